@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+class CoreConfig(AppConfig):
+    name = 'apps.core'
+
+    def ready(self):
+        # Install the search indexes of the tables created by migrate
+        from .search import install_after_migrate
+        post_migrate.connect(install_after_migrate, dispatch_uid='apps.core.search')
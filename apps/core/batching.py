@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to pass long lists of values to database queries.
+
+SQLite limits the number of parameters per query (to 999 before version
+3.32), so long ``IN`` lists have to be split over several queries there.
+PostgreSQL gets such lists as a single array parameter, other backends
+without a limit get them in one query.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import sqlite3
+from collections import OrderedDict
+
+from django.db import connections, router, DEFAULT_DB_ALIAS
+from django.db.models import Field, ForeignObject
+from django.db.models.fields.related_lookups import RelatedIn
+from django.db.models.lookups import In
+
+"""
+Number of parameters left for the rest of a query when computing batch sizes
+"""
+RESERVED_PARAMS = 19
+
+"""
+Number of distinct values from which on :func:`resolve` joins against a
+temporary table instead of filtering with ``IN`` lists
+"""
+TEMP_TABLE_THRESHOLD = 1000
+
+
+@Field.register_lookup
+class AnyIn(In):
+    """
+    ``IN`` lookup that passes the values as one array parameter on PostgreSQL,
+    i.e. ``field = ANY(%s)``. On all other backends it behaves like ``in``.
+    """
+    lookup_name = 'any_in'
+
+    def as_postgresql(self, compiler, connection):
+        if not self.rhs_is_direct_value():
+            return self.as_sql(compiler, connection)
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        _, rhs_params = self.process_rhs(compiler, connection)
+        return '%s = ANY(%%s)' % lhs, list(lhs_params) + [list(rhs_params)]
+
+
+@ForeignObject.register_lookup
+class RelatedAnyIn(RelatedIn, AnyIn):
+    """
+    ``any_in`` lookup for foreign keys, accepting model instances as values.
+    """
+    pass
+
+
+def max_query_params(using=DEFAULT_DB_ALIAS):
+    """
+    Return the maximum number of parameters per query of a database.
+
+    Args:
+        using (str):
+            The database alias.
+
+    Returns:
+        The number of parameters, or ``None`` if there is no limit.
+
+    """
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        connection.ensure_connection()
+        try:
+            return connection.connection.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+        except AttributeError:
+            # Connection.getlimit() requires Python 3.11
+            return 999 if sqlite3.sqlite_version_info < (3, 32) else 32766
+    return connection.features.max_query_params
+
+
+def batch_size(using=DEFAULT_DB_ALIAS, params_per_item=1):
+    """
+    Return the number of list items that can be passed to a single query.
+
+    Args:
+        using (str):
+            The database alias.
+        params_per_item (int):
+            Number of query parameters needed per item, e.g. 2 if the items
+            are split between two ``IN`` clauses.
+
+    Returns:
+        The number of items, or ``None`` if there is no limit.
+
+    """
+    limit = max_query_params(using)
+    if limit is None:
+        return None
+    return max(1, (limit - RESERVED_PARAMS) // params_per_item)
+
+
+def batches(items, size):
+    """
+    Split a list into slices of the given size.
+
+    Args:
+        items (list):
+            The list to split.
+        size (int):
+            The maximum number of items per slice, ``None`` for no limit.
+
+    Returns:
+        A list of slices, empty for an empty list.
+
+    """
+    if not size:
+        return [items] if items else []
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def filter_in(queryset, filter_field, filter_list, size=None):
+    """
+    Select the items of a queryset filtered by a long list of values.
+
+    The list is split into as few queries as the database allows, on
+    PostgreSQL a single query with an array parameter is used.
+
+    Args:
+        queryset:
+            The base queryset.
+        filter_field (str):
+            The field to filter on.
+        filter_list (list):
+            The values to filter by.
+        size (int):
+            Number of values per query, determined from the database by default.
+
+    Returns:
+        A list containing the items of all queries.
+
+    """
+    if size is None:
+        size = batch_size(queryset.db)
+    out = []
+    for filter_slice in batches(list(filter_list), size):
+        out.extend(queryset.filter(**{filter_field + '__any_in': filter_slice}))
+    return out
+
+
+def resolve(model, field_name, values, temp_table=None, key_field=None, key=None):
+    """
+    Resolve a list of field values to the primary keys of the matching objects.
+
+    Short lists are looked up with ``IN`` filters. Long lists are loaded into
+    a temporary table and resolved with a single outer join, which yields
+    the missing values in the same pass.
+
+    Args:
+        model:
+            The model class to look up.
+        field_name (str):
+            The field the values belong to.
+        values (list):
+            The values to resolve, duplicates are ignored.
+        temp_table (bool):
+            Whether to use a temporary table, by default only if there are
+            more than ``TEMP_TABLE_THRESHOLD`` distinct values.
+        key_field (str):
+            An indexed field derived from ``field_name`` to look up by
+            instead, e.g. a hash. Matches are verified against the values.
+        key (callable):
+            Function computing the ``key_field`` value of a value.
+
+    Returns:
+        A tuple ``(found, missing)`` of a dict mapping the values to primary
+        keys and a list of the values without object, in input order.
+
+    """
+    values = list(OrderedDict.fromkeys(values))
+    using = router.db_for_read(model)
+    if temp_table is None:
+        temp_table = len(values) > TEMP_TABLE_THRESHOLD
+
+    if temp_table:
+        rows = _join_temp_table(model, field_name, values, using, key_field, key)
+        found = {value: pk for value, pk in rows if pk is not None}
+    else:
+        queryset = model.objects.using(using).values_list(field_name, 'pk')
+        if key_field is None:
+            found = dict(filter_in(queryset, field_name, values))
+        else:
+            keys = list(OrderedDict.fromkeys(key(value) for value in values))
+            wanted = set(values)
+            found = {value: pk for value, pk in filter_in(queryset, key_field, keys)
+                     if value in wanted}
+    return found, [value for value in values if value not in found]
+
+
+def _join_temp_table(model, field_name, values, using, key_field=None, key=None):
+    """
+    Load values into a temporary table and outer join it with a model table.
+
+    Returns:
+        A list of ``(value, pk)`` tuples, ``pk`` is ``None`` for values
+        without matching object.
+
+    """
+    if not values:
+        return []
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    field = model._meta.get_field(field_name)
+    table = qn('tmp_%s_%s' % (model._meta.db_table, field.column))
+    columns = ['value %s NOT NULL' % field.db_type(connection)]
+    join = 't.%s = v.value' % qn(field.column)
+    rows = [(value,) for value in values]
+    if key_field is not None:
+        key_column = model._meta.get_field(key_field)
+        columns.append('value_key %s NOT NULL' % key_column.db_type(connection))
+        join = 't.%s = v.value_key AND %s' % (qn(key_column.column), join)
+        rows = [(value, key(value)) for value in values]
+
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % table)
+        cursor.execute('CREATE TEMPORARY TABLE %s (%s)' % (table, ', '.join(columns)))
+        placeholders = ', '.join(['%s'] * len(columns))
+        if connection.vendor == 'postgresql':
+            cursor.execute('INSERT INTO %s SELECT * FROM unnest(%s)' % (table, placeholders),
+                           [list(column) for column in zip(*rows)])
+        else:
+            cursor.executemany('INSERT INTO %s VALUES (%s)' % (table, placeholders), rows)
+        cursor.execute('SELECT v.value, t.%s FROM %s v LEFT OUTER JOIN %s t ON %s' %
+                       (qn(model._meta.pk.column), table, qn(model._meta.db_table), join))
+        rows = cursor.fetchall()
+        cursor.execute('DROP TABLE %s' % table)
+    return rows
@@ -3,6 +3,7 @@ from __future__ import print_function, division, absolute_import, unicode_litera
 
 import binascii
 import calendar
+import zlib
 from datetime import datetime
 
 from django.db import models
@@ -38,6 +39,49 @@ class HashField(models.BinaryField):
         return binascii.unhexlify(bytes(value, 'ascii'))
 
 
+"""
+zlib compression level used by the CompressedTextField
+"""
+COMPRESSION_LEVEL = 6
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Custom field type to store large texts zlib compressed
+
+    Values that were stored uncompressed (e.g. before the column was
+    converted) are returned as they are.
+    """
+    def from_db_value(self, value, expression, connection, *args, **kwargs):
+        return self.to_python(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if self.is_compressed(value):
+            try:
+                value = zlib.decompress(value)
+            except zlib.error:
+                pass  # Uncompressed text that happens to look like a zlib header
+        return value.decode('utf-8')
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return zlib.compress(bytes(value, 'utf-8'), COMPRESSION_LEVEL)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+    @staticmethod
+    def is_compressed(value):
+        """
+        Check whether a raw database value starts with a zlib header.
+        """
+        return len(value) >= 2 and value[0] == 0x78 and (value[0] << 8 | value[1]) % 31 == 0
+
+
 class EpochField(models.IntegerField):
     """
     Custom field type for unix timestamps.
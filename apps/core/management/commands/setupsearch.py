@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Custom manage.py command to install the search indexes.
+
+Usage: ./manage.py setupsearch [--rebuild | --drop]
+
+Creates the pg_trgm indexes on PostgreSQL or the FTS5 tables on SQLite,
+e.g. for a database created by strongSwan instead of migrate. The FTS5 tables
+are updated by triggers, so strongSwan's SQLite needs FTS5 with the trigram
+tokenizer (SQLite 3.34 or later) to write to the database. Otherwise they can
+be removed again with ``--drop``.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from apps.core import search
+
+
+class Command(BaseCommand):
+    """
+    Required class to be recognized by manage.py.
+    """
+    help = 'Install the indexes used to search names, paths and IDs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='The database to install the indexes in.')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Refill existing FTS5 tables (SQLite only).')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop the FTS5 tables and their triggers (SQLite only).')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['drop']:
+            count = search.uninstall(kwargs['database'])
+            self.stdout.write('Dropped {0} search indexes'.format(count))
+            return
+        count = search.install(kwargs['database'], rebuild=kwargs['rebuild'])
+        self.stdout.write('Installed {0} search indexes'.format(count))
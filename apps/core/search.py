@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Indexed case-insensitive substring search.
+
+Filter with the ``substring`` lookup instead of ``icontains`` on the fields
+listed in ``SEARCH_FIELDS``, e.g. ``File.objects.filter(name__substring=q)``.
+
+On PostgreSQL the lookup compiles to ``ILIKE``, which uses a pg_trgm GIN
+index. On SQLite it matches against an FTS5 shadow table with the trigram
+tokenizer, kept in sync with the model table by triggers (so rows written by
+strongSwan are indexed too). Terms shorter than three characters, fields
+without index and other backends fall back to ``icontains``.
+
+The indexes are installed after ``migrate`` or by ``./manage.py setupsearch``,
+which also restores triggers dropped since (e.g. when a migration remade the
+table). Where they cannot be created (SQLite before 3.34 has no trigram
+tokenizer, creating the pg_trgm extension needs privileges), a warning is
+logged and the fields are searched without index.
+
+On SQLite the triggers run in every program writing to the database, so the
+SQLite library used by strongSwan needs FTS5 with the trigram tokenizer too,
+otherwise its inserts fail. If it does not have them, drop the tables with
+``./manage.py setupsearch --drop``.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import logging
+
+from django.apps import apps
+from django.db import connections, router, transaction, DatabaseError, DEFAULT_DB_ALIAS
+from django.db.models import CharField, Lookup, TextField
+from django.db.models.expressions import Col
+from django.db.models.lookups import IContains
+
+"""
+Fields searched with the ``substring`` lookup, as (model label, field name)
+"""
+SEARCH_FIELDS = (
+    ('devices.Device', 'description'),
+    ('devices.Device', 'value'),
+    ('devices.Group', 'name'),
+    ('devices.Product', 'name'),
+    ('filesystem.Directory', 'path'),
+    ('filesystem.File', 'name'),
+    ('packages.Package', 'name'),
+    ('policies.Policy', 'name'),
+    ('swid.Entity', 'regid'),
+    ('swid.Tag', 'unique_id'),
+)
+
+"""
+Minimum length of a term matched with the trigram index
+"""
+MIN_TERM_LENGTH = 3
+
+logger = logging.getLogger(__name__)
+
+# Names of the FTS5 tables that exist per database alias
+_installed_tables = {}
+
+
+@CharField.register_lookup
+@TextField.register_lookup
+class Substring(Lookup):
+    """
+    Case-insensitive substring lookup using a search index if available.
+    """
+    lookup_name = 'substring'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        return compiler.compile(IContains(self.lhs, self.rhs))
+
+    def as_sqlite(self, compiler, connection):
+        if not self._is_term() or not isinstance(self.lhs, Col):
+            return self.as_sql(compiler, connection)
+        field = self.lhs.target
+        table = search_table(field.model, field.name)
+        if table not in get_installed_tables(connection.alias):
+            return self.as_sql(compiler, connection)
+        qn = connection.ops.quote_name
+        sql = '%s.%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' % \
+            (qn(self.lhs.alias), qn(field.model._meta.pk.column), qn(table), qn(table))
+        # Match the term as a phrase, i.e. as consecutive trigrams
+        return sql, ['"%s"' % self.rhs.replace('"', '""')]
+
+    def as_postgresql(self, compiler, connection):
+        if not isinstance(self.rhs, str):
+            return self.as_sql(compiler, connection)
+        lhs_sql, lhs_params = compiler.compile(self.lhs)
+        pattern = '%%%s%%' % connection.ops.prep_for_like_query(self.rhs)
+        return '%s ILIKE %%s' % lhs_sql, list(lhs_params) + [pattern]
+
+    def _is_term(self):
+        return isinstance(self.rhs, str) and len(self.rhs) >= MIN_TERM_LENGTH
+
+
+def search_table(model, field_name):
+    """
+    Return the name of the FTS5 table of a field.
+    """
+    column = model._meta.get_field(field_name).column
+    return '%s_%s_search' % (model._meta.db_table, column)
+
+
+def get_installed_tables(using=DEFAULT_DB_ALIAS):
+    """
+    Return the names of the FTS5 tables in a SQLite database.
+    """
+    if using not in _installed_tables:
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE %s",
+                           ['%USING fts5%'])
+            _installed_tables[using] = {row[0] for row in cursor.fetchall()}
+    return _installed_tables[using]
+
+
+def get_search_fields(app_config=None):
+    """
+    Return the searched fields as (model, field name) tuples.
+
+    Args:
+        app_config:
+            Only return the fields of this app.
+
+    """
+    fields = []
+    for label, field_name in SEARCH_FIELDS:
+        model = apps.get_model(label)
+        if app_config is None or model._meta.app_config == app_config:
+            fields.append((model, field_name))
+    return fields
+
+
+def install(using=DEFAULT_DB_ALIAS, fields=None, rebuild=False):
+    """
+    Create the search indexes of a database, if not there yet.
+
+    Args:
+        using (str):
+            The database alias.
+        fields (list):
+            The (model, field name) tuples to index, all by default.
+        rebuild (bool):
+            Whether to fill existing FTS5 tables anew.
+
+    Returns:
+        The number of indexes created or rebuilt. Indexes that cannot be
+        created are skipped with a warning.
+
+    """
+    connection = connections[using]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return 0
+    if fields is None:
+        fields = get_search_fields()
+    fields = [(model, name) for model, name in fields if router.allow_migrate_model(using, model)]
+    existing = connection.introspection.table_names()
+
+    count = 0
+    with connection.cursor() as cursor:
+        for model, field_name in fields:
+            if model._meta.db_table not in existing:
+                continue
+            try:
+                with transaction.atomic(using=using):
+                    if connection.vendor == 'postgresql':
+                        count += _install_trigram_index(cursor, connection, model, field_name)
+                    else:
+                        count += _install_fts_table(cursor, connection, model, field_name, rebuild)
+            except DatabaseError as e:
+                logger.warning('Could not install the search index of %s.%s, searching without: %s',
+                               model._meta.label, field_name, e)
+    _installed_tables.pop(using, None)
+    return count
+
+
+def _install_trigram_index(cursor, connection, model, field_name):
+    qn = connection.ops.quote_name
+    column = model._meta.get_field(field_name).column
+    cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    cursor.execute('CREATE INDEX IF NOT EXISTS %s ON %s USING gin (%s gin_trgm_ops)' %
+                   (qn('%s_%s_trgm' % (model._meta.db_table, column)), qn(model._meta.db_table), qn(column)))
+    return 1
+
+
+def _install_fts_table(cursor, connection, model, field_name, rebuild):
+    qn = connection.ops.quote_name
+    table = search_table(model, field_name)
+    values = {
+        'fts': qn(table),
+        'table': qn(model._meta.db_table),
+        'column': qn(model._meta.get_field(field_name).column),
+        'pk': qn(model._meta.pk.column),
+    }
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column}, content={table}, "
+        "content_rowid={pk}, tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS {trigger_ai} AFTER INSERT ON {table} BEGIN "
+        "INSERT INTO {fts}(rowid, {column}) VALUES (new.{pk}, new.{column}); END",
+        "CREATE TRIGGER IF NOT EXISTS {trigger_ad} AFTER DELETE ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{pk}, old.{column}); END",
+        "CREATE TRIGGER IF NOT EXISTS {trigger_au} AFTER UPDATE ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{pk}, old.{column}); "
+        "INSERT INTO {fts}(rowid, {column}) VALUES (new.{pk}, new.{column}); END",
+    ]
+    triggers = _fts_triggers(table)
+    for suffix, trigger in triggers.items():
+        values['trigger_' + suffix] = qn(trigger)
+
+    # Remaking a table (e.g. in a migration on SQLite) drops its triggers,
+    # the rows written since then are missing in the index
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+                   [model._meta.db_table])
+    complete = set(triggers.values()) <= {row[0] for row in cursor.fetchall()}
+    exists = table in connection.introspection.table_names()
+    for statement in statements:
+        cursor.execute(statement.format(**values))
+    if exists and complete and not rebuild:
+        return 0
+    cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(**values))
+    return 1
+
+
+def _fts_triggers(table):
+    return {suffix: '%s_%s' % (table, suffix) for suffix in ('ai', 'ad', 'au')}
+
+
+def uninstall(using=DEFAULT_DB_ALIAS, fields=None):
+    """
+    Drop the FTS5 tables and triggers of a SQLite database.
+
+    Once installed, the triggers need FTS5 with the trigram tokenizer in every
+    program writing to the indexed tables, e.g. also in strongSwan.
+
+    Args:
+        using (str):
+            The database alias.
+        fields (list):
+            The (model, field name) tuples to drop the index of, all by default.
+
+    Returns:
+        The number of indexes dropped.
+
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return 0
+    if fields is None:
+        fields = get_search_fields()
+    installed = get_installed_tables(using)
+
+    count = 0
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for model, field_name in fields:
+            table = search_table(model, field_name)
+            for trigger in _fts_triggers(table).values():
+                cursor.execute('DROP TRIGGER IF EXISTS %s' % connection.ops.quote_name(trigger))
+            if table in installed:
+                cursor.execute('DROP TABLE %s' % connection.ops.quote_name(table))
+                count += 1
+    _installed_tables.pop(using, None)
+    return count
+
+
+def install_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    ``post_migrate`` handler installing the search indexes of an app.
+    """
+    install(using, get_search_fields(sender))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate, post_save
+
+
+class DevicesConfig(AppConfig):
+    name = 'apps.devices'
+
+    def ready(self):
+        # Install the triggers maintaining the latest results
+        from .latest_results import install_after_migrate
+        post_migrate.connect(install_after_migrate, sender=self, dispatch_uid='apps.devices.latest_results')
+
+        # Keep the group pairs of groups stored without Group.save()
+        from .models import Group, update_group_closure, rebuild_group_closure_after_migrate
+        post_save.connect(update_group_closure, sender=Group, dispatch_uid='apps.devices.group_closure')
+        post_migrate.connect(rebuild_group_closure_after_migrate, sender=self,
+                             dispatch_uid='apps.devices.group_closure')
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Maintenance of the latest result of every device per policy.
+
+The ``latest_results`` table (model :class:`LatestResult`) is written by
+triggers on the ``results`` and ``sessions`` tables, so results inserted by
+strongSwan are covered too. Inserting a result replaces the row of its
+device and policy if the session is not older. Deleting a result or a
+session, or changing the time of a session, looks up the latest remaining
+result of the affected device and policies.
+
+The triggers are installed after ``migrate`` or by
+``./manage.py setuplatestresults``, on SQLite and PostgreSQL. Where they are
+not installed (e.g. on MySQL), the latest results are queried from the
+results instead, see :func:`is_installed`.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+# Selects the latest results of the sessions ``s`` and results ``r`` matching
+# {where}, the result with the higher ID wins between sessions of equal time
+_LATEST_SQL = (
+    "SELECT s.device, r.policy, r.session, s.time, r.rec "
+    "FROM results r JOIN sessions s ON s.id = r.session "
+    "WHERE {where} AND NOT EXISTS ("
+    "SELECT 1 FROM results r2 JOIN sessions s2 ON s2.id = r2.session "
+    "WHERE s2.device = s.device AND r2.policy = r.policy "
+    "AND (s2.time > s.time OR (s2.time = s.time AND r2.id > r.id)))"
+)
+
+_INSERT_SQL = "INSERT INTO latest_results (device_id, policy_id, session_id, time, recommendation) "
+
+# Trigger name, event, table and body statements
+_TRIGGERS = (
+    ('latest_results_result_ai', 'INSERT', 'results', [
+        _INSERT_SQL + "SELECT s.device, new.policy, new.session, s.time, new.rec "
+        "FROM sessions s WHERE s.id = new.session "
+        "ON CONFLICT (device_id, policy_id) DO UPDATE SET session_id = excluded.session_id, "
+        "time = excluded.time, recommendation = excluded.recommendation "
+        "WHERE excluded.time >= latest_results.time",
+    ]),
+    ('latest_results_result_ad', 'DELETE', 'results', [
+        "DELETE FROM latest_results WHERE policy_id = old.policy "
+        "AND device_id = (SELECT device FROM sessions WHERE id = old.session)",
+        _INSERT_SQL + _LATEST_SQL.format(
+            where="r.policy = old.policy "
+                  "AND s.device = (SELECT device FROM sessions WHERE id = old.session)"),
+    ]),
+    ('latest_results_session_ad', 'DELETE', 'sessions', [
+        "DELETE FROM latest_results WHERE session_id = old.id",
+        _INSERT_SQL + _LATEST_SQL.format(
+            where="s.device = old.device AND r.policy NOT IN "
+                  "(SELECT policy_id FROM latest_results WHERE device_id = old.device)"),
+    ]),
+    ('latest_results_session_au', 'UPDATE OF time', 'sessions', [
+        "DELETE FROM latest_results WHERE device_id = new.device "
+        "AND policy_id IN (SELECT policy FROM results WHERE session = new.id)",
+        _INSERT_SQL + _LATEST_SQL.format(
+            where="s.device = new.device "
+                  "AND r.policy IN (SELECT policy FROM results WHERE session = new.id)"),
+    ]),
+)
+
+
+# Aliases of the databases the triggers were found or installed in
+_installed = set()
+
+
+def is_installed(using=DEFAULT_DB_ALIAS):
+    """
+    Check if the triggers maintaining the latest results are installed in a
+    database, i.e. whether the ``latest_results`` table can be read.
+
+    Args:
+        using (str):
+            The database alias.
+
+    """
+    if using in _installed:
+        return True
+    connection = connections[using]
+    names = [name for name, _, _, _ in _TRIGGERS]
+    if connection.vendor == 'sqlite':
+        sql = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s)"
+    elif connection.vendor == 'postgresql':
+        sql = "SELECT COUNT(DISTINCT tgname) FROM pg_trigger WHERE tgname IN (%s)"
+    else:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(sql % ', '.join(['%s'] * len(names)), names)
+        if cursor.fetchone()[0] < len(names):
+            return False
+    _installed.add(using)
+    return True
+
+
+def install(using=DEFAULT_DB_ALIAS, rebuild=False):
+    """
+    Create the triggers maintaining the latest results of a database, if not
+    there yet, and fill the table if it is empty.
+
+    Args:
+        using (str):
+            The database alias.
+        rebuild (bool):
+            Whether to fill the table anew even if it is not empty.
+
+    Returns:
+        The number of latest results filled in, ``None`` if the table was
+        not filled.
+
+    """
+    connection = connections[using]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return None
+    existing = connection.introspection.table_names()
+    if not {'latest_results', 'results', 'sessions'} <= set(existing):
+        return None
+
+    with connection.cursor() as cursor:
+        for name, event, table, statements in _TRIGGERS:
+            if connection.vendor == 'postgresql':
+                _install_pg_trigger(cursor, name, event, table, statements)
+            else:
+                cursor.execute('CREATE TRIGGER IF NOT EXISTS %s AFTER %s ON %s FOR EACH ROW BEGIN %s; END' %
+                               (name, event, table, '; '.join(statements)))
+        _installed.add(using)
+
+        cursor.execute('SELECT 1 FROM latest_results LIMIT 1')
+        if cursor.fetchone() and not rebuild:
+            return None
+        cursor.execute('DELETE FROM latest_results')
+        cursor.execute(_INSERT_SQL + _LATEST_SQL.format(where='1 = 1'))
+        return cursor.rowcount
+
+
+def _install_pg_trigger(cursor, name, event, table, statements):
+    cursor.execute('CREATE OR REPLACE FUNCTION %s() RETURNS trigger AS $$ BEGIN %s; RETURN NULL; END $$ '
+                   'LANGUAGE plpgsql' % (name, '; '.join(statements)))
+    cursor.execute('DROP TRIGGER IF EXISTS %s ON %s' % (name, table))
+    cursor.execute('CREATE TRIGGER %s AFTER %s ON %s FOR EACH ROW EXECUTE PROCEDURE %s()' %
+                   (name, event, table, name))
+
+
+def install_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    ``post_migrate`` handler installing the triggers of the latest results.
+    """
+    install(using)
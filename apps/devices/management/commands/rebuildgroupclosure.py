@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Custom manage.py command to compute the ancestor/descendant pairs of all
+groups anew.
+
+Usage: ./manage.py rebuildgroupclosure
+
+Needed after groups were inserted or moved in SQL, which does not update
+the pairs.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from apps.devices.models import GroupClosure
+
+
+class Command(BaseCommand):
+    """
+    Required class to be recognized by manage.py.
+    """
+    help = 'Compute the ancestor/descendant pairs of all groups anew.'
+
+    def handle(self, *args, **kwargs):
+        count = GroupClosure.rebuild()
+        self.stdout.write('Rebuilt the group closure with {0} pairs'.format(count))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Custom manage.py command to install the triggers maintaining the latest
+result of every device per policy.
+
+Usage: ./manage.py setuplatestresults [--rebuild]
+
+Needed for a database whose ``results`` table was created by strongSwan
+after migrate ran, fills the table from the existing results.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from apps.devices import latest_results
+
+
+class Command(BaseCommand):
+    """
+    Required class to be recognized by manage.py.
+    """
+    help = 'Install the triggers maintaining the latest result of every device per policy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='The database to install the triggers in.')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Fill the latest results anew.')
+
+    def handle(self, *args, **kwargs):
+        count = latest_results.install(kwargs['database'], rebuild=kwargs['rebuild'])
+        if count is None:
+            self.stdout.write('Installed the latest result triggers')
+        else:
+            self.stdout.write('Installed the latest result triggers, filled in {0} results'.format(count))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_group_closure(apps, schema_editor):
+    Group = apps.get_model('devices', 'Group')
+    GroupClosure = apps.get_model('devices', 'GroupClosure')
+
+    parents = dict(Group.objects.values_list('pk', 'parent_id'))
+    pairs = []
+    for pk in parents:
+        ancestor_id, depth = pk, 0
+        while ancestor_id is not None and depth <= len(parents):
+            pairs.append(GroupClosure(ancestor_id=ancestor_id, descendant_id=pk, depth=depth))
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+    GroupClosure.objects.bulk_create(pairs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0002_device_inactive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(help_text='The number of levels between the groups')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                               related_name='descendant_links', to='devices.group')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                 related_name='ancestor_links', to='devices.group')),
+            ],
+            options={
+                'db_table': 'groups_closure',
+                'unique_together': {('descendant', 'ancestor')},
+            },
+        ),
+        migrations.RunPython(fill_group_closure, migrations.RunPython.noop),
+    ]
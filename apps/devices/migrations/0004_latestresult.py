@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import apps.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '__first__'),
+        ('policies', '__first__'),
+        ('devices', '0003_groupclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('time', apps.core.fields.EpochField(help_text='The time of the session')),
+                ('recommendation', models.IntegerField(choices=[(0, 'Allow'), (1, 'Block'), (2, 'Isolate'),
+                                                                (3, 'None')])),
+                ('device', models.ForeignKey(db_constraint=False,
+                                             on_delete=django.db.models.deletion.DO_NOTHING,
+                                             related_name='latest_results', to='devices.device')),
+                ('policy', models.ForeignKey(db_constraint=False,
+                                             on_delete=django.db.models.deletion.DO_NOTHING,
+                                             related_name='latest_results', to='policies.policy')),
+                ('session', models.ForeignKey(db_constraint=False,
+                                              on_delete=django.db.models.deletion.DO_NOTHING,
+                                              related_name='+', to='core.session')),
+            ],
+            options={
+                'db_table': 'latest_results',
+                'unique_together': {('device', 'policy')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='latestresult',
+            index=models.Index(fields=['policy', 'time'], name='latest_resu_policy__25aa09_idx'),
+        ),
+    ]
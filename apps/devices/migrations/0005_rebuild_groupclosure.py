@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def rebuild_group_closure(apps, schema_editor):
+    # Groups loaded from fixtures or inserted in SQL after 0003 have no pairs
+    Group = apps.get_model('devices', 'Group')
+    GroupClosure = apps.get_model('devices', 'GroupClosure')
+
+    parents = dict(Group.objects.values_list('pk', 'parent_id'))
+    pairs = []
+    for pk in parents:
+        ancestor_id, depth = pk, 0
+        while ancestor_id in parents and depth <= len(parents):
+            pairs.append(GroupClosure(ancestor_id=ancestor_id, descendant_id=pk, depth=depth))
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+    GroupClosure.objects.all().delete()
+    GroupClosure.objects.bulk_create(pairs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0004_latestresult'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_group_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0005_rebuild_groupclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PolicyPlanVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('version', models.CharField(max_length=32)),
+            ],
+            options={
+                'db_table': 'policy_plan_version',
+            },
+        ),
+    ]
@@ -1,15 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
 
-from datetime import timedelta, datetime
+from datetime import datetime, timedelta
 
+from django.db import connections, models, router, transaction, DEFAULT_DB_ALIAS
 from django.utils import timezone
-from django.db import models
 
 from apps.core.fields import EpochField
 from apps.core.models import Result
-from apps.core.types import Action
+from apps.core.types import Action, ACTION_CHOICES
+from apps.policies.plans import create_work_items, invalidate_policy_plans, is_due
 from apps.swid.models import TagStats
+from . import latest_results
 
 
 class Product(models.Model):
@@ -65,15 +67,10 @@ class Device(models.Model):
 
     def get_group_set(self):
         """
-        Get all groups of the device
+        Get all groups of the device, including the inherited ones
         """
-        groups = []
-        for g in self.groups.all():
-            groups.append(g)
-            groups += g.get_parents()
-
-        groups = set(groups)
-        return groups
+        memberships = Group.devices.through.objects.filter(device=self).values('group_id')
+        return set(Group.objects.filter(descendant_links__descendant__in=memberships).distinct())
 
     def get_inherit_set(self):
         """
@@ -90,48 +87,44 @@ class Device(models.Model):
         Check if the device needs to perform the measurement defined by the
         enforcement
         """
-        try:
-            result = Result.objects.filter(session__device=self,
-                                           policy=enforcement.policy).latest()
-        except Result.DoesNotExist:
-            return True
+        if not latest_results.is_installed(router.db_for_read(LatestResult)):
+            try:
+                result = Result.objects.filter(session__device=self,
+                                               policy=enforcement.policy).latest()
+            except Result.DoesNotExist:
+                return True
 
-        deadline = timezone.now() - timedelta(seconds=enforcement.max_age)
+            return is_due(enforcement.max_age, result.session.time, result.recommendation == Action.ALLOW)
 
-        if result.session.time < deadline or (result.recommendation != Action.ALLOW):
+        try:
+            latest = LatestResult.objects.get(device=self, policy_id=enforcement.policy_id)
+        except LatestResult.DoesNotExist:
             return True
 
-        return False
+        return is_due(enforcement.max_age, latest.time, latest.recommendation == Action.ALLOW)
 
     def create_work_items(self, session):
         """
-        Creates workitems for every policy that is due
+        Creates workitems for every policy that is due, see
+        :func:`apps.policies.plans.create_work_items`
         """
-
-        enforcements = []
-        for group in self.get_group_set():
-            enforcements += group.enforcements.all()
-
-        minforcements = []
-
-        while enforcements:
-            emin = enforcements.pop()
-            for e in enforcements:
-                if emin.policy == e.policy:
-                    emin = min(emin, e, key=lambda x: x.max_age)
-                    if emin == e:
-                        enforcements.remove(e)
-
-            minforcements.append(emin)
-
-        for enforcement in minforcements:
-            if self.is_due_for(enforcement):
-                enforcement.policy.create_work_item(enforcement, session)
+        if session.device_id != self.pk:
+            raise ValueError('The session belongs to another device')
+        create_work_items([session])
 
     def get_sessions_in_range(self, from_timestamp, to_timestamp):
+        dt_from, dt_to = self.get_day_range(from_timestamp, to_timestamp)
+        return self.sessions.filter(time__gte=dt_from, time__lte=dt_to).order_by('-time')
+
+    @staticmethod
+    def get_day_range(from_timestamp, to_timestamp):
+        """
+        Return the start of the first and the end of the last day of a
+        time range given as Unix timestamps.
+        """
         dt_from = datetime.utcfromtimestamp(from_timestamp).replace(hour=0, minute=0, second=0)
         dt_to = datetime.utcfromtimestamp(to_timestamp).replace(hour=23, minute=59, second=59)
-        return self.sessions.filter(time__gte=dt_from, time__lte=dt_to).order_by('-time')
+        return dt_from, dt_to
 
     def get_vulnerabilities(self):
         return TagStats.objects.exclude(first_installed=None).filter(last_deleted=None,
@@ -165,20 +158,182 @@ class Group(models.Model):
         """
         return self.name
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=router.db_for_write(Group, instance=self)):
+            super(Group, self).save(*args, **kwargs)
+            # Renames do not change the policy plans of the members
+            if GroupClosure.update(self):
+                invalidate_policy_plans()
+
     def get_parents(self):
         """
-        Recursively get all parent groups.
+        Get all parent groups, starting with the closest one.
         """
-        if not self.parent:
-            return []
-        return [self.parent] + self.parent.get_parents()
+        return list(Group.objects.filter(descendant_links__descendant=self, descendant_links__depth__gt=0)
+                    .order_by('descendant_links__depth'))
 
     def get_children(self):
         """
-        Recursively get all child groups.
+        Get all child groups, level by level.
         """
-        result = list(Group.objects.filter(parent=self))
-        for child in result:
-            result += list(child.get_children())
+        return list(Group.objects.filter(ancestor_links__ancestor=self, ancestor_links__depth__gt=0)
+                    .order_by('ancestor_links__depth', 'name'))
 
-        return result
+
+class GroupClosure(models.Model):
+    """
+    Ancestor/descendant pair of groups, including the pair of every group with
+    itself at depth 0, so group hierarchies are resolved in a single query.
+    """
+    ancestor = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField(help_text='The number of levels between the groups')
+
+    class Meta(object):
+        db_table = 'groups_closure'
+        unique_together = ('descendant', 'ancestor')
+
+    @classmethod
+    def update(cls, group):
+        """
+        Update the pairs of a group and its children after the group was
+        saved, if it is new or got another parent.
+
+        Args:
+            group (Group):
+                The saved group.
+
+        Returns:
+            True if the pairs changed, False if the group kept its parent.
+
+        """
+        links = cls.objects.filter(descendant=group, depth__lte=1).values_list('ancestor_id', 'depth')
+        links = {depth: ancestor_id for ancestor_id, depth in links}
+        if 0 in links and links.get(1) == group.parent_id:
+            return False
+
+        # Move the subtree below the new parent
+        subtree = {group.pk: 0}
+        subtree.update(cls.objects.filter(ancestor=group).values_list('descendant_id', 'depth'))
+        ancestors = []
+        if group.parent_id is not None:
+            ancestors = cls.objects.filter(descendant_id=group.parent_id)
+            ancestors = list(ancestors.values_list('ancestor_id', 'depth'))
+            if any(ancestor_id in subtree for ancestor_id, _ in ancestors):
+                raise ValueError('A group cannot be moved below itself or its children')
+
+        cls.objects.filter(descendant__in=list(subtree)).exclude(ancestor__in=list(subtree)).delete()
+        pairs = [cls(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth + 1 + offset)
+                 for ancestor_id, depth in ancestors for descendant_id, offset in subtree.items()]
+        if 0 not in links:
+            pairs.append(cls(ancestor=group, descendant=group, depth=0))
+        cls.objects.bulk_create(pairs)
+        return True
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Compute all pairs anew from the parents of the groups.
+
+        Returns:
+            The number of pairs.
+
+        """
+        parents = dict(Group.objects.values_list('pk', 'parent_id'))
+        pairs = []
+        for pk in parents:
+            # Parents not stored yet (e.g. further down in a fixture) end the chain
+            ancestor_id, depth = pk, 0
+            while ancestor_id in parents and depth <= len(parents):
+                pairs.append(cls(ancestor_id=ancestor_id, descendant_id=pk, depth=depth))
+                ancestor_id, depth = parents[ancestor_id], depth + 1
+        cls.objects.all().delete()
+        cls.objects.bulk_create(pairs, batch_size=1000)
+        return len(pairs)
+
+    @classmethod
+    def is_complete(cls):
+        """
+        Check if every group has its pair with itself, i.e. no group was
+        stored without updating the pairs (e.g. inserted in SQL).
+        """
+        return not Group.objects.exclude(ancestor_links__depth=0).exists()
+
+
+def update_group_closure(sender, instance, raw=False, **kwargs):
+    """
+    ``post_save`` handler computing the group pairs anew after a group was
+    loaded from a fixture, which does not call :meth:`Group.save`.
+    """
+    if raw:
+        GroupClosure.rebuild()
+        invalidate_policy_plans()
+
+
+def rebuild_group_closure_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    ``post_migrate`` handler computing the group pairs anew if groups were
+    stored without them.
+    """
+    if not router.allow_migrate_model(using, GroupClosure):
+        return
+    tables = connections[using].introspection.table_names()
+    if GroupClosure._meta.db_table in tables and not GroupClosure.is_complete():
+        GroupClosure.rebuild()
+
+
+class LatestResult(models.Model):
+    """
+    The latest result of a device for a policy, with the time of its session.
+
+    Written by database triggers only, see :mod:`apps.devices.latest_results`.
+    The foreign keys have no constraints, the triggers also remove the rows of
+    deleted results and sessions. Without the triggers (e.g. on MySQL) the
+    table stays empty.
+    """
+    device = models.ForeignKey(Device, on_delete=models.DO_NOTHING, db_constraint=False,
+                               related_name='latest_results')
+    policy = models.ForeignKey('policies.Policy', on_delete=models.DO_NOTHING, db_constraint=False,
+                               related_name='latest_results')
+    session = models.ForeignKey('core.Session', on_delete=models.DO_NOTHING, db_constraint=False,
+                                related_name='+')
+    time = EpochField(help_text='The time of the session')
+    recommendation = models.IntegerField(choices=ACTION_CHOICES)
+
+    class Meta(object):
+        db_table = 'latest_results'
+        unique_together = ('device', 'policy')
+        indexes = [models.Index(fields=['policy', 'time'])]
+
+    @classmethod
+    def get_overdue(cls, policy, max_age):
+        """
+        Get the latest results of a policy that are older than max_age, i.e.
+        the devices that are overdue for the policy, oldest first. Requires
+        the triggers, see :func:`apps.devices.latest_results.is_installed`.
+
+        Args:
+            policy (Policy):
+                The policy.
+            max_age (int):
+                The maximum age of a result in seconds.
+
+        """
+        deadline = timezone.now() - timedelta(seconds=max_age)
+        return cls.objects.filter(policy=policy, time__lt=deadline).select_related('device') \
+            .order_by('time', 'device_id')
+
+
+class PolicyPlanVersion(models.Model):
+    """
+    The version of the compiled policy plans, see :mod:`apps.policies.plans`.
+
+    A single row, set to a new random value when a policy, enforcement,
+    group or group membership changes, so all processes drop their cached
+    plans. Unlike a counter, the value of a rolled back change is not
+    used again.
+    """
+    version = models.CharField(max_length=32)
+
+    class Meta(object):
+        db_table = 'policy_plan_version'
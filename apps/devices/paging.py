@@ -6,21 +6,21 @@ import math
 from .models import Device, Product
 from apps.core.models import Session
 from apps.swid.models import Event
-from apps.front.paging import ProducerFactory
+from apps.front.paging import ProducerFactory, keyset_page
 
 
 # PAGING PRODUCER
 
-device_producer_factory = ProducerFactory(Device, 'description__icontains')
+device_producer_factory = ProducerFactory(Device, 'description__substring')
 
-product_producer_factory = ProducerFactory(Product, 'name__icontains')
+product_producer_factory = ProducerFactory(Product, 'name__substring', keyset=True)
 
 
 def device_session_list_producer(from_idx, to_idx, filter_query, dynamic_params=None,
-                                                                  static_params=None):
+                                                                  static_params=None, cursor=None):
     device_id = dynamic_params['device_id']
     session_list = Session.objects.filter(device=device_id)
-    return session_list[from_idx:to_idx]
+    return keyset_page(session_list, ('-time', '-pk'), from_idx, to_idx, cursor)
 
 
 def device_session_stat_producer(page_size, filter_query, dynamic_params=None,
@@ -83,6 +83,8 @@ device_list_paging = {
     'template_name': 'front/paging/default_list',
     'list_producer': device_producer_factory.list(),
     'stat_producer': device_producer_factory.stat(),
+    'page_producer': device_producer_factory.page(),
+    'count_models': (Device,),
     'static_producer_args': None,
     'var_name': 'object_list',
     'url_name': 'devices:device_detail',
@@ -93,6 +95,9 @@ product_list_paging = {
     'template_name': 'front/paging/default_list',
     'list_producer': product_producer_factory.list(),
     'stat_producer': product_producer_factory.stat(),
+    'page_producer': product_producer_factory.page(),
+    'keyset': True,
+    'count_models': (Product,),
     'static_producer_args': None,
     'var_name': 'object_list',
     'url_name': 'devices:product_detail',
@@ -111,6 +116,7 @@ device_session_list_paging = {
     'template_name': 'devices/paging/device_report_sessions',
     'list_producer': device_session_list_producer,
     'stat_producer': device_session_stat_producer,
+    'keyset': True,
     'static_producer_args': None,
     'var_name': 'sessions',
     'url_name': 'devices:session_detail',
@@ -56,7 +56,7 @@ def product(request, productID):
             context['has_dependencies'] = True
             context['versions'] = versions
 
-        parent_groups = set([p for g in defaults for p in g.get_parents()] + list(defaults))
+        parent_groups = Group.objects.filter(descendant_links__descendant__in=defaults)
         enforcements = Enforcement.objects.filter(group__in=parent_groups).order_by('policy', 'group')
         context['enforcements'] = enforcements
 
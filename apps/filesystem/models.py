@@ -62,15 +62,15 @@ class File(models.Model):
 
         # collecting the data from two tables
         if file_part and not path_part:
-            files = cls.objects.filter(name__icontains=file_part)
-            dirs = Directory.objects.filter(path__icontains=file_part)
+            files = cls.objects.filter(name__substring=file_part)
+            dirs = Directory.objects.filter(path__substring=file_part)
 
         if path_part and not file_part:
-            dirs = Directory.objects.filter(path__icontains=path_part)
+            dirs = Directory.objects.filter(path__substring=path_part)
 
         if path_part and file_part:
-            files = cls.objects.filter(name__icontains=file_part)
-            dirs = Directory.objects.filter(path__icontains=search_term)
+            files = cls.objects.filter(name__substring=file_part)
+            dirs = Directory.objects.filter(path__substring=search_term)
 
         resulting_files = []
 
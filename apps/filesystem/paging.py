@@ -4,18 +4,33 @@ from __future__ import print_function, division, absolute_import, unicode_litera
 import math
 
 from .models import Directory, File
-from apps.front.paging import ProducerFactory
+from apps.front.paging import ProducerFactory, keyset_page, page_with_count
 
 # PAGING PRODUCER
 
-directory_producer_factory = ProducerFactory(Directory, 'path__icontains')
+directory_producer_factory = ProducerFactory(Directory, 'path__substring', keyset=True)
 
 
-def file_list_producer(from_idx, to_idx, filter_query, dynamic_params=None, static_params=None):
-    file_list = File.objects.all().order_by('directory', 'name')
+"""
+Keyset ordering of the file list, by path
+"""
+FILE_LIST_ORDERING = ('directory__path', 'name', 'pk')
+
+
+def file_list_producer(from_idx, to_idx, filter_query, dynamic_params=None, static_params=None, cursor=None):
     if filter_query:
-        file_list = File.filter(filter_query, order_by=('directory', 'name'))
-    return file_list[from_idx:to_idx]
+        file_list = File.filter(filter_query, order_by=FILE_LIST_ORDERING)
+        return file_list[from_idx:to_idx]
+    return keyset_page(File.objects.all(), FILE_LIST_ORDERING, from_idx, to_idx, cursor)
+
+
+def file_page_producer(from_idx, to_idx, filter_query, dynamic_params=None, static_params=None):
+    if filter_query:
+        file_list = File.filter(filter_query, order_by=FILE_LIST_ORDERING)
+        if isinstance(file_list, list):
+            return file_list[from_idx:to_idx], len(file_list)
+        return page_with_count(file_list, from_idx, to_idx)
+    return page_with_count(File.objects.all(), from_idx, to_idx, FILE_LIST_ORDERING)
 
 
 def file_stat_producer(page_size, filter_query, dynamic_params=None, static_params=None):
@@ -56,6 +71,9 @@ dir_list_paging = {
     'template_name': 'front/paging/default_list',
     'list_producer': directory_producer_factory.list(),
     'stat_producer': directory_producer_factory.stat(),
+    'page_producer': directory_producer_factory.page(),
+    'keyset': True,
+    'count_models': (Directory,),
     'static_producer_args': None,
     'var_name': 'object_list',
     'url_name': 'filesystem:directory_detail',
@@ -74,6 +92,9 @@ file_list_paging = {
     'template_name': 'front/paging/default_list',
     'list_producer': file_list_producer,
     'stat_producer': file_stat_producer,
+    'page_producer': file_page_producer,
+    'keyset': True,
+    'count_models': (File, Directory),
     'static_producer_args': None,
     'var_name': 'object_list',
     'url_name': 'filesystem:file_detail',
@@ -2,6 +2,7 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 
 import json
+import math
 
 from django.template.loader import render_to_string
 
@@ -10,6 +11,7 @@ from django.views.decorators.http import require_POST
 
 from apps.core.decorators import ajax_login_required
 from . import paging as paging_functions
+from .search import SEARCH_CATEGORIES, search_category
 from apps.swid.paging import regid_detail_paging, regid_list_paging, swid_list_paging
 from apps.swid.paging import swid_inventory_list_paging, swid_log_list_paging
 from apps.swid.paging import swid_inventory_session_paging
@@ -23,6 +25,38 @@ from apps.devices.paging import device_vulnerability_list_paging
 from apps.tpm.paging import tpm_devices_list_paging
 
 
+"""
+Paging configs by name. A config holds values such as the list/stat-producer,
+template_name, var_name, url_name, page_size and so on. An optional
+page_producer returns the elements and their total count at once, the count
+is cached if the config lists the count_models it depends on. With keyset
+set, the list_producer takes the cursor of the page shown before.
+"""
+PAGING_CONFIGS = {
+    'regid_list_config': regid_list_paging,
+    'regid_detail_config': regid_detail_paging,
+    'swid_list_config': swid_list_paging,
+    'dir_list_config': dir_list_paging,
+    'file_list_config': file_list_paging,
+    'policy_list_config': policy_list_paging,
+    'enforcement_list_config': enforcement_list_paging,
+    'package_list_config': package_list_paging,
+    'device_list_config': device_list_paging,
+    'product_list_config': product_list_paging,
+    'device_session_list_config': device_session_list_paging,
+    'device_event_list_config': device_event_list_paging,
+    'device_vulnerability_list_config': device_vulnerability_list_paging,
+    'swid_inventory_list_config': swid_inventory_list_paging,
+    'swid_log_list_config': swid_log_list_paging,
+    'swid_inventory_session_list_config': swid_inventory_session_paging,
+    'dir_file_list_config': dir_file_list_paging,
+    'swid_files_list_config': swid_files_list_paging,
+    'product_devices_list_config': product_devices_list_paging,
+    'swid_devices_list_config': swid_devices_list_paging,
+    'tpm_devices_list_config': tpm_devices_list_paging,
+}
+
+
 @require_POST
 @ajax_login_required
 def paging(request):
@@ -48,11 +82,16 @@ def paging(request):
         producer_args (dict):
             Dictionary with dynamic custom arguments which are passed to the producers.
 
+        cursor (str):
+            Opaque cursor of the page shown before, as returned by the last request.
+            Keyset paged lists seek the previous/next page relative to it.
+
     Returns:
         A json object:
         {
             current_page: <The current page index, 0 based>,
             page_count: <Number of pages (might change when filtered)>,
+            cursor: <Opaque cursor of this page, null if not keyset paged>,
             html: <The rendered template (only provided if stats_only == False>
         }
 
@@ -62,49 +101,44 @@ def paging(request):
     filter_query = request.POST.get('filter_query')
     pager_id = int(request.POST.get('pager_id'))
     producer_args = json.loads(request.POST.get('producer_args'))
-    # TODO: extract this to somewhere else
-    # register configs
-    paging_conf_dict = {
-        'regid_list_config': regid_list_paging,
-        'regid_detail_config': regid_detail_paging,
-        'swid_list_config': swid_list_paging,
-        'dir_list_config': dir_list_paging,
-        'file_list_config': file_list_paging,
-        'policy_list_config': policy_list_paging,
-        'enforcement_list_config': enforcement_list_paging,
-        'package_list_config': package_list_paging,
-        'device_list_config': device_list_paging,
-        'product_list_config': product_list_paging,
-        'device_session_list_config': device_session_list_paging,
-        'device_event_list_config': device_event_list_paging,
-        'device_vulnerability_list_config': device_vulnerability_list_paging,
-        'swid_inventory_list_config': swid_inventory_list_paging,
-        'swid_log_list_config': swid_log_list_paging,
-        'swid_inventory_session_list_config': swid_inventory_session_paging,
-        'dir_file_list_config': dir_file_list_paging,
-        'swid_files_list_config': swid_files_list_paging,
-        'product_devices_list_config': product_devices_list_paging,
-        'swid_devices_list_config': swid_devices_list_paging,
-        'tpm_devices_list_config': tpm_devices_list_paging,
-    }
 
-    conf = paging_conf_dict[config_name]
+    conf = PAGING_CONFIGS[config_name]
     page_size = conf.get('page_size', 50)
-
-    # get page count from stat producer
-    sp = conf.get('stat_producer')
-    if sp is None:
-        raise ValueError('Invalid stat producer')
-    page_count = sp(page_size, filter_query, producer_args, conf.get('static_producer_args'))
+    static_args = conf.get('static_producer_args')
 
     from_idx = current_page * page_size
     to_idx = from_idx + page_size
 
-    # get element list form list producer
-    lp = conf.get('list_producer')
-    if lp is None:
-        raise ValueError('Invalid list producer')
-    element_list = lp(from_idx, to_idx, filter_query, producer_args, conf.get('static_producer_args'))
+    cursor = None
+    if conf.get('keyset'):
+        cursor = paging_functions.decode_cursor(request.POST.get('cursor'), filter_query, producer_args)
+
+    page_count = paging_functions.get_cached_page_count(config_name, conf, filter_query, producer_args)
+    count_cached = page_count is not None
+    pp = conf.get('page_producer')
+    if page_count is None and pp is not None and cursor is None:
+        # get element list and count from one query
+        element_list, count = pp(from_idx, to_idx, filter_query, producer_args, static_args)
+        page_count = math.ceil(count / page_size)
+    else:
+        if page_count is None:
+            # get page count from stat producer
+            sp = conf.get('stat_producer')
+            if sp is None:
+                raise ValueError('Invalid stat producer')
+            page_count = sp(page_size, filter_query, producer_args, static_args)
+
+        # get element list form list producer
+        lp = conf.get('list_producer')
+        if lp is None:
+            raise ValueError('Invalid list producer')
+        if conf.get('keyset'):
+            element_list = lp(from_idx, to_idx, filter_query, producer_args, static_args,
+                              cursor=cursor)
+        else:
+            element_list = lp(from_idx, to_idx, filter_query, producer_args, static_args)
+    if not count_cached:
+        paging_functions.set_cached_page_count(config_name, conf, filter_query, producer_args, page_count)
 
     var_name = conf.get('var_name', 'object_list')
     template_context = {
@@ -122,6 +156,47 @@ def paging(request):
     response = {
         'current_page': current_page,
         'page_count': page_count,
+        'cursor': paging_functions.encode_cursor(current_page, filter_query, producer_args, element_list),
         'html': render_to_string(template_name + '.html', template_context)
     }
     return HttpResponse(json.dumps(response), content_type="application/x-json")
+
+
+@require_POST
+@ajax_login_required
+def search_results(request):
+    """
+    Returns further hits of a search category.
+
+    Args:
+        category (str):
+            Name of the search category.
+
+        q (str):
+            The search term.
+
+        offset (int):
+            Index of the first hit to return.
+
+    Returns:
+        A json object:
+        {
+            html: <The rendered list items of the hits>,
+            offset: <Index after the last hit returned>,
+            more: <Whether there are more hits>
+        }
+
+    """
+    name = request.POST.get('category')
+    q = request.POST.get('q', '')
+    offset = int(request.POST.get('offset', 0))
+    if name not in SEARCH_CATEGORIES or not (q or SEARCH_CATEGORIES[name]['list_all']):
+        return HttpResponse(status=400)
+
+    category = search_category(name, q, offset)
+    response = {
+        'html': render_to_string('front/search_results.html', {'category': category}),
+        'offset': offset + len(category['results']),
+        'more': category['more'],
+    }
+    return HttpResponse(json.dumps(response), content_type="application/x-json")
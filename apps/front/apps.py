@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.apps import AppConfig
+
+
+class FrontConfig(AppConfig):
+    name = 'apps.front'
+
+    def ready(self):
+        # Invalidate the cached counts of paged lists on writes
+        from .ajax import PAGING_CONFIGS
+        from .paging import watch_count_models
+        watch_count_models(PAGING_CONFIGS.values())
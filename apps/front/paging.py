@@ -1,7 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+import base64
+import hashlib
+import json
 import math
+import operator
+from functools import reduce
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Count, F, Q, Window
+from django.db.models.signals import post_delete, post_save
+
+"""
+Number of seconds the item counts of paged lists are cached. Saving or
+deleting objects of a config's ``count_models`` invalidates them earlier,
+bulk operations do not.
+"""
+COUNT_CACHE_TIMEOUT = 60
 
 
 # **************** #
@@ -13,12 +32,12 @@ class ProducerFactory(object):
 
     Example usage::
 
-        device_producer_factory = ProducerFactory(Device, 'description__icontains')
+        device_producer_factory = ProducerFactory(Device, 'description__substring')
         device_list_producer = device_producer_factory.list()
         device_stat_producer = device_producer_factory.stat()
 
     """
-    def __init__(self, model, filter_target):
+    def __init__(self, model, filter_target, keyset=False):
         """
         Initialize a new producer.
 
@@ -27,36 +46,289 @@ class ProducerFactory(object):
                 The model class that you want to quer.
             query_filter:
                 The target for the filter query, for example
-                ``description__icontains``.
+                ``description__substring`` (see :mod:`apps.core.search`).
+            keyset (bool):
+                Whether the list producer seeks pages relative to a cursor
+                (see :func:`keyset_page`), ordered by the model's
+                ``Meta.ordering`` and pk. The ordering fields must not be
+                nullable. Set ``'keyset': True`` in the paging config too.
 
         """
         self.model = model
         self.filter_target = filter_target
+        self.ordering = None
+        if keyset:
+            self.ordering = tuple(model._meta.ordering) + ('pk',)
+
+    def _queryset(self, filter_query):
+        qs = self.model.objects.all()
+        if filter_query:
+            kwargs = {self.filter_target: filter_query}
+            qs = qs.filter(**kwargs)
+        return qs
 
     def list(self):
         """
         Return a list producer function.
         """
-        def _func(from_idx, to_idx, filter_query, *args):
-            qs = self.model.objects.all()
-            if filter_query:
-                kwargs = {self.filter_target: filter_query}
-                qs = qs.filter(**kwargs)
+        def _func(from_idx, to_idx, filter_query, dynamic_params=None, static_params=None, cursor=None):
+            qs = self._queryset(filter_query)
+            if self.ordering:
+                return keyset_page(qs, self.ordering, from_idx, to_idx, cursor)
             return qs[from_idx:to_idx]
         return _func
 
     def stat(self):
         """
-        Return a list producer function.
+        Return a stat producer function.
         """
         def _func(page_size, filter_query, *args):
-            qs = self.model.objects.all()
-            if filter_query:
-                kwargs = {self.filter_target: filter_query}
-                qs = qs.filter(**kwargs)
+            qs = self._queryset(filter_query)
             return math.ceil(qs.count() / page_size)
         return _func
 
+    def page(self):
+        """
+        Return a page producer function, returning the items of a page and
+        the total number of items from a single query.
+        """
+        def _func(from_idx, to_idx, filter_query, *args):
+            qs = self._queryset(filter_query)
+            return page_with_count(qs, from_idx, to_idx, self.ordering)
+        return _func
+
+
+def page_with_count(qs, from_idx, to_idx, ordering=None):
+    """
+    Return the items of a queryset slice and the number of items in the
+    queryset, counted by a window function in the same query. Databases
+    without window functions (MySQL before 8.0, SQLite before 3.25) count
+    in a separate query unless the slice tells the count.
+
+    Args:
+        qs:
+            The queryset to page.
+        from_idx (int):
+            Index of the first item.
+        to_idx (int):
+            Index after the last item.
+        ordering (tuple):
+            Keyset ordering, see :func:`keyset_page`. The items are returned
+            as :class:`Page` then.
+
+    Returns:
+        A tuple ``(items, count)``.
+
+    """
+    if ordering:
+        qs, keys = _with_keys(qs, ordering)
+    if connections[qs.db].features.supports_over_clause:
+        items = list(qs.annotate(paging_count=Window(Count('pk')))[from_idx:to_idx])
+        count = items[0].paging_count if items else None
+    else:
+        items = list(qs[from_idx:to_idx])
+        count = None
+        if len(items) < to_idx - from_idx and items:
+            # The last page
+            count = from_idx + len(items)
+    if count is None:
+        # Out of range, the items do not tell the count
+        count = 0 if from_idx == 0 and not items else qs.count()
+    if ordering:
+        items = _keyed_page(items, qs, keys)
+    return items, count
+
+
+# ***************** #
+# KEYSET PAGINATION #
+# ***************** #
+class Page(list):
+    """
+    Items of a page with the keys of the first and last item, which the
+    paging view passes to the client in an opaque cursor.
+    """
+    first_key = None
+    last_key = None
+
+
+def keyset_page(qs, ordering, from_idx, to_idx, cursor=None):
+    """
+    Return the items of a page, ordered by the given fields.
+
+    If the cursor belongs to the previous or next page, the items are looked
+    up relative to its keys (``WHERE (a, b) > (x, y)``), which costs the same
+    on every page. Otherwise, e.g. when jumping to a page, the offset is used.
+
+    Args:
+        qs:
+            The queryset to page.
+        ordering (tuple):
+            The field names to order by, with ``-`` for descending order.
+            Together they must be unique and not nullable, e.g. by ending
+            with ``pk``.
+        from_idx (int):
+            Index of the first item.
+        to_idx (int):
+            Index after the last item.
+        cursor (dict):
+            The ``page`` index and the ``first`` and ``last`` key of the page
+            shown before (see :func:`decode_cursor`).
+
+    Returns:
+        A :class:`Page` of items.
+
+    """
+    qs, keys = _with_keys(qs, ordering)
+    page_size = to_idx - from_idx
+    page = from_idx // page_size
+    items = None
+    try:
+        if cursor and page == cursor['page'] + 1:
+            items = list(qs.filter(_seek(qs, keys, cursor['last'], True))[:page_size])
+        elif cursor and page == cursor['page'] - 1:
+            items = list(qs.filter(_seek(qs, keys, cursor['first'], False)).reverse()[:page_size])[::-1]
+    except (KeyError, TypeError, ValueError, ValidationError):
+        pass
+    if items is None:
+        items = list(qs[from_idx:to_idx])
+    return _keyed_page(items, qs, keys)
+
+
+def encode_cursor(current_page, filter_query, producer_args, page):
+    """
+    Return the opaque cursor of a page, or ``None`` if it has no keys.
+    """
+    first_key = getattr(page, 'first_key', None)
+    last_key = getattr(page, 'last_key', None)
+    if first_key is None or last_key is None:
+        return None
+    data = {
+        'page': current_page,
+        'params': _params_digest(filter_query, producer_args),
+        'first': first_key,
+        'last': last_key,
+    }
+    return base64.urlsafe_b64encode(json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, filter_query, producer_args):
+    """
+    Return the data of an opaque cursor, or ``None`` if it is invalid or
+    belongs to another filter query or other producer arguments.
+    """
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('params') != _params_digest(filter_query, producer_args):
+        return None
+    return data
+
+
+def _params_digest(filter_query, producer_args):
+    params = json.dumps([filter_query or '', producer_args], sort_keys=True)
+    return hashlib.sha1(params.encode('utf-8')).hexdigest()
+
+
+def _with_keys(qs, ordering):
+    # Annotate the ordering fields, so their values are available on the items
+    keys = [('keyset_%d' % i, name.lstrip('-'), name.startswith('-')) for i, name in enumerate(ordering)]
+    qs = qs.annotate(**{alias: F(name) for alias, name, _ in keys})
+    return qs.order_by(*[('-' if desc else '') + alias for alias, _, desc in keys]), keys
+
+
+def _key_field(qs, alias):
+    return qs.query.annotations[alias].output_field
+
+
+def _keyed_page(items, qs, keys):
+    page = Page(items)
+    if items:
+        page.first_key = [_key_field(qs, alias).get_prep_value(getattr(items[0], alias))
+                          for alias, _, _ in keys]
+        page.last_key = [_key_field(qs, alias).get_prep_value(getattr(items[-1], alias))
+                         for alias, _, _ in keys]
+    return page
+
+
+def _seek(qs, keys, key, forward):
+    if len(key) != len(keys):
+        raise ValueError('Invalid key')
+    values = [_key_field(qs, alias).to_python(value) for (alias, _, _), value in zip(keys, key)]
+    conditions = []
+    for i, (alias, _, desc) in enumerate(keys):
+        lookup = 'lt' if desc == forward else 'gt'
+        condition = {keys[j][0]: values[j] for j in range(i)}
+        condition['%s__%s' % (alias, lookup)] = values[i]
+        conditions.append(Q(**condition))
+    return reduce(operator.or_, conditions)
+
+
+# *********** #
+# COUNT CACHE #
+# *********** #
+def get_cached_page_count(config_name, conf, filter_query, producer_args):
+    """
+    Return the cached page count of a paged list, or ``None``.
+
+    Only configs with ``count_models`` are cached, keyed by the config name,
+    filter query and producer arguments.
+    """
+    key = _count_cache_key(config_name, conf, filter_query, producer_args)
+    return cache.get(key) if key else None
+
+
+def set_cached_page_count(config_name, conf, filter_query, producer_args, page_count):
+    key = _count_cache_key(config_name, conf, filter_query, producer_args)
+    if key:
+        cache.set(key, page_count, COUNT_CACHE_TIMEOUT)
+
+
+def invalidate_counts(model):
+    """
+    Invalidate the cached counts of all paged lists depending on a model.
+    """
+    try:
+        cache.incr(_model_version_key(model))
+    except ValueError:  # Not cached yet or expired
+        pass
+
+
+def watch_count_models(configs):
+    """
+    Invalidate cached counts when objects of the ``count_models`` of the
+    given paging configs are saved or deleted.
+    """
+    for conf in configs:
+        for model in conf.get('count_models', ()):
+            uid = 'paging_count_%s' % model._meta.label_lower
+            post_save.connect(_model_changed, sender=model, dispatch_uid=uid)
+            post_delete.connect(_model_changed, sender=model, dispatch_uid=uid)
+
+
+def _model_changed(sender, **kwargs):
+    invalidate_counts(sender)
+
+
+def _model_version_key(model):
+    return 'paging_count_version:%s' % model._meta.label_lower
+
+
+def _count_cache_key(config_name, conf, filter_query, producer_args):
+    models = conf.get('count_models')
+    if not models:
+        return None
+    version_keys = [_model_version_key(model) for model in models]
+    versions = cache.get_many(version_keys)
+    for version_key in version_keys:
+        if version_key not in versions:
+            versions[version_key] = 1
+            cache.add(version_key, 1, None)
+    params = json.dumps([filter_query or '', producer_args, sorted(versions.items())], sort_keys=True)
+    return 'paging_count:%s:%s' % (config_name, hashlib.sha1(params.encode('utf-8')).hexdigest())
+
 
 # ************* #
 # PAGING HELPER #
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Categories of the global search.
+
+Every category returns the first ``SEARCH_RESULT_LIMIT`` hits together with
+their total count from a single query (see
+:func:`apps.front.paging.page_with_count`), further hits are fetched per
+category via AJAX.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from apps.devices.models import Device, Group, Product
+from apps.filesystem.models import File
+from apps.packages.models import Package
+from apps.policies.models import Policy, Enforcement
+from .paging import page_with_count
+
+"""
+Number of hits per category shown at once
+"""
+SEARCH_RESULT_LIMIT = 10
+
+
+def _search_groups(q):
+    return Group.objects.filter(name__substring=q) if q else Group.objects.all()
+
+
+def _search_policies(q):
+    return Policy.objects.filter(name__substring=q) if q else Policy.objects.all()
+
+
+def _search_enforcements(q):
+    enforcements = Enforcement.objects.select_related('policy', 'group')
+    if q:
+        enforcements = enforcements.filter(Q(policy__name__substring=q) | Q(group__name__substring=q))
+    return enforcements.order_by('policy__name', 'pk')
+
+
+def _search_devices(q):
+    if not q:
+        return Device.objects.all()
+    return Device.objects.filter(Q(description__substring=q) | Q(value__substring=q))
+
+
+def _search_packages(q):
+    return Package.objects.filter(name__substring=q) if q else Package.objects.all()
+
+
+def _search_products(q):
+    return Product.objects.filter(name__substring=q) if q else Product.objects.all()
+
+
+def _search_files(q):
+    files = File.objects.filter(Q(name__substring=q) | Q(directory__path__substring=q))
+    return files.select_related('directory').order_by('name', 'pk')
+
+
+"""
+Search categories by name. ``query`` returns the matching objects, those
+without ``list_all`` are only searched with a non-empty query.
+"""
+SEARCH_CATEGORIES = OrderedDict([
+    ('groups', {'title': _('Groups'), 'query': _search_groups, 'list_all': True,
+                'url_name': 'devices:group_detail', 'ordering': ('name', 'pk')}),
+    ('policies', {'title': _('Policies'), 'query': _search_policies, 'list_all': True,
+                  'url_name': 'policies:policy_detail', 'ordering': ('name', 'pk')}),
+    ('enforcements', {'title': _('Enforcements'), 'query': _search_enforcements, 'list_all': True,
+                      'url_name': 'policies:enforcement_detail'}),
+    ('devices', {'title': _('Devices'), 'query': _search_devices, 'list_all': True,
+                 'url_name': 'devices:device_detail', 'ordering': ('description', 'pk')}),
+    ('packages', {'title': _('Packages'), 'query': _search_packages, 'list_all': True,
+                  'url_name': 'packages:package_detail', 'ordering': ('name', 'pk')}),
+    ('products', {'title': _('Products'), 'query': _search_products, 'list_all': True,
+                  'url_name': 'devices:product_detail', 'ordering': ('name', 'pk')}),
+    ('files', {'title': _('Files'), 'query': _search_files, 'list_all': False,
+               'url_name': 'filesystem:file_detail'}),
+])
+
+
+def search_category(name, q, offset=0, limit=SEARCH_RESULT_LIMIT):
+    """
+    Search the objects of a category.
+
+    Args:
+        name (str):
+            The category name, a key of ``SEARCH_CATEGORIES``.
+        q (str):
+            The search term, may be empty.
+        offset (int):
+            Index of the first hit to return.
+        limit (int):
+            Maximum number of hits to return.
+
+    Returns:
+        A dict with the category's ``name``, ``title`` and ``url_name``, the
+        ``results``, their total ``count`` and whether there are ``more``.
+
+    """
+    category = SEARCH_CATEGORIES[name]
+    qs = category['query'](q)
+    if 'ordering' in category:
+        qs = qs.order_by(*category['ordering'])
+    results, count = page_with_count(qs, offset, offset + limit)
+    return {
+        'name': name,
+        'title': category['title'],
+        'url_name': category['url_name'],
+        'results': results,
+        'count': count,
+        'more': offset + len(results) < count,
+    }
+
+
+def search_all(q):
+    """
+    Search the first hits of all categories. With an empty term, categories
+    without ``list_all`` are skipped.
+
+    The categories are queried one after the other on the request's
+    connection. Querying them in threads would open (and have to close) a
+    connection per thread, without seeing the request's transaction.
+
+    Returns:
+        A list of dicts as returned by :func:`search_category`, for the
+        categories with hits.
+
+    """
+    names = [name for name, category in SEARCH_CATEGORIES.items() if q or category['list_all']]
+    categories = [search_category(name, q) for name in names]
+    return [category for category in categories if category['count']]
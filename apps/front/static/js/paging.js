@@ -133,6 +133,7 @@ var Pager = function() {
     this.statsUpdate = function(data) {
         this.currentPageIdx = data.current_page;
         this.pageCount = data.page_count;
+        this.cursor = data.cursor;
         this.hideButtons();
         this.updateStatus();
     };
@@ -207,13 +208,18 @@ var Pager = function() {
     };
 
     this.getParamObject = function(filterQuery) {
-        return {
+        var paramObject = {
             'config_name': this.config,
             'current_page': this.currentPageIdx,
             'filter_query': filterQuery,
             'pager_id': this.uid,
             'producer_args': JSON.stringify(this.args)
         };
+        // opaque cursor of the page shown, lets the server seek the adjacent pages
+        if(this.cursor) {
+            paramObject.cursor = this.cursor;
+        }
+        return paramObject;
     };
 
     this.setURLParam = function(hashKey, hashValue, avoidHistory) {
@@ -253,6 +259,7 @@ var Pager = function() {
 
     this.reset = function() {
         this.currentPageIdx = 0;
+        this.cursor = null;
         if(this.filter) {
             this.$filterInput.val('');
         }
@@ -0,0 +1,36 @@
+$(document).ready(function() {
+    initSearchMore();
+});
+
+var initSearchMore = function() {
+    var query = $('input[name="q"]').val();
+    $('.search-category').each(function() {
+        var $category = $(this);
+        var $button = $('.search-more', $category);
+        $button.on('click', function() {
+            $button.prop('disabled', true);
+            $.ajax({
+                method: 'POST',
+                // hardcode the URL for now (could be retrieved with '{% url 'front:search_results' %}')
+                url: '/search/results',
+                data: {
+                    'category': $category.data('category'),
+                    'q': query,
+                    'offset': $button.data('offset')
+                },
+                success: function(data) {
+                    $('.search-results', $category).append(data.html);
+                    $button.data('offset', data.offset);
+                    $button.prop('disabled', false);
+                    if(!data.more) {
+                        $button.remove();
+                    }
+                },
+                error: function() {
+                    $button.prop('disabled', false);
+                    alert('Error: Could not fetch more search results.');
+                }
+            });
+        });
+    });
+};
@@ -6,5 +6,6 @@ urlpatterns = [
     re_path(r'^statistics/?$', views.statistics, name='statistics'),
     re_path(r'^vulnerabilities/?$', views.vulnerabilities, name='vulnerabilities'),
     re_path(r'^search/?$', views.search, name='search'),
+    re_path(r'^search/results/?$', ajax.search_results, name='search_results'),
     re_path(r'^paging/?$', ajax.paging, name='paging'),
 ]
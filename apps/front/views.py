@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
 
-from django.db.models import Count, Q
+from django.db.models import Count
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_GET
 from django.shortcuts import render
@@ -13,6 +13,7 @@ from apps.devices.models import Device, Group, Product
 from apps.packages.models import Package, Version
 from apps.filesystem.models import Directory, File, FileHash
 from apps.swid.models import Tag, TagStats, Entity, Event
+from .search import search_all
 
 
 @require_GET
@@ -89,38 +90,11 @@ def statistics(request):
 @login_required
 def search(request):
     """
-    Global search view
+    Global search view, showing the first hits of every category
     """
-    context = {}
-    context['group_title'] = _('Groups')
-    context['policy_title'] = _('Policies')
-    context['enforcement_title'] = _('Enforcements')
-    context['device_title'] = _('Devices')
-    context['package_title'] = _('Packages')
-    context['product_title'] = _('Products')
-    context['file_title'] = _('Files')
-
-    context['groups'] = Group.objects.all().order_by('name')
-    context['policies'] = Policy.objects.all().order_by('name')
-    context['enforcements'] = Enforcement.objects.all().order_by('policy')
-    context['devices'] = Device.objects.all().order_by('description')
-    context['packages'] = Package.objects.all().order_by('name')
-    context['products'] = Product.objects.all().order_by('name')
-    context['files'] = File.objects.all().order_by('name')
-
     q = request.GET.get('q', '')
-    if q != '':
-        context['query'] = q
-        context['groups'] = Group.objects.filter(name__icontains=q)
-        context['policies'] = Policy.objects.filter(name__icontains=q)
-        context['enforcements'] = Enforcement.objects.filter(
-                Q(policy__name__icontains=q) | Q(group__name__icontains=q))
-        context['devices'] = Device.objects.filter(
-                Q(description__icontains=q) | Q(value__icontains=q))
-        context['packages'] = Package.objects.filter(name__icontains=q)
-        context['products'] = Product.objects.filter(name__icontains=q)
-        q1 = Q(name__icontains=q)
-        q2 = Q(directory__path__icontains=q)
-        context['files'] = File.objects.filter(q1 | q2)
-
+    context = {
+        'query': q,
+        'categories': search_all(q),
+    }
     return render(request, 'front/search.html', context)
@@ -7,7 +7,7 @@ from apps.front.paging import ProducerFactory
 
 # PAGING PRODUCER
 
-package_producer_factory = ProducerFactory(Package, 'name__icontains')
+package_producer_factory = ProducerFactory(Package, 'name__substring', keyset=True)
 
 # PAGING CONFIGS
 
@@ -15,6 +15,9 @@ package_list_paging = {
     'template_name': 'front/paging/default_list',
     'list_producer': package_producer_factory.list(),
     'stat_producer': package_producer_factory.stat(),
+    'page_producer': package_producer_factory.page(),
+    'keyset': True,
+    'count_models': (Package,),
     'static_producer_args': None,
     'var_name': 'object_list',
     'url_name': 'packages:package_detail',
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.apps import AppConfig
+
+
+class PoliciesConfig(AppConfig):
+    name = 'apps.policies'
+
+    def ready(self):
+        # Drop the cached policy plans on changes of policies, enforcements and groups
+        from .plans import watch_plan_models
+        watch_plan_models()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Custom manage.py command to benchmark the creation of work items when a
+whole fleet of devices connects at once.
+
+Usage: ./manage.py benchworkitems [--devices N] [--groups N] [--policies N] [--skip-single]
+
+Fills the configured database (SQLite or PostgreSQL) with synthetic devices,
+groups, policies, enforcements and earlier results, then times creating the
+work items of one new session per device, session by session and as one
+batch. Everything is rolled back afterwards.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.core.models import Identity, Result, Session, WorkItem
+from apps.core.types import Action, WorkItemType
+from apps.devices.models import Device, Group, Product
+from apps.policies.models import Enforcement, Policy
+from apps.policies.plans import create_work_items, invalidate_policy_plans
+
+
+class Command(BaseCommand):
+    """
+    Required class to be recognized by manage.py.
+    """
+    help = 'Time the creation of the work items of many simultaneous sessions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=10000,
+                            help='Number of connecting devices (default 10000).')
+        parser.add_argument('--groups', type=int, default=50,
+                            help='Number of groups (default 50).')
+        parser.add_argument('--policies', type=int, default=20,
+                            help='Number of policies (default 20).')
+        parser.add_argument('--skip-single', action='store_true',
+                            help='Only time the batch, not the sessions one by one.')
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            sessions = self.populate(kwargs['devices'], kwargs['groups'], kwargs['policies'])
+            self.stdout.write('Database: {0}, {1} sessions'.format(connection.vendor, len(sessions)))
+
+            if not kwargs['skip_single']:
+                self.run('One by one', lambda: sum(create_work_items([s]) for s in sessions))
+            self.run('Batch', lambda: create_work_items(sessions))
+            transaction.set_rollback(True)
+        invalidate_policy_plans()
+
+    def run(self, label, func):
+        # Start with empty policy plan caches and without work items
+        invalidate_policy_plans()
+        WorkItem.objects.filter(session__identity__data='benchmark').delete()
+        start = time.perf_counter()
+        count = func()
+        elapsed = time.perf_counter() - start
+        self.stdout.write('{0}: {1} work items in {2:.2f}s'.format(label, count, elapsed))
+
+    def populate(self, device_count, group_count, policy_count):
+        """
+        Create the synthetic objects and return the new sessions.
+        """
+        rng = random.Random(0)
+        now = timezone.now()
+        product = Product.objects.create(name='benchmark')
+
+        groups = [Group.objects.create(name='benchmark-0')]
+        for i in range(1, group_count):
+            groups.append(Group.objects.create(name='benchmark-%d' % i, parent=rng.choice(groups)))
+
+        Policy.objects.bulk_create(
+            Policy(type=WorkItemType.TCPOP, name='benchmark-%d' % i, argument='1-1024',
+                   fail=Action.BLOCK, noresult=Action.ALLOW)
+            for i in range(policy_count))
+        policies = list(Policy.objects.filter(name__startswith='benchmark-'))
+        Enforcement.objects.bulk_create(
+            Enforcement(policy=policy, group=group, max_age=rng.choice([60, 3600, 86400]))
+            for policy in policies for group in rng.sample(groups, min(2, len(groups))))
+
+        Device.objects.bulk_create(Device(value='benchmark-%d' % i, product=product)
+                                   for i in range(device_count))
+        device_ids = list(Device.objects.filter(product=product).values_list('pk', flat=True))
+        Group.devices.through.objects.bulk_create(
+            Group.devices.through(group_id=rng.choice(groups).pk, device_id=pk) for pk in device_ids)
+
+        # Half of the devices were measured half an hour ago
+        identity = Identity.objects.create(type=1, data='benchmark')
+        Session.objects.bulk_create(
+            Session(time=now - timedelta(seconds=1800), connection_id=0, identity=identity,
+                    device_id=pk, recommendation=Action.ALLOW)
+            for pk in device_ids[::2])
+        Result.objects.bulk_create(
+            Result(session=session, policy=policy, result='',
+                   recommendation=rng.choice([Action.ALLOW, Action.ALLOW, Action.BLOCK]))
+            for session in Session.objects.filter(identity=identity)
+            for policy in rng.sample(policies, min(5, len(policies))))
+
+        Session.objects.bulk_create(Session(time=now, connection_id=1, identity=identity, device_id=pk)
+                                    for pk in device_ids)
+        return list(Session.objects.filter(identity=identity, connection_id=1).order_by('pk'))
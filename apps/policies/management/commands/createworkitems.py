@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Custom manage.py command to create the work items of new sessions.
+
+Usage: ./manage.py createworkitems SESSION_ID [SESSION_ID ...]
+
+Creates the work items of every policy that is due for the devices of the
+sessions, e.g. for the sessions of a fleet reconnecting at once.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from apps.core import batching
+from apps.core.models import Session
+from apps.policies.plans import create_work_items
+
+
+class Command(BaseCommand):
+    """
+    Required class to be recognized by manage.py.
+    """
+    help = 'Create the work items of the policies due for the devices of the given sessions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('session_ids', nargs='+', type=int, metavar='SESSION_ID',
+                            help='The ID of a new session.')
+
+    def handle(self, *args, **kwargs):
+        sessions = batching.filter_in(Session.objects.order_by('pk'), 'pk', kwargs['session_ids'])
+        count = create_work_items(sessions)
+        self.stdout.write('Created {0} work items for {1} sessions'.format(count, len(sessions)))
@@ -11,7 +11,7 @@ from apps.front.paging import ProducerFactory
 
 # PAGING PRODUCER
 
-policy_producer_factory = ProducerFactory(Policy, 'name__icontains')
+policy_producer_factory = ProducerFactory(Policy, 'name__substring', keyset=True)
 
 
 def enforcement_list_producer(from_idx, to_idx, filter_query, dynamic_params=None, static_params=None):
@@ -37,6 +37,9 @@ policy_list_paging = {
     'template_name': 'front/paging/default_list',
     'list_producer': policy_producer_factory.list(),
     'stat_producer': policy_producer_factory.stat(),
+    'page_producer': policy_producer_factory.page(),
+    'keyset': True,
+    'count_models': (Policy,),
     'static_producer_args': None,
     'var_name': 'object_list',
     'url_name': 'policies:policy_detail',
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled policy plans of devices.
+
+The plan of a device lists the enforcements that apply to it with their
+resolved work item values, so creating the work items of a connection only
+has to look up the latest results. Plans are cached per device under the
+version stored in the database (model
+:class:`apps.devices.models.PolicyPlanVersion`), which changes when a
+policy, enforcement, group or group membership is saved or deleted. So every
+process drops its cached plans, whatever cache backend is configured.
+Changes written to the database by others (e.g. devices added to their
+product's default groups) apply after ``PLAN_CACHE_TIMEOUT``.
+
+Work items are created for whole batches of sessions with a constant number
+of queries, see :func:`create_work_items`.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import router
+from django.db.models import F, Max, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone
+
+from apps.core import batching
+from apps.core.models import Result, WorkItem
+from apps.core.types import Action
+from .models import Enforcement
+
+"""
+Number of seconds a compiled policy plan is cached
+"""
+PLAN_CACHE_TIMEOUT = 300
+
+
+class PlanEntry(namedtuple('PlanEntry', ['enforcement_id', 'policy_id', 'type', 'arg_str',
+                                         'fail', 'noresult', 'max_age'])):
+    """
+    An enforcement of a policy plan with the values of its work items.
+    """
+    __slots__ = ()
+
+    def make_work_item(self, session):
+        """
+        Return an unsaved workitem of this enforcement for a session.
+        """
+        return WorkItem(result=None, type=self.type, recommendation=None, arg_str=self.arg_str,
+                        enforcement_id=self.enforcement_id, session=session,
+                        fail=self.fail, noresult=self.noresult)
+
+
+def get_policy_plan(device):
+    """
+    Return the policy plan of a device, see :func:`get_policy_plans`.
+    """
+    return get_policy_plans([device.pk])[device.pk]
+
+
+def get_policy_plans(device_ids):
+    """
+    Return the policy plans of devices, from the cache or compiled.
+
+    Args:
+        device_ids (list):
+            The IDs of the devices.
+
+    Returns:
+        A dict mapping the device IDs to lists of :class:`PlanEntry` tuples.
+
+    """
+    version = _get_version()
+    keys = OrderedDict((pk, 'policy_plan:%s:%d' % (version, pk)) for pk in device_ids)
+    cached = cache.get_many(list(keys.values()))
+    plans = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in keys if pk not in plans]
+    if missing:
+        compiled = compile_policy_plans(missing)
+        cache.set_many({keys[pk]: plan for pk, plan in compiled.items()}, PLAN_CACHE_TIMEOUT)
+        plans.update(compiled)
+    return plans
+
+
+def compile_policy_plans(device_ids):
+    """
+    Compile the policy plans of devices from the enforcements on their groups
+    (including the inherited ones). Of every policy, the enforcement with the
+    lowest max_age applies.
+
+    Args:
+        device_ids (list):
+            The IDs of the devices.
+
+    Returns:
+        A dict mapping the device IDs to lists of :class:`PlanEntry` tuples.
+
+    """
+    enforcements = Enforcement.objects.select_related('policy') \
+        .annotate(device_id=F('group__descendant_links__descendant__devices'))
+    strictest = {}
+    for enforcement in batching.filter_in(enforcements, 'device_id', device_ids):
+        key = (enforcement.device_id, enforcement.policy_id)
+        current = strictest.get(key)
+        if current is None or (enforcement.max_age, enforcement.pk) < (current.max_age, current.pk):
+            strictest[key] = enforcement
+
+    plans = {pk: [] for pk in device_ids}
+    for enforcement in sorted(strictest.values(), key=lambda e: (-e.group_id, -e.pk)):
+        item = enforcement.policy.make_work_item(enforcement, None)
+        plans[enforcement.device_id].append(PlanEntry(enforcement.pk, enforcement.policy_id, item.type,
+                                                      item.arg_str, item.fail, item.noresult,
+                                                      enforcement.max_age))
+    return plans
+
+
+def get_latest_results(device_ids):
+    """
+    Return the time of the latest result of devices for every policy, and
+    whether that result allowed access.
+
+    Args:
+        device_ids (list):
+            The IDs of the devices.
+
+    Returns:
+        A dict mapping ``(device_id, policy_id)`` to ``(time, allowed)``.
+
+    """
+    from apps.devices import latest_results
+    from apps.devices.models import LatestResult
+    if not latest_results.is_installed(router.db_for_read(LatestResult)):
+        results = Result.objects.order_by().values_list('session__device', 'policy') \
+            .annotate(time=Max('session__time'),
+                      allowed_time=Max('session__time', filter=Q(recommendation=Action.ALLOW)))
+        return {(device_id, policy_id): (time, allowed_time == time)
+                for device_id, policy_id, time, allowed_time
+                in batching.filter_in(results, 'session__device', device_ids)}
+
+    results = LatestResult.objects.values_list('device_id', 'policy_id', 'time', 'recommendation')
+    return {(device_id, policy_id): (time, recommendation == Action.ALLOW)
+            for device_id, policy_id, time, recommendation
+            in batching.filter_in(results, 'device', device_ids)}
+
+
+def is_due(max_age, time, allowed, now=None):
+    """
+    Check if a measurement is due.
+
+    Args:
+        max_age (int):
+            The maximum age of a result in seconds.
+        time (datetime):
+            The time of the latest result, ``None`` if there is none.
+        allowed (bool):
+            Whether the latest result allowed access.
+        now (datetime):
+            The current time, by default ``timezone.now()``.
+
+    """
+    if time is None:
+        return True
+    deadline = (now or timezone.now()) - timedelta(seconds=max_age)
+    return time < deadline or not allowed
+
+
+def create_work_items(sessions):
+    """
+    Create the work items of every policy that is due for the devices of a
+    batch of new sessions. The number of queries does not depend on the
+    number of sessions (apart from splitting very long parameter lists).
+
+    Args:
+        sessions (list):
+            The new sessions.
+
+    Returns:
+        The number of work items created.
+
+    """
+    sessions = list(sessions)
+    device_ids = list(OrderedDict.fromkeys(session.device_id for session in sessions))
+    plans = get_policy_plans(device_ids)
+    planned = [pk for pk in device_ids if plans[pk]]
+    results = get_latest_results(planned) if planned else {}
+
+    now = timezone.now()
+    items = []
+    for session in sessions:
+        for entry in plans[session.device_id]:
+            time, allowed = results.get((session.device_id, entry.policy_id), (None, False))
+            if is_due(entry.max_age, time, allowed, now):
+                items.append(entry.make_work_item(session))
+    WorkItem.objects.bulk_create(items)
+    return len(items)
+
+
+def invalidate_policy_plans():
+    """
+    Drop the cached policy plans of all devices, in all processes.
+    """
+    from apps.devices.models import PolicyPlanVersion
+    PolicyPlanVersion.objects.update_or_create(pk=1, defaults={'version': uuid.uuid4().hex})
+
+
+def watch_plan_models():
+    """
+    Invalidate the policy plans when the objects they are compiled from are
+    saved or deleted. Saved groups invalidate them in :meth:`Group.save`,
+    only if they got another parent.
+    """
+    from apps.devices.models import Group
+    for model in ('policies.Policy', 'policies.Enforcement'):
+        uid = 'policy_plan_%s' % model.lower()
+        post_save.connect(_plan_changed, sender=model, dispatch_uid=uid)
+        post_delete.connect(_plan_changed, sender=model, dispatch_uid=uid)
+    post_delete.connect(_plan_changed, sender=Group, dispatch_uid='policy_plan_devices.group')
+    m2m_changed.connect(_plan_changed, sender=Group.devices.through, dispatch_uid='policy_plan_members')
+
+
+def _plan_changed(sender, **kwargs):
+    # m2m_changed is sent before and after changes
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate_policy_plans()
+
+
+def _get_version():
+    from apps.devices.models import PolicyPlanVersion
+    return PolicyPlanVersion.objects.filter(pk=1).values_list('version', flat=True).first() or ''
@@ -11,11 +11,15 @@ class EventAdmin(admin.ModelAdmin):
     list_filter = ('device', )
 
 
+class TagAdmin(admin.ModelAdmin):
+    raw_id_fields = ('xml',)
+
+
 class TagEventAdmin(admin.ModelAdmin):
     list_display = ('tag', 'event', 'record_id', 'action')
 
 
-admin.site.register(models.Tag)
+admin.site.register(models.Tag, TagAdmin)
 admin.site.register(models.TagStats)
 admin.site.register(models.TagEvent, TagEventAdmin)
 admin.site.register(models.Entity)
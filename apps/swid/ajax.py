@@ -3,6 +3,7 @@ from __future__ import print_function, division, absolute_import, unicode_litera
 
 import json
 
+from django.db.models import Count, Max, Min, Q
 from django.http import HttpResponse
 from django.views.decorators.http import require_POST
 
@@ -97,28 +98,20 @@ def get_tag_log_stats(request):
 
     from_timestamp = timestamp_local_to_utc(from_timestamp)
     to_timestamp = timestamp_local_to_utc(to_timestamp)
-    diffs = get_tag_diffs(device_id, from_timestamp, to_timestamp)
-    if diffs:
-        added_count = 0
-        removed_count = 0
-        sessions = set()
-        for diff in diffs:
-            sessions.add(diff.session)
-            if diff.action == '+':
-                added_count += 1
-            else:
-                removed_count += 1
-
-        s = sorted(sessions, key=lambda sess: sess.time)
-        first_session = s[0]
-        last_session = s[-1]
-
+    stats = get_tag_diffs(device_id, from_timestamp, to_timestamp).aggregate(
+        session_count=Count('session', distinct=True),
+        first_time=Min('time'),
+        last_time=Max('time'),
+        added_count=Count('pk', filter=Q(added=True)),
+        removed_count=Count('pk', filter=Q(added=False)),
+    )
+    if stats['session_count']:
         result = {
-            'session_count': len(sessions),
-            'first_session': local_dtstring(first_session.time),
-            'last_session': local_dtstring(last_session.time),
-            'added_count': added_count,
-            'removed_count': removed_count,
+            'session_count': stats['session_count'],
+            'first_session': local_dtstring(stats['first_time']),
+            'last_session': local_dtstring(stats['last_time']),
+            'added_count': stats['added_count'],
+            'removed_count': stats['removed_count'],
         }
 
         return HttpResponse(json.dumps(result), content_type="application/x-json")
@@ -5,12 +5,11 @@ from django.db import transaction
 from rest_framework import viewsets, views, status
 from rest_framework.response import Response
 from rest_framework.parsers import JSONParser
-from lxml.etree import XMLSyntaxError
 from config.settings import USE_XMPP, XMPP_GRID
 
 from . import utils, serializers
 
-from .models import Event, Entity, Tag, TagEvent, TagStats
+from .models import Event, Entity, Tag, TagStats
 from apps.core.models import Session
 from apps.api.utils import make_message
 from apps.swid.xmpp_grid import XmppGridClient
@@ -31,10 +30,18 @@ class EntityViewSet(viewsets.ReadOnlyModelViewSet):
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     model = Tag
-    queryset = model.objects.all()
+    queryset = model.objects.select_related('xml').prefetch_related('entityrole_set', 'tagevent_set')
     serializer_class = serializers.TagSerializer
     filter_fields = ('package_name', 'version_str', 'unique_id', 'software_id')
 
+    def get_queryset(self):
+        queryset = super(TagViewSet, self).get_queryset()
+        software_id = self.request.query_params.get('software_id')
+        if software_id:
+            # Use the indexed hash, the filter backend compares the full string
+            queryset = queryset.filter(software_id_hash=Tag.hash_software_id(software_id))
+        return queryset
+
 
 class TagStatsViewSet(viewsets.ReadOnlyModelViewSet):
     model = TagStats
@@ -115,21 +122,16 @@ class TagAddView(views.APIView):
 
         # Process tags
         stats = {'added': 0, 'replaced': 0}
-        for tag in tags:
-            try:
-                tag, replaced = utils.process_swid_tag(tag)
-            except XMLSyntaxError:
-                return make_message('Invalid XML', status.HTTP_400_BAD_REQUEST)
-            except ValueError as e:
-                return make_message(str(e), status.HTTP_400_BAD_REQUEST)
+        for tag, replaced, error, _ in utils.process_swid_tags(tags):
+            if error:
+                return make_message(str(error), status.HTTP_400_BAD_REQUEST)
+            # Update stats
+            if replaced:
+                stats['replaced'] += 1
             else:
-                # Update stats
-                if replaced:
-                    stats['replaced'] += 1
-                else:
-                    stats['added'] += 1
-                if xmpp_connected:
-                    xmpp.publish(XMPP_GRID['node_swidtags'], tag.software_id, tag.json())
+                stats['added'] += 1
+            if xmpp_connected:
+                xmpp.publish(XMPP_GRID['node_swidtags'], tag.software_id, tag.json())
 
         if xmpp_connected:
             xmpp.disconnect()
@@ -162,14 +164,8 @@ class SwidMeasurementView(views.APIView):
             software_ids = validate_data_param(request, 'software IDs')
         except ValueError as e:
             return e.args[0]
-        found_tag_qs = Tag.objects.values_list('software_id', 'pk')
-        found_tags = dict(utils.chunked_filter_in(found_tag_qs, 'software_id', software_ids, 980))
-
         # Look for matching tags
-        missing_tags = []
-        for software_id in software_ids:
-            if software_id not in found_tags:
-                missing_tags.append(software_id)
+        found_tags, missing_tags = utils.resolve_software_ids(software_ids)
 
         if missing_tags:
             # Some tags are missing
@@ -181,11 +177,13 @@ class SwidMeasurementView(views.APIView):
             except Session.DoesNotExist:
                 msg = 'Session with id "%s" not found' % pk
                 return make_message(msg, status.HTTP_404_NOT_FOUND)
-            utils.chunked_bulk_add(session.tag_set, list(found_tags.values()), 980)
+            utils.chunked_bulk_add(session.tag_set, list(found_tags.values()))
 
             # Update tag stats
             # Also possible with signaling https://docs.djangoproject.com/en/dev/ref/signals/#m2m-changed
             utils.update_tag_stats(session, list(found_tags.values()))
+            utils.update_session_stats(Session.objects.filter(pk=session.pk))
+            utils.update_tag_diffs(session)
 
             return Response(data=[], status=status.HTTP_200_OK)
 
@@ -225,12 +223,8 @@ class SwidEventsView(views.APIView):
         obj = request.data
 
         # Check if any software identifiers, i.e. Tags are missing
-        missing_tags = []
-        for e in obj['events']:
-            sw_id = e['softwareId']
-            if not Tag.objects.filter(software_id=sw_id).exists():
-                if sw_id not in missing_tags:
-                    missing_tags.append(sw_id)
+        software_ids = [e['softwareId'] for e in obj['events']]
+        tag_ids, missing_tags = utils.resolve_software_ids(software_ids)
 
         if missing_tags:
             return Response(data=missing_tags,
@@ -261,41 +255,20 @@ class SwidEventsView(views.APIView):
 
         # Create Event and TagEvent objects if they don't exist yet
         epoch = obj['epoch']
-        for e in obj['events']:
-            action = e['action']
-            ev, _ = Event.objects.get_or_create(device=session.device,
-                       epoch=epoch, eid=e['eid'], timestamp=e['timestamp'])
-            t = Tag.objects.get(software_id=e['softwareId'])
-            te, _ = TagEvent.objects.get_or_create(event=ev, tag=t,
-                       record_id=e['recordId'], source_id=e['sourceId'],
-                       action=action)
+        utils.store_swid_events(session, epoch, obj['events'], tag_ids)
+        utils.update_session_stats(Session.objects.filter(pk=session.pk))
 
-            if xmpp_connected:
+        if xmpp_connected:
+            for e in obj['events']:
                 j_event = '"event": {"timestamp": "%s", "epoch": "%s", "eid": "%s"}' % \
                     (e['timestamp'], epoch, e['eid'])
                 j_device = '"device": {"value": "%s", "description": "%s"}' % \
                     (session.device.value, session.device.description)
                 j_tag = '"tag": {"softwareId": "%s", "recordId": %s, "sourceId": %s}' % \
                     (e['softwareId'], e['recordId'], e['sourceId'])
-                j_action = '"action": %d' % action
+                j_action = '"action": %d' % e['action']
                 j_data = '{%s, %s, %s, %s}' % (j_event, j_device, j_tag, j_action)
                 xmpp.publish(XMPP_GRID['node_events'], None, j_data)
-
-            # Update tag stats
-            ts_set = TagStats.objects.filter(device=session.device, tag=t)
-            if ts_set:
-                ts = ts_set[0]
-                if action == TagEvent.CREATION:
-                    ts.last_deleted = None
-                else:
-                    ts.last_deleted = ev
-                ts.last_seen = session
-                ts.save()
-            else:
-                ts = TagStats.objects.create(device=session.device, tag=t,
-                        first_seen=session, last_seen=session, first_installed=ev)
-
-        if xmpp_connected:
             xmpp.disconnect()
 
         return Response(data=[], status=status.HTTP_200_OK)
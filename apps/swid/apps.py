@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.apps import AppConfig
+from django.db.models.signals import post_delete
+
+
+class SwidConfig(AppConfig):
+    name = 'apps.swid'
+
+    def ready(self):
+        # Delete the stored XML of deleted tags
+        from .models import Tag, delete_tag_xml
+        post_delete.connect(delete_tag_xml, sender=Tag, dispatch_uid='apps.swid.tag_xml')
+
+        # Compare the next measurement of a device with the one before a deleted session
+        from apps.core.models import Session
+        from .utils import update_tag_diffs_after_delete
+        post_delete.connect(update_tag_diffs_after_delete, sender=Session,
+                            dispatch_uid='apps.swid.tag_diffs')
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Custom manage.py command to compress the XML of swid tags stored uncompressed.
+
+Usage: ./manage.py compressswid [--batch-size N]
+
+The XML is compressed when it is stored, but rows written uncompressed (e.g. by
+other tools) are still read as they are. These are read and written back in
+batches, each in its own transaction. The command may be interrupted and run again.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.db.models.functions import Cast
+
+from apps.core.fields import CompressedTextField
+from apps.swid.models import TagXml
+
+
+class Command(BaseCommand):
+    """
+    Required class to be recognized by manage.py.
+    """
+    help = 'Compress the XML of SWID tags stored uncompressed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of tags converted per transaction.')
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        if batch_size < 1:
+            raise CommandError('The batch size must be at least 1')
+
+        # Cast to a plain binary field to get the stored bytes
+        raw_rows = TagXml.objects.order_by('pk') \
+            .annotate(raw_xml=Cast('xml', models.BinaryField())) \
+            .values_list('pk', 'raw_xml')
+
+        last_pk = 0
+        converted = 0
+        while True:
+            with transaction.atomic():
+                batch = list(raw_rows.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+                rows = [TagXml(pk=pk, xml=bytes(raw_xml).decode('utf-8'))
+                        for pk, raw_xml in batch
+                        if not CompressedTextField.is_compressed(bytes(raw_xml))]
+                TagXml.objects.bulk_update(rows, ['xml'])
+            converted += len(rows)
+            self.stdout.write('Compressed %d tags (up to id %d)' % (converted, last_pk))
+        self.stdout.write('Done, compressed %d tags' % converted)
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 """
-Custom manage.py command to import swid tags from a file.
+Custom manage.py command to import swid tags from a file or directory.
 
-Usage: ./manage.py importswid [filename]
+Usage: ./manage.py importswid [--workers N] [--prettify] [path]
 
-The file must contain valid swid tags, one swid tag per line, separated by a **single** newline.
+The file may contain any number of concatenated swid tags (e.g. one per line) and may
+be gzip or xz compressed. For a directory, all ``.swidtag``, ``.gz`` and ``.xz`` files in
+it are imported.
+With ``--workers N`` the tags are parsed by N processes, while they are stored by a single one.
+The tags are stored as read and indented on display, ``--prettify`` stores them indented.
 """
 from __future__ import print_function, division, absolute_import, unicode_literals
 
@@ -20,21 +24,28 @@ class Command(BaseCommand):
     """
     Required class to be recognized by manage.py.
     """
-    args = '<filename>'
-    help = 'Import SWID tags from a file into the DB. ' \
-           'The file must contain one swid tag per line.'
+    args = '<path>'
+    help = 'Import SWID tags from a file or directory into the DB. ' \
+           'The file may contain concatenated swid tags and may be gzip or xz compressed.'
 
     def add_arguments(self, parser):
         parser.add_argument('args', nargs='*')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes used to parse the tags.')
+        parser.add_argument('--prettify', action='store_true',
+                            help='Store the tag XML indented instead of as read.')
 
     def handle(self, *args, **kwargs):
         if len(args) != 1:
-            raise CommandError('Usage: ./manage.py importswid <filename>')
+            raise CommandError('Usage: ./manage.py importswid [--workers N] [--prettify] <path>')
 
-        filename = args[0]
+        path = args[0]
+        workers = kwargs['workers']
+        if workers < 1:
+            raise CommandError('The number of workers must be at least 1')
 
-        if not os.path.isfile(filename):
-            raise CommandError('No such file: ' + filename)
+        if not os.path.exists(path):
+            raise CommandError('No such file or directory: ' + path)
 
         # Publish SWID tags on XMPP-Grid?
         xmpp_connected = False
@@ -54,15 +65,22 @@ class Command(BaseCommand):
             else:
                 self.stdout.write('Unable to connect to XMPP-Grid server.')
 
-        with open(filename, 'r') as f:
-            for line in f:
-                tag_xml = line.strip()
-                tag, replaced = utils.process_swid_tag(tag_xml, allow_tag_update=True)
-                if replaced:
+        tags_xml = utils.read_swid_tags(path)
+        results = utils.process_swid_tags(tags_xml, allow_tag_update=True, workers=workers,
+                                          prettify=kwargs['prettify'])
+        try:
+            for tag, replaced, error, unchanged in results:
+                if error:
+                    raise CommandError('Invalid SWID tag: %s' % error)
+                if unchanged:
+                    self.stdout.write('Unchanged {0}'.format(tag))
+                elif replaced:
                     self.stdout.write('Replaced {0}'.format(tag))
                 else:
                     self.stdout.write('Added {0}'.format(tag))
                 if xmpp_connected:
                     xmpp.publish(XMPP_GRID['node_swidtags'], tag.software_id, tag.json())
+        except ValueError as e:
+            raise CommandError('Invalid XML in %s: %s' % (path, e))
         if xmpp_connected:
             xmpp.disconnect()
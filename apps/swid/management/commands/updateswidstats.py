@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Custom manage.py command to compute the stored SWID tag counts of sessions
+and the SWID log of devices.
+
+Usage: ./manage.py updateswidstats [--device ID]
+
+New measurements update the counts of their session and the log of their
+device, this fills them in for sessions measured before they were stored.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from apps.core.models import Session
+from apps.swid import utils
+
+
+class Command(BaseCommand):
+    """
+    Required class to be recognized by manage.py.
+    """
+    help = 'Compute the number of measured and first reported SWID tags of all sessions ' \
+           'and the added and removed SWID tags of all devices.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', type=int,
+                            help='Only update the sessions of the device with this ID.')
+
+    def handle(self, *args, **kwargs):
+        sessions = Session.objects.all()
+        if kwargs['device'] is not None:
+            sessions = sessions.filter(device_id=kwargs['device'])
+        count = utils.update_session_stats(sessions)
+        self.stdout.write('Updated the SWID stats of {0} sessions'.format(count))
+
+        device_ids = sessions.filter(tag__isnull=False).order_by() \
+            .values_list('device_id', flat=True).distinct()
+        for device_id in device_ids:
+            count = utils.rebuild_tag_diffs(device_id)
+            self.stdout.write('Stored {0} SWID log entries of device {1}'.format(count, device_id))
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+import apps.core.fields
+
+
+def convert_swid_xml_column(apps, schema_editor):
+    # A plain text::bytea cast would interpret backslashes (e.g. in Windows
+    # paths) as escape sequences, so convert the column explicitly. The cast
+    # issued by the AlterField below is then a no-op.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE swid_tags ALTER COLUMN swid_xml TYPE bytea "
+                              "USING convert_to(swid_xml, 'UTF8')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swid', '0004_link_tag_to_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_swid_xml_column),
+        migrations.AlterField(
+            model_name='tag',
+            name='swid_xml',
+            field=apps.core.fields.CompressedTextField(help_text='The full SWID tag XML'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import apps.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swid', '0005_compress_swid_xml'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagXml',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('digest', models.CharField(help_text='The SHA-256 hash of the XML', max_length=64,
+                                            unique=True)),
+                ('xml', apps.core.fields.CompressedTextField(help_text='The full SWID tag XML')),
+            ],
+            options={
+                'db_table': 'swid_tag_xml',
+            },
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='xml',
+            field=models.ForeignKey(help_text='The full SWID tag XML', null=True,
+                                    on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='tags', to='swid.tagxml'),
+        ),
+    ]
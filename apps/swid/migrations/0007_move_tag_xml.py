@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+from collections import OrderedDict
+
+from django.db import migrations
+from lxml import etree
+
+
+def get_digest(xml):
+    # Same as TagXml.get_digest, the SHA-256 hash of the canonical XML
+    try:
+        root = etree.fromstring(xml.encode('utf-8'), etree.XMLParser(remove_blank_text=True))
+        canonical = etree.tostring(root, method='c14n')
+    except etree.XMLSyntaxError:
+        canonical = xml.encode('utf-8')
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def move_swid_xml(apps, schema_editor):
+    Tag = apps.get_model('swid', 'Tag')
+    TagXml = apps.get_model('swid', 'TagXml')
+
+    xml_ids = {}
+    last_pk = 0
+    while True:
+        tags = list(Tag.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'swid_xml')[:500])
+        if not tags:
+            break
+        last_pk = tags[-1].pk
+
+        digests = [get_digest(tag.swid_xml) for tag in tags]
+        new_xml = OrderedDict()
+        for tag, digest in zip(tags, digests):
+            if digest not in xml_ids:
+                new_xml.setdefault(digest, tag.swid_xml)
+        TagXml.objects.bulk_create([TagXml(digest=d, xml=x) for d, x in new_xml.items()])
+        xml_ids.update(TagXml.objects.filter(digest__in=list(new_xml)).values_list('digest', 'pk'))
+
+        for tag, digest in zip(tags, digests):
+            tag.xml_id = xml_ids[digest]
+        Tag.objects.bulk_update(tags, ['xml'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swid', '0006_tag_xml'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_swid_xml),
+    ]
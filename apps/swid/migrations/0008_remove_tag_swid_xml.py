@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swid', '0007_move_tag_xml'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='tag',
+            name='swid_xml',
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='xml',
+            field=models.ForeignKey(help_text='The full SWID tag XML',
+                                    on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='tags', to='swid.tagxml'),
+        ),
+    ]
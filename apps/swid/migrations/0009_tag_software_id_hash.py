@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_software_id(software_id):
+    digest = hashlib.sha256(software_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+def fill_software_id_hash(apps, schema_editor):
+    Tag = apps.get_model('swid', 'Tag')
+
+    batch = []
+    tags = Tag.objects.order_by('pk').only('pk', 'software_id')
+    for tag in tags.iterator(chunk_size=1000):
+        tag.software_id_hash = hash_software_id(tag.software_id)
+        batch.append(tag)
+        if len(batch) == 1000:
+            Tag.objects.bulk_update(batch, ['software_id_hash'])
+            batch = []
+    Tag.objects.bulk_update(batch, ['software_id_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swid', '0008_remove_tag_swid_xml'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='software_id_hash',
+            field=models.BigIntegerField(editable=False, null=True,
+                                         help_text='64-bit hash of the Software ID, used for lookups'),
+        ),
+        migrations.RunPython(fill_software_id_hash),
+        migrations.AlterField(
+            model_name='tag',
+            name='software_id_hash',
+            field=models.BigIntegerField(db_index=True, editable=False,
+                                         help_text='64-bit hash of the Software ID, used for lookups'),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='software_id',
+            field=models.CharField(help_text='The Software ID, format: {regid}__{tagId} e.g '
+                                             'strongswan.org__fedora_19-x86_64-strongswan-5.1.2-4.fc19',
+                                   max_length=767),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '__first__'),
+        ('swid', '0009_tag_software_id_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionStats',
+            fields=[
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE,
+                                                 primary_key=True, related_name='swid_stats',
+                                                 serialize=False, to='core.session')),
+                ('tag_count', models.PositiveIntegerField(default=0,
+                    help_text='Number of tags measured in the session')),
+                ('new_tag_count', models.PositiveIntegerField(default=0,
+                    help_text='Number of tags first reported in the session')),
+            ],
+            options={
+                'verbose_name_plural': 'session stats',
+            },
+        ),
+    ]
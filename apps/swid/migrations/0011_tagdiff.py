@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+import apps.core.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '__first__'),
+        ('devices', '0002_device_inactive'),
+        ('swid', '0010_sessionstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagDiff',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('time', apps.core.fields.EpochField(help_text='The time of the session')),
+                ('added', models.BooleanField(help_text='Whether the tag was added or removed')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                             to='devices.device')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                              to='core.session')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='swid.tag')),
+            ],
+            options={
+                'ordering': ('-time', '-session_id', '-added', 'tag_id'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tagdiff',
+            index=models.Index(fields=['device', 'time'], name='swid_tagdif_device__97bec6_idx'),
+        ),
+    ]
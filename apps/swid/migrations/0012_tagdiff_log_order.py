@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swid', '0011_tagdiff'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='tagdiff',
+            options={'ordering': ('-time', '-session_id', 'tag_id')},
+        ),
+        migrations.RemoveIndex(
+            model_name='tagdiff',
+            name='swid_tagdif_device__97bec6_idx',
+        ),
+        migrations.AddIndex(
+            model_name='tagdiff',
+            index=models.Index(fields=['device', '-time', '-session', 'tag'],
+                               name='swid_tagdif_device__f72270_idx'),
+        ),
+    ]
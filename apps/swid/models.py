@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+import hashlib
+
 from django.db import models
+from lxml import etree
 
+from apps.core.fields import CompressedTextField, EpochField
 from apps.packages.models import Package
 from config.settings import XMPP_GRID
 
@@ -13,6 +17,24 @@ TABLE_PREFIX = 'swid_'
 # custom db_table names.
 
 
+class TagQuerySet(models.QuerySet):
+    """
+    Queryset for tags, maintaining the Software ID hash on bulk inserts.
+    """
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.software_id_hash = Tag.hash_software_id(obj.software_id)
+        return super(TagQuerySet, self).bulk_create(objs, *args, **kwargs)
+
+    def with_software_id(self, software_id):
+        """
+        Filter by Software ID, using the indexed hash column.
+        """
+        return self.filter(software_id_hash=Tag.hash_software_id(software_id),
+                           software_id=software_id)
+
+
 class Tag(models.Model):
     package_name = models.CharField(max_length=255, db_index=True,
                         help_text='The name of the software, e.g. "strongswan"')
@@ -22,12 +44,17 @@ class Tag(models.Model):
                         on_delete=models.CASCADE)
     unique_id = models.CharField(max_length=255, db_index=True,
                         help_text='The tagId, e.g. "fedora_19-x86_64-strongswan-5.1.2-4.fc19"')
-    swid_xml = models.TextField(help_text='The full SWID tag XML')
+    xml = models.ForeignKey('TagXml', on_delete=models.PROTECT, related_name='tags',
+                        help_text='The full SWID tag XML')
     files = models.ManyToManyField('filesystem.File', blank=True, verbose_name='list of files')
     sessions = models.ManyToManyField('core.Session', verbose_name='list of sessions')
-    software_id = models.CharField(max_length=767, db_index=True,
+    software_id = models.CharField(max_length=767,
                         help_text='The Software ID, format: {regid}__{tagId} '
                                              'e.g strongswan.org__fedora_19-x86_64-strongswan-5.1.2-4.fc19')
+    software_id_hash = models.BigIntegerField(db_index=True, editable=False,
+                        help_text='64-bit hash of the Software ID, used for lookups')
+
+    objects = TagQuerySet.as_manager()
 
     class Meta(object):
         db_table = TABLE_PREFIX + 'tags'
@@ -36,9 +63,27 @@ class Tag(models.Model):
     def __str__(self):
         return self.unique_id
 
+    def save(self, *args, **kwargs):
+        self.software_id_hash = self.hash_software_id(self.software_id)
+        super(Tag, self).save(*args, **kwargs)
+
+    @staticmethod
+    def hash_software_id(software_id):
+        """
+        Return a signed 64-bit hash of a Software ID.
+
+        The hash is not unique, lookups have to compare the Software ID too.
+        """
+        digest = hashlib.sha256(software_id.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big', signed=True)
+
     def list_repr(self):
         return self.unique_id
 
+    @property
+    def swid_xml(self):
+        return self.xml.xml
+
     def json(self):
         j_tag_id = '"tagId": "%s"' % self.unique_id
         j_package_name = '"packageName": "%s"' % self.package_name
@@ -67,13 +112,98 @@ class Tag(models.Model):
         """
         tag_pks = session.tag_set.values_list('pk', flat=True)
         tag_stats = TagStats.objects.filter(tag__in=tag_pks, device=session.device_id) \
-            .select_related('last_seen', 'first_seen', 'tag').defer('tag__swid_xml')
+            .select_related('last_seen', 'first_seen', 'tag')
         return tag_stats
 
     def get_matching_packages(self):
         return Package.objects.filter(name=self.package_name)
 
 
+class TagXml(models.Model):
+    """
+    The XML of SWID tags, stored once per distinct content.
+    """
+    digest = models.CharField(max_length=64, unique=True,
+                        help_text='The SHA-256 hash of the XML')
+    xml = CompressedTextField(help_text='The full SWID tag XML')
+
+    class Meta(object):
+        db_table = TABLE_PREFIX + 'tag_xml'
+
+    def __str__(self):
+        return self.digest
+
+    @staticmethod
+    def get_digest(xml):
+        """
+        Return the SHA-256 hash of the canonical form of the XML, so the XML of
+        a tag as read and prettified has the same digest.
+        """
+        return hashlib.sha256(canonicalize_xml(xml)).hexdigest()
+
+    @staticmethod
+    def get_tree_digest(root):
+        """
+        Return the digest of an already parsed document, see
+        :meth:`get_digest`. The document must be parsed with
+        ``remove_blank_text``, like :data:`CANONICAL_PARSER_OPTIONS`.
+        """
+        return hashlib.sha256(etree.tostring(root, method='c14n')).hexdigest()
+
+    @classmethod
+    def get_or_create_for(cls, xml, digest=None):
+        """
+        Return the stored XML with the same content, or store it.
+
+        Args:
+            xml (unicode):
+                The SWID tag XML.
+            digest (str):
+                The digest of the XML if already known, see :meth:`get_digest`.
+
+        Returns:
+            The TagXml instance.
+
+        """
+        if digest is None:
+            digest = cls.get_digest(xml)
+        tag_xml, _ = cls.objects.get_or_create(digest=digest, defaults={'xml': xml})
+        return tag_xml
+
+    @classmethod
+    def delete_unused(cls, pks):
+        """
+        Delete the given entries unless a tag still references them.
+        """
+        cls.objects.filter(pk__in=pks, tags__isnull=True).delete()
+
+
+def delete_tag_xml(sender, instance, **kwargs):
+    """
+    ``post_delete`` handler deleting the XML of a deleted tag, unless other
+    tags share it.
+    """
+    TagXml.delete_unused([instance.xml_id])
+
+
+"""
+Options of the XML parser for the canonical form of SWID tags
+"""
+CANONICAL_PARSER_OPTIONS = {'remove_blank_text': True}
+
+
+def canonicalize_xml(xml):
+    """
+    Return the canonical XML (C14N) of a document as bytes, without the
+    whitespace between elements. Text that does not parse is returned as is.
+    """
+    try:
+        root = etree.fromstring(xml.encode('utf-8'), etree.XMLParser(**CANONICAL_PARSER_OPTIONS))
+    except etree.XMLSyntaxError:
+        return xml.encode('utf-8')
+    return etree.tostring(root, method='c14n')
+
+
 class TagStats(models.Model):
     tag = models.ForeignKey('Tag', on_delete=models.CASCADE)
     device = models.ForeignKey('devices.Device', on_delete=models.CASCADE)
@@ -92,6 +222,40 @@ class TagStats(models.Model):
         ordering = ('device', 'tag')
 
 
+class SessionStats(models.Model):
+    """
+    Number of SWID tags measured in a session, stored when the measurement
+    is linked to the session.
+    """
+    session = models.OneToOneField('core.Session', primary_key=True, on_delete=models.CASCADE,
+                        related_name='swid_stats')
+    tag_count = models.PositiveIntegerField(default=0,
+                        help_text='Number of tags measured in the session')
+    new_tag_count = models.PositiveIntegerField(default=0,
+                        help_text='Number of tags first reported in the session')
+
+    class Meta(object):
+        verbose_name_plural = 'session stats'
+
+
+class TagDiff(models.Model):
+    """
+    A tag added to or removed from the measurement of a device, compared to
+    the previous session with SWID measurement.
+    """
+    device = models.ForeignKey('devices.Device', on_delete=models.CASCADE)
+    session = models.ForeignKey('core.Session', on_delete=models.CASCADE)
+    time = EpochField(help_text='The time of the session')
+    tag = models.ForeignKey('Tag', on_delete=models.CASCADE)
+    added = models.BooleanField(help_text='Whether the tag was added or removed')
+
+    class Meta(object):
+        ordering = ('-time', '-session_id', 'tag_id')
+        indexes = [
+            models.Index(fields=['device', '-time', '-session', 'tag']),
+        ]
+
+
 class EntityRole(models.Model):
     AGGREGATOR = 0
     DISTRIBUTOR = 1
@@ -2,22 +2,24 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 
 import math
-from collections import OrderedDict, namedtuple
+from collections import OrderedDict
 
+from django.db.models import Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 
 from .models import Entity, Tag
 from apps.core.models import Session
 from apps.devices.models import Device
 from apps.front.utils import timestamp_local_to_utc
-from apps.front.paging import ProducerFactory
-from apps.swid.models import TagStats
+from apps.front.paging import ProducerFactory, keyset_page
+from apps.swid.models import TagDiff, TagStats
 
 # PAGING PRODUCER
 
-swid_producer_factory = ProducerFactory(Tag, 'unique_id__icontains')
+swid_producer_factory = ProducerFactory(Tag, 'unique_id__substring', keyset=True)
 
-regid_producer_factory = ProducerFactory(Entity, 'regid__icontains')
+regid_producer_factory = ProducerFactory(Entity, 'regid__substring', keyset=True)
 
 
 def entity_swid_list_producer(from_idx, to_idx, filter_query, dynamic_params=None, static_params=None):
@@ -89,23 +91,41 @@ def get_installed_tags(session_id, filter_query):
     return installed_tags
 
 
-def swid_log_list_producer(from_idx, to_idx, filter_query, dynamic_params, static_params=None):
+class SwidLogPage(OrderedDict):
+    """
+    A page of the SWID log, mapping sessions to their added and removed tags,
+    with the keys of the first and last entry for the paging cursor.
+    """
+    first_key = None
+    last_key = None
+
+
+"""
+Keyset ordering of the SWID log, see :func:`get_tag_diffs`
+"""
+SWID_LOG_ORDERING = ('-time', '-session_id', 'tag_id')
+
+
+def swid_log_list_producer(from_idx, to_idx, filter_query, dynamic_params, static_params=None, cursor=None):
     if not dynamic_params:
         return []
     device_id = dynamic_params['device_id']
     from_timestamp = timestamp_local_to_utc(dynamic_params['from_timestamp'])
     to_timestamp = timestamp_local_to_utc(dynamic_params['to_timestamp'])
 
-    diffs = get_tag_diffs(device_id, from_timestamp, to_timestamp, filter_query)[from_idx:to_idx]
+    diffs = get_tag_diffs(device_id, from_timestamp, to_timestamp, filter_query)
+    diffs = keyset_page(diffs, SWID_LOG_ORDERING, from_idx, to_idx, cursor)
 
-    result = OrderedDict()
+    result = SwidLogPage()
     for diff in diffs:
         tag = diff.tag
-        tag.added = diff.action == '+'
+        tag.added = diff.added
         if diff.session not in result:
             result[diff.session] = [tag]
         else:
             result[diff.session].append(tag)
+    result.first_key = diffs.first_key
+    result.last_key = diffs.last_key
     return result
 
 
@@ -116,181 +136,52 @@ def swid_log_stat_producer(page_size, filter_query, dynamic_params=None, static_
     from_timestamp = timestamp_local_to_utc(dynamic_params['from_timestamp'])
     to_timestamp = timestamp_local_to_utc(dynamic_params['to_timestamp'])
     diffs = get_tag_diffs(device_id, from_timestamp, to_timestamp, filter_query)
-    return math.ceil(len(diffs) / page_size)
+    return math.ceil(diffs.count() / page_size)
 
 
 def get_tag_diffs(device_id, from_timestamp, to_timestamp, filter_query=None):
     """
     Get differences of installed SWID tags between all sessions of the
-    given device in the given timerange (see `session_tag_difference`).
+    given device in the given timerange, as stored at measurement time.
+
+    For the oldest session with SWID measurement in the range only the added
+    tags are listed, compared to the previous measurement (if any).
 
     Args:
+        device_id (int):
+            The device ID.
         from_timestamp (int):
             A unix timestamp (UTC).
         to_timestamp (int):
             A unix timestamp (UTC).
-
-    """
-    device = Device.objects.get(pk=device_id)
-    sessions = device.get_sessions_in_range(from_timestamp, to_timestamp)
-
-    sessions_with_tags = sessions.filter(tag__isnull=False).distinct().order_by('-time')
-    num_of_sessions = sessions_with_tags.count()
-    sessions_with_tags = list(sessions_with_tags)  # Force evaluate
-
-    diffs = []
-
-    # diff only possible if more than 1 session is selected
-    if num_of_sessions > 1:
-        for i, session in enumerate(sessions_with_tags, start=1):
-            if i < num_of_sessions:
-                prev_session = sessions_with_tags[i]
-                diff = session_tag_difference(session, prev_session, filter_query)
-                diffs.extend(diff)
-            elif i == num_of_sessions:
-                diffs = last_session_diff(session, diffs, filter_query)
-    elif num_of_sessions == 1:
-        diffs = last_session_diff(sessions_with_tags[0], diffs, filter_query)
-
-    return diffs
-
-
-def session_tag_difference(curr_session, prev_session, filter_query):
-    """
-    Calculate the difference of the installed SWID tags between
-    the two given sessions.
-
-    Args:
-        curr_session (apps.core.models.Session):
-            The current session
-
-        prev_session (apps.core.models.Session):
-            The session before
-
-    Returns:
-        A list of named tuples, consisting of a session object,
-        a tag object and an action (str) which is either '+' for
-        added or '-' for removed:
-            [
-                (session: session, action: '+', tag: tag),
-                (session: session, action: '-', tag: tag),
-                ...,
-            ]
-
-    """
-    curr_tag_ids = curr_session.tag_set.values_list('id', flat=True).order_by('id')
-    prev_tag_ids = prev_session.tag_set.values_list('id', flat=True).order_by('id')
-
-    added_ids = list(set(curr_tag_ids) - set(prev_tag_ids))
-    removed_ids = list(set(prev_tag_ids) - set(curr_tag_ids))
-
-    differences = []
-    DiffEntry = namedtuple('DiffEntry', ['session', 'action', 'tag'])
-
-    block_size = 980
-    for i in range(0, len(added_ids), block_size):
-        added_ids_slice = added_ids[i:i + block_size]
-        if filter_query:
-            added_tags = Tag.objects \
-                .filter(id__in=added_ids_slice, unique_id__icontains=filter_query) \
-                .defer('swid_xml')
-        else:
-            added_tags = Tag.objects.filter(id__in=added_ids_slice).defer('swid_xml')
-        for tag in added_tags:
-            entry = DiffEntry(curr_session, '+', tag)
-            differences.append(entry)
-
-    for i in range(0, len(removed_ids), block_size):
-        removed_ids_slice = removed_ids[i:i + block_size]
-        if filter_query:
-            removed_tags = Tag.objects \
-                .filter(id__in=removed_ids_slice, unique_id__icontains=filter_query) \
-                .defer('swid_xml')
-        else:
-            removed_tags = Tag.objects.filter(id__in=removed_ids_slice).defer('swid_xml')
-        for tag in removed_tags:
-            entry = DiffEntry(curr_session, '-', tag)
-            differences.append(entry)
-
-    return differences
-
-
-def last_session_diff(last_session, diff, filter_query):
-    """
-    Adds the tag difference for the last session in the list (or a single session).
-    There are two cases for a last/single session:
-    1. The session is the first session with SWID measurements.
-       -> All measured tags in this session will be listed as added.
-    2. The session has previous (not selected) sessions wiht SWID measurements
-       -> The tags which are added in this session will be listed as added.
-
-    Args:
-        last_session (apps.core.models.Session):
-            The last or sinlgle selected session of a tag diff.
-
-        diff (list of namedtuple (session, action, tag)):
-            The tagdiffs from newer sessions.
-
-        filter_quers (str):
-            Filter query.
+        filter_query (str):
+            Filter the tags (unique_id) by this string
 
     Returns:
-        A list of named tuples, consisting of a session object,
-        a tag object and an action (str) which is either '+' for
-        added or '-' for removed:
-            [
-                (session: session, action: '+', tag: tag),
-                (session: session, action: '-', tag: tag),
-                ...,
-            ]
+        A queryset of TagDiff objects, ordered by descending session time
+        and ascending tag ID.
 
     """
-    prev_sessions = Session.objects.filter(device=last_session.device,
-                                           tag__isnull=False, time__lt=last_session.time)
-    curr_diff = []
-    DiffEntry = namedtuple('DiffEntry', ['session', 'action', 'tag'])
-
-    if prev_sessions.count() > 0:
-        prev_session = prev_sessions.first()
-        curr_tag_ids = last_session.tag_set.values_list('id', flat=True).order_by('id')
-        prev_tag_ids = prev_session.tag_set.values_list('id', flat=True).order_by('id')
-
-        added_ids = list(set(curr_tag_ids) - set(prev_tag_ids))
-        block_size = 980
-        added_block_count = int(math.ceil(len(added_ids) / block_size))
-        for i in range(added_block_count):
-            added_ids_slice = added_ids[i * block_size: (i + 1) * block_size]
-            if filter_query:
-                added_tags = Tag.objects.filter(id__in=added_ids_slice, unique_id__icontains=filter_query)\
-                    .defer('swid_xml')
-            else:
-                added_tags = Tag.objects.filter(id__in=added_ids_slice).defer('swid_xml')
-            for tag in added_tags:
-                entry = DiffEntry(last_session, '+', tag)
-                curr_diff.append(entry)
-    else:
-        if filter_query:
-            tags = last_session.tag_set.filter(unique_id__icontains=filter_query).defer('swid_xml')
-        else:
-            tags = last_session.tag_set.all().defer('swid_xml')
-        for tag in tags:
-            entry = DiffEntry(last_session, '+', tag)
-            curr_diff.append(entry)
+    dt_from, dt_to = Device.get_day_range(from_timestamp, to_timestamp)
+    first_session = Session.objects.filter(device_id=device_id, time__gte=dt_from, time__lte=dt_to,
+                                           tag__isnull=False).order_by('time').values('pk')[:1]
 
-    diff.extend(curr_diff)
-    return diff
+    diffs = TagDiff.objects.filter(device_id=device_id, time__gte=dt_from, time__lte=dt_to) \
+        .exclude(session=Subquery(first_session), added=False)
+    if filter_query:
+        diffs = diffs.filter(tag__unique_id__icontains=filter_query)
+    return diffs.select_related('session', 'tag').order_by('-time', '-session_id', 'tag_id')
 
 
 def swid_inventory_session_list_producer(from_idx, to_idx, filter_query, dynamic_params, static_params=None):
     if not dynamic_params:
         return []
 
-    sessions = get_device_sessions(dynamic_params)[from_idx:to_idx]
+    sessions = get_device_sessions(dynamic_params).annotate(
+        tag_count=Coalesce('swid_stats__tag_count', 0),
+        new_tag_count=Coalesce('swid_stats__new_tag_count', 0))[from_idx:to_idx]
 
     for session in sessions:
-        installed_tags = Tag.get_installed_tags_with_time(session)
-        session.tag_count = installed_tags.count()
-        session.new_tag_count = installed_tags.filter(first_seen=session).count()
         session.has_tags = session.tag_count > 0
 
     return sessions
@@ -331,7 +222,7 @@ def swid_devices_list_producer(from_idx, to_idx, filter_query, dynamic_params, s
         return []
     tag_id = dynamic_params['tag_id']
     tagstats = TagStats.objects.filter(tag__pk=tag_id).select_related('last_seen', 'first_seen', 'device') \
-                       .defer('tag__swid_xml').order_by('device__description')
+        .order_by('device__description')
     return tagstats[from_idx:to_idx]
 
 
@@ -349,6 +240,9 @@ regid_list_paging = {
     'template_name': 'front/paging/default_list',
     'list_producer': regid_producer_factory.list(),
     'stat_producer': regid_producer_factory.stat(),
+    'page_producer': regid_producer_factory.page(),
+    'keyset': True,
+    'count_models': (Entity,),
     'url_name': 'swid:regid_detail',
     'page_size': 50,
 }
@@ -365,6 +259,9 @@ swid_list_paging = {
     'template_name': 'front/paging/default_list',
     'list_producer': swid_producer_factory.list(),
     'stat_producer': swid_producer_factory.stat(),
+    'page_producer': swid_producer_factory.page(),
+    'keyset': True,
+    'count_models': (Tag,),
     'url_name': 'swid:tag_detail',
     'page_size': 50,
 }
@@ -405,6 +302,7 @@ swid_log_list_paging = {
     'template_name': 'swid/paging/swid_log_list',
     'list_producer': swid_log_list_producer,
     'stat_producer': swid_log_stat_producer,
+    'keyset': True,
     'url_name': 'swid:tag_detail',
     'page_size': 50,
 }
@@ -1,17 +1,29 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+import codecs
+import gzip
+import lzma
+import os
+import re
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import django
 from django.db import transaction
+from django.db.models import Count, F
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
 from lxml import etree
 
+from apps.core import batching
 from apps.filesystem.models import Directory, File, FileHash, Algorithm
 from apps.devices.models import Product
 from apps.packages.models import Package, Version
-from apps.swid.models import Entity, EntityRole, TagStats
-from .models import Tag
+from apps.core.models import Session
+from apps.swid.models import Entity, EntityRole, Event, SessionStats, TagDiff, TagEvent, TagStats
+from .models import CANONICAL_PARSER_OPTIONS, Tag, TagXml
 
 """
 Maximum of nested <Directory> levels
@@ -31,18 +43,109 @@ NISTIR 8060 (n8060) namespace
 """
 MUTABLE = '{http://csrc.nist.gov/schema/swid/2015-extensions/swid-2015-extensions-1.0.xsd}mutable'
 
+"""
+Byte order mark and XML declaration at the start of a SWID tag document
+"""
+XML_DECLARATION = re.compile(br'\s*(?:\xef\xbb\xbf)?\s*(?:<\?xml\s[^>]*\?>\s*)?')
+XML_ENCODING = re.compile(br'encoding\s*=\s*["\']([A-Za-z][\w.-]*)["\']')
+
+"""
+End tag or empty element of the root element of a SWID tag document
+"""
+SWID_TAG_END = re.compile(br'</(?:[\w.-]+:)?SoftwareIdentity\s*>'
+                          br'|<(?:[\w.-]+:)?SoftwareIdentity(?:\s(?:[^>"\']|"[^"]*"|\'[^\']*\')*)?/>')
+
+"""
+Suffixes of the files read from a directory, compressed files are read too
+"""
+SWID_TAG_FILE_SUFFIXES = ('.swidtag', '.gz', '.xz')
+
+"""
+Hash attributes and the name of the corresponding Algorithm
+"""
+HASH_ALGORITHMS = (
+    (SHA1, 'SHA1'),
+    (SHA256, 'SHA256'),
+    (SHA384, 'SHA384'),
+    (SHA512, 'SHA512'),
+)
+
+"""
+A <File> element collected by the SwidParser
+"""
+FileEntry = namedtuple('FileEntry', ['directory', 'name', 'size', 'mutable', 'hashes'])
+
+"""
+The data of a SWID tag collected by the SwidParser
+"""
+ParsedTag = namedtuple('ParsedTag', ['package_name', 'version_str', 'unique_id', 'software_id',
+                                     'product', 'entities', 'files', 'swid_xml', 'digest'])
+
+"""
+Outcome of a single tag processed by process_swid_tags
+"""
+TagImportResult = namedtuple('TagImportResult', ['tag', 'replaced', 'error', 'unchanged'])
+
+
+class TagCache(object):
+    """
+    In-memory cache for the rows shared by the tags of an import.
+
+    Tags of the same distribution mostly reference the same packages,
+    products, entities, directories and hash algorithms, so these are
+    only looked up once per batch.
+    """
+
+    def __init__(self):
+        self.packages = {}
+        self.products = {}
+        self.entities = {}
+        self.algorithms = {}
+        self.directories = {}
+
+    def clear(self):
+        """
+        Forget all cached rows, e.g. after a rolled back transaction.
+        """
+        self.__init__()
+
+    def package(self, name):
+        if name not in self.packages:
+            self.packages[name], _ = Package.objects.get_or_create(name=name)
+        return self.packages[name]
+
+    def product(self, name):
+        if name not in self.products:
+            self.products[name], _ = Product.objects.get_or_create(name=name)
+        return self.products[name]
+
+    def entity(self, regid):
+        if regid not in self.entities:
+            self.entities[regid], _ = Entity.objects.get_or_create(regid=regid)
+        return self.entities[regid]
+
+    def algorithm(self, name):
+        if name not in self.algorithms:
+            self.algorithms[name], _ = Algorithm.objects.get_or_create(name=name)
+        return self.algorithms[name]
+
 
 class SwidParser(object):
     """
     A SAX-like target parser for SWID XML files.
+
+    The parser does not access the database, the collected data is stored
+    by :func:`store_swid_tag`.
     """
 
     def __init__(self):
-        self.tag = Tag()
+        self.package_name = None
+        self.version_str = None
+        self.unique_id = None
+        self.software_id = None
+        self.product = None
         self.entities = []
         self.files = []
-        self.package = None
-        self.version = None
         self.level = 0
         self.dir = ["" for x in range(MAX_LEVEL)]
 
@@ -54,24 +157,16 @@ class SwidParser(object):
         clean_tag = tag.split('}')[-1]  # Strip XSD part from tag name
         if clean_tag == 'SoftwareIdentity':
             # Store basic attributes
-            self.tag.package_name = attrib['name']
-            self.package, _ = Package.objects.get_or_create(name=self.tag.package_name)
-            self.tag.version_str = attrib['version']
+            self.package_name = attrib['name']
+            self.version_str = attrib['version']
             if 'tagId' in attrib:
-                self.tag.unique_id = attrib['tagId']
+                self.unique_id = attrib['tagId']
             else:
                 # Fallback to SWID draft standard
-                self.tag.unique_id = attrib['uniqueId']
+                self.unique_id = attrib['uniqueId']
         elif clean_tag == 'Meta':
             if 'product' in attrib:
-                product = attrib['product']
-                p, _ = Product.objects.get_or_create(name=product)
-                self.version, _ = Version.objects.get_or_create(product=p,
-                                    package=self.package, release=self.tag.version_str)
-                # Update time
-                self.version.time = timezone.now()
-                self.version.save()
-                self.tag.version = self.version
+                self.product = attrib['product']
         elif clean_tag == 'Directory':
             # Increment <Directory> level
             self.level += 1
@@ -90,9 +185,6 @@ class SwidParser(object):
                 # Fallback to SWID draft standard
                 dirname = attrib['location']
             filename = attrib['name']
-            d, _ = Directory.objects.get_or_create(path=dirname)
-            f, _ = File.objects.get_or_create(name=filename, directory=d)
-            self.files.append(f)
 
             size = None
             if 'size' in attrib:
@@ -103,26 +195,10 @@ class SwidParser(object):
                 if attrib[MUTABLE] == 'true':
                     mutable = True
 
-            if SHA1 in attrib:
-                a, _ = Algorithm.objects.get_or_create(name='SHA1')
-                h, _ = FileHash.objects.get_or_create(version=self.version,
-                           file=f, size=size, mutable=mutable, algorithm=a,
-                           hash=attrib[SHA1].lower())
-            if SHA256 in attrib:
-                a, _ = Algorithm.objects.get_or_create(name='SHA256')
-                h, _ = FileHash.objects.get_or_create(version=self.version,
-                           file=f, size=size, mutable=mutable, algorithm=a,
-                           hash=attrib[SHA256].lower())
-            if SHA384 in attrib:
-                a, _ = Algorithm.objects.get_or_create(name='SHA384')
-                h, _ = FileHash.objects.get_or_create(version=self.version,
-                           file=f, size=size, mutable=mutable, algorithm=a,
-                           hash=attrib[SHA384].lower())
-            if SHA512 in attrib:
-                a, _ = Algorithm.objects.get_or_create(name='SHA512')
-                h, _ = FileHash.objects.get_or_create(version=self.version,
-                           file=f, size=size, mutable=mutable, algorithm=a,
-                           hash=attrib[SHA512].lower())
+            # Directories, files and hashes are stored in bulk after parsing
+            hashes = [(algorithm, attrib[attr].lower())
+                      for attr, algorithm in HASH_ALGORITHMS if attr in attrib]
+            self.files.append(FileEntry(dirname, filename, size, mutable, hashes))
 
         elif clean_tag == 'Entity':
             # Store entities
@@ -130,17 +206,12 @@ class SwidParser(object):
             name = attrib['name']
             roles = attrib['role']
             for role in roles.split():
-                entity, _ = Entity.objects.get_or_create(regid=regid)
-                entity.name = name
-
                 role_id = EntityRole.xml_attr_to_choice(role)
-                entity_role = EntityRole()
-                entity_role.role = role_id
-                self.entities.append((entity, entity_role))
+                self.entities.append((regid, name, role_id))
 
                 # Use regid of last entity with tagCreator role to construct software-id
                 if role_id == EntityRole.TAG_CREATOR:
-                    self.tag.software_id = '%s__%s' % (regid, self.tag.unique_id)
+                    self.software_id = '%s__%s' % (regid, self.unique_id)
 
     def end(self, tag):
         clean_tag = tag.split('}')[-1]  # Strip XSD part from tag name
@@ -151,14 +222,66 @@ class SwidParser(object):
         """
         Fired when parsing is complete.
         """
-        if not self.tag.software_id:
+        if not self.software_id:
             msg = 'A SWID tag (%s) without a `tagCreator` entity is currently not supported.'
-            raise ValueError(msg % self.tag.unique_id)
-        return self.tag, self.files, self.entities
+            raise ValueError(msg % self.unique_id)
+        return ParsedTag(self.package_name, self.version_str, self.unique_id,
+                         self.software_id, self.product, self.entities, self.files, None, None)
 
 
-@transaction.atomic
-def process_swid_tag(tag_xml, allow_tag_update=False):
+def parse_swid_tag(tag_xml, prettify=False):
+    """
+    Parse a SWID XML tag without accessing the database.
+
+    The parsed tree is walked to collect the tag data and to compute the
+    digest of the XML (see :meth:`TagXml.get_digest`), so storing the tag
+    does not parse it again. By default the document is only parsed once and
+    the XML is stored as given, it is prettified on display (see
+    :func:`prettify_xml`). If ``prettify`` is set, the tree is serialized as
+    indented XML, whose digest is computed from the result.
+
+    Args:
+       tag_xml (unicode):
+           The SWID tag as an XML string, or as UTF-8 encoded bytes
+           (see :func:`read_swid_tags`).
+       prettify (bool):
+           Whether the XML stored with the tag gets prettified.
+
+    Returns:
+       A :data:`ParsedTag` containing the (prettified) XML and its digest.
+
+    Raises:
+       ValueError: If the tag is invalid or not well-formed XML.
+
+    """
+    if isinstance(tag_xml, bytes):
+        xml_bytes, tag_xml = tag_xml, tag_xml.decode('utf-8')
+    else:
+        xml_bytes = tag_xml.encode('utf-8')
+    try:
+        # The prettified XML keeps the whitespace of the input, like prettify_xml()
+        parser = etree.XMLParser() if prettify else etree.XMLParser(**CANONICAL_PARSER_OPTIONS)
+        root = etree.fromstring(xml_bytes, parser)
+        target = SwidParser()
+        for event, element in etree.iterwalk(root, events=('start', 'end'), tag='*'):
+            if event == 'start':
+                target.start(element.tag, element.attrib)
+            else:
+                target.end(element.tag)
+        parsed = target.close()
+    except KeyError as ke:
+        raise ValueError('Invalid tag: missing %s property' % ke.args[0])
+    except etree.XMLSyntaxError as e:
+        raise ValueError('Invalid XML: %s' % e)
+    if not prettify:
+        return parsed._replace(swid_xml=tag_xml, digest=TagXml.get_tree_digest(root))
+
+    swid_xml = etree.tostring(root, pretty_print=True, xml_declaration=True,
+                              encoding='UTF-8').decode('utf-8')
+    return parsed._replace(swid_xml=swid_xml, digest=TagXml.get_digest(swid_xml))
+
+
+def process_swid_tag(tag_xml, allow_tag_update=False, cache=None, prettify=False):
     """
     Parse a SWID XML tag and store the contained elements in the database.
 
@@ -172,67 +295,134 @@ def process_swid_tag(tag_xml, allow_tag_update=False):
            The SWID tag as an XML string.
        allow_tag_update (bool):
             If the tag already exists its data gets overwritten.
+       cache (TagCache):
+            Optional cache shared with other tags of the same import.
+       prettify (bool):
+            Whether the XML stored with the tag gets prettified.
 
     Returns:
        A tuple containing the newly created Tag model instance and a flag
        whether a pre-existing tag was replaced or not.
 
     """
-    # Instantiate parser
-    parser_target = SwidParser()
-    parser = etree.XMLParser(target=parser_target, ns_clean=True)
+    return store_swid_tag(parse_swid_tag(tag_xml, prettify), allow_tag_update, cache)
 
-    # Parse XML, save tag into database
-    try:
-        tag, files, entities = etree.fromstring(tag_xml.encode('utf-8'), parser)
-    except KeyError as ke:
-        raise ValueError('Invalid tag: missing %s property' % ke.message)
 
-    tag.swid_xml = prettify_xml(tag_xml)
+def store_swid_tag(parsed, allow_tag_update=False, cache=None):
+    """
+    Store a tag returned by :func:`parse_swid_tag` in the database.
+
+    All database changes run in a transaction. When an error occurs, the
+    database remains unchanged.
+
+    Args:
+       parsed (ParsedTag):
+           The parsed SWID tag.
+       allow_tag_update (bool):
+            If the tag already exists its data gets overwritten.
+       cache (TagCache):
+            Optional cache shared with other tags of the same import.
+
+    Returns:
+       A tuple containing the newly created Tag model instance and a flag
+       whether a pre-existing tag was replaced or not. An existing tag that
+       is unchanged (or may not be updated) is not replaced.
+
+    """
+    tag, replaced, _ = _store_swid_tag(parsed, allow_tag_update, cache)
+    return tag, replaced
+
+
+@transaction.atomic
+def _store_swid_tag(parsed, allow_tag_update=False, cache=None):
+    """
+    Store a parsed tag, see :func:`store_swid_tag`. Returns a tuple of the
+    tag, whether it was replaced and whether an existing tag was kept as is.
+    """
+    if cache is None:
+        cache = TagCache()
+
+    tag = Tag(package_name=parsed.package_name, version_str=parsed.version_str,
+              unique_id=parsed.unique_id, software_id=parsed.software_id,
+              software_id_hash=Tag.hash_software_id(parsed.software_id))
+    package = cache.package(parsed.package_name)
+    if parsed.product is not None:
+        product = cache.product(parsed.product)
+        version, _ = Version.objects.get_or_create(product=product,
+                        package=package, release=parsed.version_str)
+        # Update time
+        version.time = timezone.now()
+        version.save()
+        tag.version = version
+
+    entities = []
+    for regid, name, role_id in parsed.entities:
+        entity = cache.entity(regid)
+        entity.name = name
+        entities.append((entity, EntityRole(role=role_id)))
+
+    # The digest is computed while parsing, possibly in a worker process
+    digest = parsed.digest or TagXml.get_digest(parsed.swid_xml)
 
     # Check whether tag already exists
     try:
-        old_tag = Tag.objects.get(software_id=tag.software_id)
-    # Tag doesn't exist, create a new one later on
+        old_tag = Tag.objects.with_software_id(tag.software_id) \
+            .select_related('xml').defer('xml__xml').get()
     except Tag.DoesNotExist:
+        old_tag = None
+        unchanged = False
+    else:
+        unchanged = old_tag.version_id == tag.version_id and old_tag.xml.digest == digest
+
+    # Tag already exists but updates are not allowed, or it is unchanged
+    if old_tag is not None and (unchanged or not allow_tag_update):
+        # The tag will not be changed, but we want to make sure
+        # that the entities have the right name.
+        for entity, _ in entities:
+            Entity.objects.filter(pk=entity.pk).update(name=entity.name)
+
+        # Tag needs to be reloaded after entity updates
+        return Tag.objects.get(pk=old_tag.pk), False, True
+
+    files = store_files(parsed.files, tag.version, cache)
+
+    if old_tag is None:
         replaced = False
-    # Tag exists already
     else:
-        # Tag already exists but updates are not allowed
-        if not allow_tag_update:
-            replaced = False
-            # The tag will not be changed, but we want to make sure
-            # that the entities have the right name.
-            for entity, _ in entities:
-                Entity.objects.filter(pk=entity.pk).update(name=entity.name)
-
-            # Tag needs to be reloaded after entity updates
-            return Tag.objects.get(pk=old_tag.pk), replaced
         # Update tag with new information
         old_tag.package_name = tag.package_name
         old_tag.version_str = tag.version_str
         old_tag.version = tag.version
         old_tag.unique_id = tag.unique_id
-        old_tag.files.clear()
-        chunked_bulk_add(old_tag.files, files, 980)
-        old_tag.swid_xml = tag.swid_xml
         tag = old_tag
-        tag.entity_set.clear()
         replaced = True
 
+    # Identical XML is only stored once, an unchanged tag keeps its entry
+    old_xml_id = tag.xml_id
+    tag.xml = TagXml.get_or_create_for(parsed.swid_xml, digest)
+
     # Validate and save tag and entity
     try:
         tag.full_clean()
         tag.save()  # We need to save before we can add many-to-many relations
 
-        # Add entities
+        # Add entities, only roles that changed are touched for a replaced tag
+        old_roles = set()
+        if replaced:
+            old_roles = set(tag.entityrole_set.values_list('entity_id', 'role'))
+        new_roles = set()
         for entity, entity_role in entities:
             entity.full_clean()
             entity.save()
+            new_roles.add((entity.pk, entity_role.role))
+            if (entity.pk, entity_role.role) in old_roles:
+                continue
             entity_role.tag = tag
             entity_role.entity = entity
             entity_role.full_clean()
             entity_role.save()
+        for entity_id, role in old_roles - new_roles:
+            EntityRole.objects.filter(tag=tag, entity_id=entity_id, role=role).delete()
     except ValidationError as e:
         msgs = []
         for field, errors in e.error_dict.items():
@@ -240,11 +430,324 @@ def process_swid_tag(tag_xml, allow_tag_update=False):
             msgs.append('%s: %s' % (field, error_str))
         raise ValueError(' '.join(msgs))
 
-    # SQLite does not support >999 SQL parameters per query, so we need
-    # to do manual chunking.
-    chunked_bulk_add(tag.files, files, 980)
+    if old_xml_id is not None and old_xml_id != tag.xml_id:
+        TagXml.delete_unused([old_xml_id])
 
-    return tag, replaced
+    # Only add and remove the files that changed for a replaced tag
+    if replaced:
+        old_files = set(tag.files.values_list('pk', flat=True))
+        removed = list(old_files.difference(files))
+        for removed_slice in batching.batches(removed, batching.batch_size(tag.files.db)):
+            tag.files.remove(*removed_slice)
+        files = [f for f in files if f not in old_files]
+
+    chunked_bulk_add(tag.files, files)
+
+    return tag, replaced, False
+
+
+def process_swid_tags(tags_xml, allow_tag_update=False, workers=1, prettify=False):
+    """
+    Parse multiple SWID XML tags and store them in the database.
+
+    The tags share a :class:`TagCache`, so rows referenced by several tags
+    are only resolved once. Each tag is stored in its own transaction
+    (see :func:`store_swid_tag`), an invalid tag does not affect the others.
+
+    With more than one worker, the tags are parsed in a process pool (see
+    :func:`parse_swid_tags`) while they are stored in the calling process.
+
+    Args:
+       tags_xml (iterable):
+           The SWID tags as XML strings or UTF-8 encoded bytes.
+       allow_tag_update (bool):
+            If a tag already exists its data gets overwritten.
+       workers (int):
+            Number of processes used to parse the tags.
+       prettify (bool):
+            Whether the XML stored with the tags gets prettified.
+
+    Yields:
+       A :data:`TagImportResult` per tag, containing either the Tag model
+       instance, the replaced flag and whether an existing tag was kept
+       unchanged, or the ``ValueError`` raised for an invalid tag.
+
+    """
+    cache = TagCache()
+    for parsed, error in parse_swid_tags(tags_xml, workers, prettify=prettify):
+        if error:
+            yield TagImportResult(None, False, error, False)
+            continue
+        try:
+            tag, replaced, unchanged = _store_swid_tag(parsed, allow_tag_update, cache)
+        except ValueError as e:
+            # Cached rows might have been created in the rolled back transaction
+            cache.clear()
+            yield TagImportResult(None, False, e, False)
+        else:
+            yield TagImportResult(tag, replaced, None, unchanged)
+
+
+def parse_swid_tags(tags_xml, workers=1, queue_size=None, prettify=False):
+    """
+    Parse multiple SWID XML tags, optionally in a process pool.
+
+    The tags are consumed lazily. At most ``queue_size`` tags are parsed
+    ahead of the consumer, so memory usage does not depend on the number
+    of tags.
+
+    Args:
+       tags_xml (iterable):
+           The SWID tags as XML strings or UTF-8 encoded bytes.
+       workers (int):
+            Number of processes used to parse the tags. With a single
+            worker the tags are parsed in the calling process.
+       queue_size (int):
+            Maximum number of pending tags, defaults to 16 per worker.
+       prettify (bool):
+            Whether the XML stored with the tags gets prettified.
+
+    Yields:
+       A tuple ``(parsed, error)`` per tag, in the order of the input.
+
+    """
+    if workers <= 1:
+        for tag_xml in tags_xml:
+            yield _parse_swid_tag(tag_xml, prettify)
+        return
+
+    if queue_size is None:
+        queue_size = 16 * workers
+    with ProcessPoolExecutor(workers, initializer=django.setup) as executor:
+        pending = deque()
+        for tag_xml in tags_xml:
+            if len(pending) >= queue_size:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_parse_swid_tag, tag_xml, prettify))
+        while pending:
+            yield pending.popleft().result()
+
+
+def _parse_swid_tag(tag_xml, prettify=False):
+    """
+    Parse a SWID tag, returning errors instead of raising them.
+    """
+    try:
+        return parse_swid_tag(tag_xml, prettify), None
+    except ValueError as e:
+        return None, e
+
+
+def read_swid_tags(path):
+    """
+    Read SWID tags from a file or a directory.
+
+    A file may contain any number of concatenated ``SoftwareIdentity``
+    documents (e.g. one per line), and may be gzip or xz compressed. For a
+    directory, all ``.swidtag``, ``.gz`` and ``.xz`` files in it and its
+    subdirectories are read.
+
+    The input is read in chunks and split at the end of every tag without
+    parsing it (see :class:`SwidTagStream`), so memory usage does not depend
+    on the size of the input, and with multiple workers the tags are only
+    parsed in the worker processes. Tags that are not well-formed are
+    reported by :func:`parse_swid_tag`.
+
+    Args:
+        path (str):
+            Path to a file or a directory.
+
+    Yields:
+        The SWID tags as UTF-8 encoded XML bytes.
+
+    Raises:
+        ValueError: If a tag declares an unknown encoding or cannot be
+            decoded with it.
+
+    """
+    if os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(SWID_TAG_FILE_SUFFIXES):
+                    for tag_xml in read_swid_tags(os.path.join(dirpath, filename)):
+                        yield tag_xml
+        return
+
+    with _open_tag_file(path) as f:
+        for tag_xml in SwidTagStream(f):
+            yield tag_xml
+
+
+def _open_tag_file(path):
+    """
+    Open a file in binary mode, transparently decompressing gzip and xz files.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    if magic.startswith(b'\x1f\x8b'):
+        return gzip.open(path, 'rb')
+    if magic == b'\xfd7zXZ\x00':
+        return lzma.open(path, 'rb')
+    return open(path, 'rb')
+
+
+class SwidTagStream(object):
+    """
+    Iterator splitting concatenated SWID tags into separate documents,
+    without parsing them.
+
+    A document ends with the end tag of its ``SoftwareIdentity`` root element
+    (or the root element itself, if it is empty). The byte order marks and
+    XML declarations at the start of every tag are removed, and tags not
+    encoded in UTF-8 are converted from the encoding declared there (only
+    ASCII compatible encodings are supported).
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, f):
+        self.f = f
+
+    def __iter__(self):
+        raw = b''
+        pos = 0  # Where the search for the end of the document continues
+        encoding = None  # None at the start of a document
+        eof = False
+        while not eof:
+            chunk = self.f.read(self.chunk_size)
+            eof = not chunk
+            raw += chunk
+            start = 0
+            while start < len(raw):
+                if encoding is None:
+                    if not eof and raw.find(b'>', start) == -1:
+                        break  # The declaration might continue in the next chunk
+                    match = XML_DECLARATION.match(raw, start)
+                    encoding = XML_ENCODING.search(match.group(0))
+                    encoding = self._lookup(encoding.group(1).decode('ascii') if encoding else 'utf-8')
+                    start = pos = match.end()
+                    continue
+
+                end = SWID_TAG_END.search(raw, pos)
+                if end is None:
+                    # An incomplete markup at the end might be the end tag
+                    pos = max(raw.rfind(b'<', start), start)
+                    break
+                yield self._encode(raw[start:end.end()], encoding)
+                start = pos = end.end()
+                encoding = None
+            raw = raw[start:]
+            pos -= start
+
+        # Incomplete documents are left to the parser to report
+        if raw.strip():
+            yield self._encode(raw, encoding or 'utf-8')
+
+    @staticmethod
+    def _lookup(encoding):
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            raise ValueError('Unknown encoding %s' % encoding)
+
+    @staticmethod
+    def _encode(data, encoding):
+        if encoding == 'utf-8':
+            return data
+        return data.decode(encoding).encode('utf-8')
+
+
+def store_files(file_entries, version, cache=None):
+    """
+    Store the directories, files and file hashes collected by the
+    :class:`SwidParser` in the database.
+
+    Instead of a ``get_or_create`` per element, the existing rows are looked
+    up in chunks and the missing ones are inserted with ``bulk_create``. The
+    resulting rows are the same as if each element was handled individually.
+
+    Args:
+        file_entries (list):
+            The :class:`FileEntry` tuples of a parsed tag.
+        version (apps.packages.models.Version):
+            The version the file hashes belong to, might be None.
+        cache (TagCache):
+            Optional cache for directories and hash algorithms.
+
+    Returns:
+        A list containing the primary keys of all files of the tag.
+
+    """
+    if not file_entries:
+        return []
+    if cache is None:
+        cache = TagCache()
+
+    # Directories
+    dir_ids = cache.directories
+    paths = [p for p in OrderedDict.fromkeys(e.directory for e in file_entries)
+             if p not in dir_ids]
+    dir_qs = Directory.objects.values_list('path', 'pk')
+    dir_ids.update(chunked_filter_in(dir_qs, 'path', paths))
+    missing_paths = [p for p in paths if p not in dir_ids]
+    if missing_paths:
+        Directory.objects.bulk_create([Directory(path=p) for p in missing_paths],
+                                      ignore_conflicts=True)
+        dir_ids.update(chunked_filter_in(dir_qs, 'path', missing_paths))
+
+    # Files
+    file_keys = list(OrderedDict.fromkeys((dir_ids[e.directory], e.name) for e in file_entries))
+    file_ids = _lookup_files(file_keys)
+    missing_files = [k for k in file_keys if k not in file_ids]
+    if missing_files:
+        File.objects.bulk_create([File(directory_id=d, name=n) for d, n in missing_files])
+        file_ids.update(_lookup_files(missing_files))
+
+    # File hashes
+    algorithms = OrderedDict.fromkeys(a for e in file_entries for a, _ in e.hashes)
+    for name in algorithms:
+        algorithms[name] = cache.algorithm(name)
+
+    hash_keys = OrderedDict()
+    for e in file_entries:
+        file_id = file_ids[(dir_ids[e.directory], e.name)]
+        for algorithm, value in e.hashes:
+            hash_keys[(file_id, e.size, e.mutable, algorithms[algorithm].pk, value)] = None
+    if hash_keys:
+        hash_qs = FileHash.objects.filter(version=version) \
+            .values_list('file_id', 'size', 'mutable', 'algorithm_id', 'hash')
+        hashed_file_ids = list(OrderedDict.fromkeys(k[0] for k in hash_keys))
+        existing = set(chunked_filter_in(hash_qs, 'file_id', hashed_file_ids))
+        FileHash.objects.bulk_create([
+            FileHash(version=version, file_id=file_id, size=size, mutable=mutable,
+                     algorithm_id=algorithm_id, hash=value)
+            for file_id, size, mutable, algorithm_id, value in hash_keys
+            if (file_id, size, mutable, algorithm_id, value) not in existing
+        ])
+
+    return [file_ids[(dir_ids[e.directory], e.name)] for e in file_entries]
+
+
+def _lookup_files(file_keys):
+    """
+    Look up the primary keys of the given ``(directory_id, name)`` pairs.
+
+    If a file exists more than once, the oldest one is used.
+
+    """
+    dir_ids = list(OrderedDict.fromkeys(d for d, _ in file_keys))
+    names = list(OrderedDict.fromkeys(n for _, n in file_keys))
+    wanted = set(file_keys)
+    found = {}
+    # Split the parameters between the two IN clauses
+    block_size = batching.batch_size(File.objects.db, params_per_item=2)
+    for dir_ids_slice in batching.batches(dir_ids, block_size):
+        file_qs = File.objects.filter(directory_id__in=dir_ids_slice) \
+            .values_list('directory_id', 'name', 'pk').order_by('-pk')
+        for dir_id, name, pk in chunked_filter_in(file_qs, 'name', names, block_size):
+            if (dir_id, name) in wanted:
+                found[(dir_id, name)] = pk
+    return found
 
 
 def prettify_xml(xml, xml_declaration=True):
@@ -269,7 +772,24 @@ def prettify_xml(xml, xml_declaration=True):
                           encoding='UTF-8').decode('utf-8')
 
 
-def chunked_bulk_add(manager, objects, block_size):
+def resolve_software_ids(software_ids):
+    """
+    Look up the tags with the given Software IDs via the hash column.
+
+    Args:
+        software_ids (list):
+            The Software IDs to resolve.
+
+    Returns:
+        A tuple ``(found, missing)`` of a dict mapping Software IDs to tag
+        IDs and a list of the Software IDs without tag, in input order.
+
+    """
+    return batching.resolve(Tag, 'software_id', software_ids,
+                            key_field='software_id_hash', key=Tag.hash_software_id)
+
+
+def chunked_bulk_add(manager, objects, block_size=None):
     """
     Add items to a reverse FK relation in chunks.
 
@@ -279,15 +799,17 @@ def chunked_bulk_add(manager, objects, block_size):
         objects:
             The objects to add to the target model.
         block_size:
-            Number of objects per block.
+            Number of objects per block, determined from the database by
+            default (see :func:`apps.core.batching.batch_size`).
 
     """
-    for i in range(0, len(objects), block_size):
-        pk_slice = objects[i:i + block_size]
+    if block_size is None:
+        block_size = batching.batch_size(manager.db)
+    for pk_slice in batching.batches(list(objects), block_size):
         manager.add(*pk_slice)
 
 
-def chunked_filter_in(queryset, filter_field, filter_list, block_size):
+def chunked_filter_in(queryset, filter_field, filter_list, block_size=None):
     """
     Select items from an ``field__in=filter_list`` filtered queryset in
     multiple queries.
@@ -312,36 +834,254 @@ def chunked_filter_in(queryset, filter_field, filter_list, block_size):
             The list of values for the ``IN`` filtering. This is the list that
             will be chunked.
         block_size:
-            The number of items to filter by per query.
+            The number of items to filter by per query, determined from the
+            database by default (see :func:`apps.core.batching.filter_in`).
 
     Returns:
         Return a list containing all the items from all the querysets.
 
     """
-    out = []
-    for i in range(0, len(filter_list), block_size):
-        filter_slice = filter_list[i:i + block_size]
-        kwargs = {filter_field + '__in': filter_slice}
-        items = list(queryset.filter(**kwargs))
-        out.extend(items)
-    return out
+    return batching.filter_in(queryset, filter_field, filter_list, block_size)
 
 
 def update_tag_stats(session, tag_ids):
-    new_tags = []
-    block_size = 980
-    for i in range(0, len(tag_ids), block_size):
-        tag_ids_slice = tag_ids[i:i + block_size]
-        # TODO: Instead of filtering the device tags, a list of all tags for a
-        # device could be created outside of the loop.
-        existing_tags = TagStats.objects.filter(device__pk=session.device_id,
-                                                tag__pk__in=tag_ids_slice)
-        new_tags.extend(set(tag_ids_slice) - set(existing_tags.values_list('tag__pk', flat=True)))
-        existing_tags.update(last_seen=session)
+    """
+    Create or update the tag stats of the session's device for the given tags.
+
+    The tags with stats of the device are loaded once. Missing stats are
+    created in bulk and ``last_seen`` of the existing ones is updated in a
+    single query where possible: usually most of the device's tags are
+    measured, so all its stats but the ones of unmeasured tags are updated.
+
+    Args:
+        session (apps.core.models.Session):
+            The session the tags were measured in.
+        tag_ids (iterable):
+            The IDs of the measured tags.
+
+    """
+    device_stats = TagStats.objects.filter(device_id=session.device_id)
+    block_size = batching.batch_size(device_stats.db)
+    device_tags = set(device_stats.values_list('tag_id', flat=True))
+    tag_ids = set(tag_ids)
+    existing_tags = tag_ids & device_tags
+    unmeasured_tags = device_tags - tag_ids
+
+    if existing_tags and len(unmeasured_tags) < len(existing_tags) and \
+            (block_size is None or len(unmeasured_tags) <= block_size):
+        device_stats.exclude(tag_id__in=unmeasured_tags).update(last_seen=session)
+    else:
+        for tag_ids_slice in batching.batches(sorted(existing_tags), block_size):
+            device_stats.filter(tag_id__any_in=tag_ids_slice).update(last_seen=session)
 
     # Chunked create is done by default for sqlite,
     # see https://docs.djangoproject.com/en/dev/ref/models/querysets/#bulk-create
     TagStats.objects.bulk_create([
-        TagStats(tag_id=t, device=session.device, first_seen=session, last_seen=session)
-        for t in new_tags]
+        TagStats(tag_id=t, device_id=session.device_id, first_seen=session, last_seen=session)
+        for t in sorted(tag_ids - device_tags)]
     )
+
+
+def update_session_stats(sessions):
+    """
+    Store the number of measured and first reported tags of sessions.
+
+    A tag counts as first reported in a session if it was measured in the
+    session and the tag stats of the session's device were created by it.
+    Sessions without measured tags get no stats. Called again after SWID
+    events are stored, which create tag stats too.
+
+    Args:
+        sessions (django.db.models.QuerySet):
+            The sessions to update.
+
+    Returns:
+        The number of sessions with measured tags.
+
+    """
+    sessions = sessions.order_by()
+    tag_counts = dict(sessions.filter(tag__isnull=False).values_list('pk').annotate(Count('tag')))
+    if not tag_counts:
+        SessionStats.objects.filter(session__in=sessions).delete()
+        return 0
+    new_tags = TagStats.objects.filter(first_seen__in=sessions, device=F('first_seen__device'),
+                                       tag__sessions=F('first_seen'))
+    new_tag_counts = dict(new_tags.order_by().values_list('first_seen').annotate(Count('pk')))
+    with transaction.atomic():
+        SessionStats.objects.filter(session__in=sessions).delete()
+        SessionStats.objects.bulk_create([
+            SessionStats(session_id=session_id, tag_count=tag_count,
+                         new_tag_count=new_tag_counts.get(session_id, 0))
+            for session_id, tag_count in tag_counts.items()
+        ])
+    return len(tag_counts)
+
+
+def update_tag_diffs(session):
+    """
+    Store the tags added and removed in a session with SWID measurement.
+
+    The diff of the next measured session of the device is updated as
+    well, in case the session is older than the latest measurement.
+
+    Args:
+        session (apps.core.models.Session):
+            The session the tags were measured in.
+
+    """
+    measured_sessions = Session.objects.filter(device_id=session.device_id, tag__isnull=False)
+    prev_session = measured_sessions.filter(time__lt=session.time).order_by('-time').first()
+    next_session = measured_sessions.filter(time__gt=session.time).order_by('time').first()
+
+    tag_ids = set(session.tag_set.values_list('pk', flat=True))
+    prev_tag_ids = set(prev_session.tag_set.values_list('pk', flat=True)) if prev_session else set()
+    sessions = [session]
+    diffs = _make_tag_diffs(session, prev_tag_ids, tag_ids)
+    if next_session:
+        next_tag_ids = set(next_session.tag_set.values_list('pk', flat=True))
+        sessions.append(next_session)
+        diffs.extend(_make_tag_diffs(next_session, tag_ids, next_tag_ids))
+
+    with transaction.atomic():
+        TagDiff.objects.filter(session__in=sessions).delete()
+        TagDiff.objects.bulk_create(diffs)
+
+
+def update_tag_diffs_after_delete(sender, instance, **kwargs):
+    """
+    ``post_delete`` handler updating the diff of the next measured session
+    of the device after a session was deleted, the diff might still be
+    relative to the deleted session.
+    """
+    next_session = Session.objects.filter(device_id=instance.device_id, time__gt=instance.time,
+                                          tag__isnull=False).order_by('time').first()
+    if next_session:
+        update_tag_diffs(next_session)
+
+
+def rebuild_tag_diffs(device_id):
+    """
+    Compute the added and removed tags of all measured sessions of a device.
+
+    Args:
+        device_id (int):
+            The device ID.
+
+    Returns:
+        The number of stored diff entries.
+
+    """
+    tag_sets = {}
+    links = Tag.sessions.through.objects.filter(session__device_id=device_id)
+    for session_id, tag_id in links.values_list('session_id', 'tag_id'):
+        tag_sets.setdefault(session_id, set()).add(tag_id)
+    sessions = Session.objects.filter(pk__in=tag_sets.keys()).order_by('time')
+
+    diffs = []
+    prev_tag_ids = set()
+    for session in sessions:
+        tag_ids = tag_sets[session.pk]
+        diffs.extend(_make_tag_diffs(session, prev_tag_ids, tag_ids))
+        prev_tag_ids = tag_ids
+
+    with transaction.atomic():
+        TagDiff.objects.filter(device_id=device_id).delete()
+        TagDiff.objects.bulk_create(diffs)
+    return len(diffs)
+
+
+def _make_tag_diffs(session, prev_tag_ids, tag_ids):
+    return [
+        TagDiff(device_id=session.device_id, session=session, time=session.time,
+                tag_id=tag_id, added=added)
+        for added, changed in ((True, tag_ids - prev_tag_ids), (False, prev_tag_ids - tag_ids))
+        for tag_id in sorted(changed)
+    ]
+
+
+def store_swid_events(session, epoch, events, tag_ids):
+    """
+    Store the SWID events reported by a device and update its tag stats.
+
+    Events, tag events and tag stats are looked up and written in bulk. The
+    result is the same as if the events were stored one after another, the
+    first event of a tag creates its missing tag stats and the last one
+    decides about ``last_deleted``.
+
+    Args:
+        session (apps.core.models.Session):
+            The session the events were reported in.
+        epoch (int):
+            The event epoch of the device.
+        events (list):
+            The events as dicts with ``eid``, ``timestamp``, ``recordId``,
+            ``sourceId``, ``action`` and ``softwareId`` keys.
+        tag_ids (dict):
+            The tag IDs by software ID, for all tags of the events.
+
+    """
+    timestamp_field = Event._meta.get_field('timestamp')
+    event_keys = []
+    for e in events:
+        timestamp = timestamp_field.get_prep_value(timestamp_field.to_python(e['timestamp']))
+        event_keys.append((e['eid'], timestamp))
+
+    # Create missing events, their primary keys are not returned by
+    # bulk_create on all backends, so look them up again.
+    device_events = Event.objects.filter(device_id=session.device_id, epoch=epoch) \
+        .values_list('eid', 'timestamp', 'pk')
+    eids = list(set(eid for eid, _ in event_keys))
+
+    def lookup_events():
+        found = chunked_filter_in(device_events, 'eid', eids)
+        return {(eid, timestamp): pk for eid, timestamp, pk in found}
+
+    event_ids = lookup_events()
+    new_events = [Event(device_id=session.device_id, epoch=epoch, eid=eid, timestamp=timestamp)
+                  for eid, timestamp in OrderedDict.fromkeys(event_keys)
+                  if (eid, timestamp) not in event_ids]
+    if new_events:
+        Event.objects.bulk_create(new_events)
+        event_ids = lookup_events()
+
+    # Create missing tag events
+    tag_event_keys = [(event_ids[key], tag_ids[e['softwareId']], e['recordId'], e['sourceId'], e['action'])
+                      for key, e in zip(event_keys, events)]
+    tag_events = TagEvent.objects.values_list('event_id', 'tag_id', 'record_id', 'source_id', 'action')
+    existing_tag_events = set(chunked_filter_in(tag_events, 'event_id',
+                                                list(set(event_ids.values()))))
+    TagEvent.objects.bulk_create([
+        TagEvent(event_id=event_id, tag_id=tag_id, record_id=record_id, source_id=source_id,
+                 action=action)
+        for event_id, tag_id, record_id, source_id, action in OrderedDict.fromkeys(tag_event_keys)
+        if (event_id, tag_id, record_id, source_id, action) not in existing_tag_events
+    ])
+
+    # Update tag stats
+    first_installed = OrderedDict()
+    last_deleted = {}
+    event_count = {}
+    for event_id, tag_id, _, _, action in tag_event_keys:
+        first_installed.setdefault(tag_id, event_id)
+        last_deleted[tag_id] = None if action == TagEvent.CREATION else event_id
+        event_count[tag_id] = event_count.get(tag_id, 0) + 1
+
+    device_stats = TagStats.objects.filter(device_id=session.device_id)
+    existing_tags = set(chunked_filter_in(device_stats.values_list('tag_id', flat=True),
+                                          'tag_id', list(first_installed)))
+    TagStats.objects.bulk_create([
+        TagStats(tag_id=tag_id, device_id=session.device_id, first_seen=session,
+                 last_seen=session, first_installed_id=event_id,
+                 last_deleted_id=last_deleted[tag_id] if event_count[tag_id] > 1 else None)
+        for tag_id, event_id in first_installed.items() if tag_id not in existing_tags
+    ])
+
+    # One update per distinct last_deleted value
+    updates = {}
+    for tag_id in existing_tags:
+        updates.setdefault(last_deleted[tag_id], []).append(tag_id)
+    block_size = batching.batch_size(device_stats.db)
+    for event_id, event_tag_ids in updates.items():
+        for tag_ids_slice in batching.batches(event_tag_ids, block_size):
+            device_stats.filter(tag_id__any_in=tag_ids_slice) \
+                .update(last_seen=session, last_deleted_id=event_id)
@@ -33,12 +33,15 @@ class SwidTagListView(LoginRequiredMixin, ListView):
 
 class SwidTagDetailView(LoginRequiredMixin, DetailView):
     model = Tag
+    queryset = Tag.objects.select_related('xml')
     template_name = 'swid/tags_detail.html'
 
     def get_context_data(self, **kwargs):
         context = super(SwidTagDetailView, self).get_context_data(**kwargs)
         context['paging_args'] = {'tag_id': self.object.pk}
         context['entityroles'] = self.object.entityrole_set.all()
+        # Tags imported without prettifying are indented for display only
+        context['swid_xml'] = utils.prettify_xml(self.object.swid_xml)
         return context
 
 
@@ -6,7 +6,7 @@ from apps.front.paging import ProducerFactory
 
 # PAGING PRODUCER
 
-tpm_device_producer_factory = ProducerFactory(Device, 'description__icontains')
+tpm_device_producer_factory = ProducerFactory(Device, 'description__substring')
 
 
 # PAGING CONFIGS
@@ -15,6 +15,8 @@ tpm_devices_list_paging = {
     'template_name': 'front/paging/default_list',
     'list_producer': tpm_device_producer_factory.list(),
     'stat_producer': tpm_device_producer_factory.stat(),
+    'page_producer': tpm_device_producer_factory.page(),
+    'count_models': (Device,),
     'static_producer_args': None,
     'var_name': 'object_list',
     'url_name': 'tpm:tpm_evidence',
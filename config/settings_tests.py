@@ -9,3 +9,8 @@ from .settings import *
 MIGRATION_MODULES = {
     'auth': None,
 }
+
+# Generate values for custom field types in model_bakery
+BAKER_CUSTOM_FIELDS_GEN = {
+    'apps.core.fields.CompressedTextField': 'model_bakery.random_gen.gen_text',
+}
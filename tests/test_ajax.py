@@ -1,18 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+import re
 import urllib
 import json
 import calendar
+import html
 from datetime import timedelta
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
 
 import pytest
 from model_bakery import baker
 
 from apps.core.models import Session
+from apps.front.ajax import PAGING_CONFIGS
+from apps.devices.models import Group
 from apps.filesystem.models import File, Directory
 
 
@@ -146,3 +154,161 @@ def test_files_autocomplete(get_completions, search_term, expected):
 def test_directory_autocomplete(get_completions, search_term, expected):
     results = get_completions(search_term, '/directories/autocomplete', 'directory')
     assert sorted(results) == sorted(expected)
+
+
+### Paging Tests ###
+
+def paging_request(client, config_name, current_page=0, filter_query='', producer_args=None, cursor=None):
+    payload = {
+        'config_name': config_name,
+        'current_page': current_page,
+        'filter_query': filter_query,
+        'pager_id': 0,
+        'producer_args': json.dumps(producer_args),
+    }
+    if cursor:
+        payload['cursor'] = cursor
+    return ajax_request(client, '/paging', payload)
+
+
+@pytest.fixture
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_paging_page_producer(client, transactional_db, clear_cache, monkeypatch):
+    Directory.objects.bulk_create([Directory(path='/dir%03d' % i) for i in range(60)])
+
+    def stat_producer(*args):
+        raise AssertionError('The page producer should be used')
+    monkeypatch.setitem(PAGING_CONFIGS['dir_list_config'], 'stat_producer', stat_producer)
+
+    data = paging_request(client, 'dir_list_config', current_page=1)
+    assert data['page_count'] == 2
+    assert data['html'].count('<tr>') == 10
+    assert paging_request(client, 'dir_list_config', filter_query='dir00')['page_count'] == 1
+    # Out of range pages count separately
+    assert paging_request(client, 'dir_list_config', current_page=5, filter_query='dir01')['page_count'] == 1
+
+
+def test_paging_page_producer_without_window(client, transactional_db, clear_cache, monkeypatch):
+    # E.g. MySQL 5.7, the count is a separate query unless the page is the last one
+    monkeypatch.setattr(connection.features, 'supports_over_clause', False)
+    Directory.objects.bulk_create([Directory(path='/dir%03d' % i) for i in range(60)])
+    with CaptureQueriesContext(connection) as queries:
+        data = paging_request(client, 'dir_list_config', current_page=1)
+    assert data['page_count'] == 2
+    assert data['html'].count('<tr>') == 10
+    assert not any('OVER' in query['sql'] for query in queries.captured_queries)
+    assert paging_request(client, 'dir_list_config', filter_query='dir00')['page_count'] == 1
+    assert paging_request(client, 'dir_list_config', current_page=5, filter_query='dir01')['page_count'] == 1
+
+
+def test_paging_count_cache(client, transactional_db, clear_cache):
+    Directory.objects.bulk_create([Directory(path='/dir%03d' % i) for i in range(50)])
+    assert paging_request(client, 'dir_list_config')['page_count'] == 1
+
+    # Bulk inserts do not invalidate the cached count
+    Directory.objects.bulk_create([Directory(path='/bulk%03d' % i) for i in range(50)])
+    assert paging_request(client, 'dir_list_config')['page_count'] == 1
+    assert paging_request(client, 'dir_list_config', filter_query='bulk')['page_count'] == 1
+
+    # Saving or deleting an object does
+    directory = Directory.objects.create(path='/new')
+    assert paging_request(client, 'dir_list_config')['page_count'] == 3
+    directory.delete()
+    assert paging_request(client, 'dir_list_config')['page_count'] == 2
+
+
+def test_paging_cursor(client, transactional_db, clear_cache):
+    Directory.objects.bulk_create([Directory(path='/dir%03d' % i) for i in range(130)])
+    offset_pages = [paging_request(client, 'dir_list_config', current_page=i)['html'] for i in range(3)]
+
+    # Walk forward and back again, passing the cursor of the page shown before
+    data = paging_request(client, 'dir_list_config')
+    for idx in [1, 2, 1, 0]:
+        with CaptureQueriesContext(connection) as queries:
+            data = paging_request(client, 'dir_list_config', current_page=idx, cursor=data['cursor'])
+        assert data['html'] == offset_pages[idx]
+        assert data['page_count'] == 3
+        assert not any('OFFSET' in query['sql'] for query in queries.captured_queries)
+
+    # Jumping to a page or changing the filter falls back to the offset
+    assert paging_request(client, 'dir_list_config', current_page=2, cursor=data['cursor'])['html'] == offset_pages[2]
+    data = paging_request(client, 'dir_list_config', current_page=1, filter_query='dir1', cursor=data['cursor'])
+    assert data['html'].count('<tr>') == 0
+    assert paging_request(client, 'dir_list_config', current_page=1, cursor='garbage')['html'] == offset_pages[1]
+
+
+
+def test_paging_cursor_file_list(client, transactional_db, clear_cache):
+    # Directories stored in reverse order, the list is ordered by path and not by id
+    dirs = [Directory.objects.create(path='/dir%d' % i) for i in reversed(range(3))]
+    File.objects.bulk_create([File(directory=d, name='file%02d' % i) for d in dirs for i in range(20)])
+    expected = ['/dir%d/file%02d' % (d, i) for d in range(3) for i in range(20)]
+
+    first = paging_request(client, 'file_list_config')
+    with CaptureQueriesContext(connection) as queries:
+        second = paging_request(client, 'file_list_config', current_page=1, cursor=first['cursor'])
+    assert not any('OFFSET' in query['sql'] for query in queries.captured_queries)
+    # Without a filter, the highlighting wraps empty spans around each character
+    text = re.sub(r'</?span[^>]*>', '', first['html'] + second['html'])
+    shown = re.findall(r'>([^<]+)</a>', html.unescape(text))
+    assert shown == expected
+    assert second['html'] == paging_request(client, 'file_list_config', current_page=1)['html']
+
+### Search Tests ###
+
+def test_search(client, files_and_directories_test_data, django_assert_max_num_queries):
+    Group.objects.bulk_create([Group(name='group%02d' % i) for i in range(15)])
+    User.objects.create_user(username='tester', password='tester')
+    client.login(username='tester', password='tester')
+
+    # One query per category, the file table is not touched without search term
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('front:search'))
+    assert not any('"files"' in query['sql'] for query in queries.captured_queries)
+    categories = {category['name']: category for category in response.context['categories']}
+    assert list(categories) == ['groups']
+    assert categories['groups']['count'] == 15
+    assert len(categories['groups']['results']) == 10
+    assert categories['groups']['more']
+
+    # One query per category and the lookup of the search tables
+    with django_assert_max_num_queries(8):
+        response = client.get(reverse('front:search'), {'q': 'usr'})
+    categories = {category['name']: category for category in response.context['categories']}
+    assert list(categories) == ['files']
+    assert categories['files']['count'] == 4
+    assert not categories['files']['more']
+
+
+def test_search_results(client, transactional_db):
+    Group.objects.bulk_create([Group(name='group%02d' % i) for i in range(15)])
+    data = ajax_request(client, '/search/results', {'category': 'groups', 'q': 'group', 'offset': 10})
+    assert data['html'].count('<li>') == 5
+    assert data['offset'] == 15
+    assert not data['more']
+
+    data = ajax_request(client, '/search/results', {'category': 'groups', 'q': '', 'offset': 0})
+    assert data['html'].count('<li>') == 10
+    assert data['more']
+
+    response = client.post('/search/results', {'category': 'files', 'q': ''},
+                           HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+    assert response.status_code == 400
+
+
+def test_search_without_window(client, transactional_db, monkeypatch):
+    monkeypatch.setattr(connection.features, 'supports_over_clause', False)
+    Group.objects.bulk_create([Group(name='group%02d' % i) for i in range(15)])
+    User.objects.create_user(username='tester', password='tester')
+    client.login(username='tester', password='tester')
+
+    response = client.get(reverse('front:search'), {'q': 'group'})
+    categories = {category['name']: category for category in response.context['categories']}
+    assert list(categories) == ['groups']
+    assert categories['groups']['count'] == 15
+    assert categories['groups']['more']
@@ -17,9 +17,10 @@ from rest_framework import status
 
 from .test_swid import swidtag  # NOQA
 from apps.authentication.permissions import GlobalPermission
+from apps.core import batching
 from apps.swid import utils
 from apps.swid.api_views import SwidMeasurementView
-from apps.swid.models import Tag
+from apps.swid.models import Event, SessionStats, Tag, TagEvent, TagStats
 from apps.core.models import Session
 
 
@@ -164,6 +165,30 @@ def test_swid_measurement_diff(api_client, session, swidtag, filename):
     assert response.status_code == status.HTTP_200_OK
     assert len(response.data) == 0
     assert session.tag_set.count() == 2
+    stats = SessionStats.objects.get(session=session)
+    assert (stats.tag_count, stats.new_tag_count) == (2, 2)
+
+
+@pytest.mark.parametrize('filename', [
+    'strongswan.short.swidtag',
+])
+def test_swid_measurement_temp_table(api_client, session, swidtag, filename, monkeypatch):
+    monkeypatch.setattr(batching, 'TEMP_TABLE_THRESHOLD', 1)
+    software_ids = [
+        'strongswan.org__debian_7.4-x86_64-cowsay-3.03+dfsg1-4',
+        'strongswan.org__debian_7.4-x86_64-strongswan-4.5.2-1.5+deb7u3',
+        'strongswan.org__debian_7.4-x86_64-bash-4.2+dfsg-0.1',
+    ]
+    data = {'data': software_ids}
+
+    response = api_client.post(reverse('session-swid-measurement', args=[session.id]), data, format='json')
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert response.data == [software_ids[0], software_ids[2]]
+
+    response = api_client.post(reverse('session-swid-measurement', args=[session.id]),
+                               {'data': software_ids[1:2]}, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    assert session.tag_set.count() == 1
 
 
 @pytest.mark.django_db
@@ -181,6 +206,95 @@ def test_diff_on_invalid_session(api_client, swidtag, filename):
     assert response.status_code == status.HTTP_404_NOT_FOUND
 
 
+def _swid_event(eid, software_id, action, timestamp='2014-06-01T12:00:00Z'):
+    return {'eid': eid, 'timestamp': timestamp, 'recordId': eid, 'sourceId': 1,
+            'action': action, 'softwareId': software_id}
+
+
+def test_swid_events(api_client, session):
+    tags = baker.make(Tag, _quantity=3)
+    url = reverse('session-swid-events', args=[session.id])
+
+    # Missing tags are reported once, in the order of the events
+    events = [_swid_event(1, 'missing-2', TagEvent.CREATION),
+              _swid_event(1, tags[0].software_id, TagEvent.CREATION),
+              _swid_event(2, 'missing-1', TagEvent.CREATION),
+              _swid_event(3, 'missing-2', TagEvent.DELETION)]
+    response = api_client.post(url, {'epoch': 1, 'events': events}, format='json')
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert response.data == ['missing-2', 'missing-1']
+    assert Event.objects.count() == 0
+
+    events = [_swid_event(1, tags[0].software_id, TagEvent.CREATION),
+              _swid_event(1, tags[1].software_id, TagEvent.CREATION),
+              _swid_event(2, tags[1].software_id, TagEvent.DELETION, '2014-06-02T12:00:00Z')]
+    for _ in range(2):
+        response = api_client.post(url, {'epoch': 1, 'events': events}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert Event.objects.count() == 2
+        assert TagEvent.objects.count() == 3
+
+    ev1 = Event.objects.get(eid=1)
+    ev2 = Event.objects.get(eid=2)
+    assert ev1.device == session.device
+    assert set(ev1.tags.all()) == set(tags[:2])
+
+    stats = TagStats.objects.get(tag=tags[0])
+    assert (stats.first_installed, stats.last_deleted) == (ev1, None)
+    stats = TagStats.objects.get(tag=tags[1])
+    assert (stats.first_installed, stats.last_deleted) == (ev1, ev2)
+    assert stats.first_seen == stats.last_seen == session
+
+    # Existing stats are updated by the last event of a tag
+    events = [_swid_event(3, tags[0].software_id, TagEvent.DELETION, '2014-06-03T12:00:00Z'),
+              _swid_event(4, tags[1].software_id, TagEvent.CREATION, '2014-06-04T12:00:00Z')]
+    response = api_client.post(url, {'epoch': 1, 'events': events}, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    stats = TagStats.objects.get(tag=tags[0])
+    assert (stats.first_installed, stats.last_deleted) == (ev1, Event.objects.get(eid=3))
+    stats = TagStats.objects.get(tag=tags[1])
+    assert (stats.first_installed, stats.last_deleted) == (ev1, None)
+    assert not TagStats.objects.filter(tag=tags[2]).exists()
+
+
+def test_swid_events_session_stats(api_client, session):
+    tags = baker.make(Tag, _quantity=2)
+    session.tag_set.add(tags[0])
+    utils.update_tag_stats(session, [tags[0].pk])
+    utils.update_session_stats(Session.objects.filter(pk=session.pk))
+
+    # Tags only reported in events are not counted as new tags of the session
+    url = reverse('session-swid-events', args=[session.id])
+    events = [_swid_event(1, tags[1].software_id, TagEvent.CREATION)]
+    response = api_client.post(url, {'epoch': 1, 'events': events}, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    assert TagStats.objects.get(tag=tags[1]).first_seen == session
+    stats = SessionStats.objects.get(session=session)
+    assert (stats.tag_count, stats.new_tag_count) == (1, 1)
+
+
+def test_swid_events_queries(api_client, session, django_assert_max_num_queries):
+    tags = baker.make(Tag, _quantity=50)
+    events = [_swid_event(i // 10, tag.software_id, TagEvent.CREATION) for i, tag in enumerate(tags)]
+    url = reverse('session-swid-events', args=[session.id])
+    with django_assert_max_num_queries(20):
+        response = api_client.post(url, {'epoch': 1, 'events': events}, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    assert Event.objects.count() == 5
+    assert TagEvent.objects.count() == 50
+    assert TagStats.objects.count() == 50
+
+
+
+def test_tag_list_queries(api_client, django_assert_num_queries):
+    results = list(utils.process_swid_tags(utils.read_swid_tags('tests/test_tags/multiple-swid-tags.txt')))
+    assert len(results) > 1
+    # The tags with their XML, the entity roles and the events, not per tag
+    with django_assert_num_queries(3):
+        response = api_client.get(reverse('tag-list'))
+    assert response.status_code == status.HTTP_200_OK
+    assert all('<SoftwareIdentity' in tag['swidXml'] for tag in response.json())
+
 @pytest.mark.django_db
 def test_add_single_tag(api_client):
     with open('tests/test_tags/strongswan.short.swidtag') as f:
@@ -158,6 +158,7 @@ def test_write_permission_enforced(client, strongtnc_users, url, method):
     ('/directories/autocomplete/', {'search_term': 'bash'}),
     ('/swid-inventory/stats', {'device_id': 1, 'date_from': '', 'date_to': ''}),
     ('/swid-log/stats', {'device_id': 1, 'date_from': '', 'date_to': ''}),
+    ('/search/results', {'category': 'files', 'q': 'bash', 'offset': 10}),
     ('/paging', {'template': '', 'list_producer': '', 'stat_producer': '', 'var_name': '',
         'url_name': '', 'current_page': '', 'page_size': '', 'filter_query': '', 'pager_id': ''}),
 ])
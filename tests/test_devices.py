@@ -4,15 +4,25 @@ Tests for `swid` app.
 """
 from __future__ import print_function, division, absolute_import, unicode_literals
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from calendar import timegm
+from io import StringIO
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
 from django.utils.timezone import get_current_timezone, utc
 
+import pytest
 from model_bakery import baker
 
-from apps.core.models import Session
-from apps.devices.models import Device
+from apps.core.models import Result, Session, WorkItem
+from apps.core.types import Action
+from apps.devices import latest_results
+from apps.devices.models import Device, Group, GroupClosure, LatestResult, PolicyPlanVersion
+from apps.policies.models import Enforcement, Policy
+from apps.policies.plans import create_work_items, get_policy_plan
 
 
 def test_get_sessions_in_range(transactional_db):
@@ -42,3 +52,217 @@ def test_get_sessions_in_range(transactional_db):
     assert len(s4) == 4
     s5 = d.get_sessions_in_range(unix_timestamp(dt3), unix_timestamp(dt4))
     assert len(s5) == 4
+
+
+def _closure_pairs():
+    return sorted(GroupClosure.objects.values_list('ancestor__name', 'descendant__name', 'depth'))
+
+
+def test_group_closure(transactional_db, django_assert_num_queries):
+    root = Group.objects.create(name='root')
+    a = Group.objects.create(name='a', parent=root)
+    b = Group.objects.create(name='b', parent=root)
+    a1 = Group.objects.create(name='a1', parent=a)
+    a11 = Group.objects.create(name='a11', parent=a1)
+
+    assert a11.get_parents() == [a1, a, root]
+    assert root.get_children() == [a, b, a1, a11]
+
+    device = baker.make(Device)
+    device.groups.add(a1, b)
+    with django_assert_num_queries(1):
+        assert device.get_group_set() == {root, a, b, a1}
+
+    # Move a subtree, unchanged parents keep the pairs
+    a1.parent = b
+    a1.save()
+    assert a11.get_parents() == [a1, b, root]
+    assert a.get_children() == []
+    with django_assert_num_queries(3):  # BEGIN, UPDATE and the parent lookup
+        a1.save()
+    pairs = _closure_pairs()
+    assert GroupClosure.rebuild() == len(pairs) == 12
+    assert _closure_pairs() == pairs
+
+    root.parent = a11
+    with pytest.raises(ValueError):
+        root.save()
+    assert Group.objects.get(pk=root.pk).parent is None
+
+    b.delete()
+    assert device.get_group_set() == set()
+    assert _closure_pairs() == [('a', 'a', 0), ('root', 'a', 1), ('root', 'root', 0)]
+
+
+def test_group_closure_without_save(transactional_db):
+    # Loading a fixture saves raw, children may come before their parents
+    child = Group(pk=2, name='child', parent_id=1)
+    with transaction.atomic():
+        Group.save_base(child, raw=True)
+        Group.save_base(Group(pk=1, name='parent'), raw=True)
+    assert _closure_pairs() == [('child', 'child', 0), ('parent', 'child', 1), ('parent', 'parent', 0)]
+    assert GroupClosure.is_complete()
+
+    # Groups inserted in SQL are covered by the command
+    Group.objects.bulk_create([Group(pk=3, name='sql', parent_id=2)])
+    assert not GroupClosure.is_complete()
+    out = StringIO()
+    call_command('rebuildgroupclosure', stdout=out)
+    assert out.getvalue() == 'Rebuilt the group closure with 6 pairs\n'
+    assert GroupClosure.is_complete()
+    assert Group.objects.get(pk=3).get_parents() == [child, Group.objects.get(pk=1)]
+
+
+def test_create_work_items(transactional_db, django_assert_num_queries):
+    root = Group.objects.create(name='root')
+    child = Group.objects.create(name='child', parent=root)
+    other = Group.objects.create(name='other')
+    device = baker.make(Device)
+    device.groups.add(child)
+
+    bash, usrbin, ports = baker.make(Policy, _quantity=3, argument='/bin', fail=3, noresult=0)
+    baker.make(Enforcement, group=root, policy=bash, max_age=100, fail=1)
+    strict = baker.make(Enforcement, group=child, policy=bash, max_age=10, fail=2)
+    baker.make(Enforcement, group=root, policy=usrbin, max_age=100)
+    baker.make(Enforcement, group=other, policy=ports, max_age=10)
+
+    # usrbin was measured recently and passed
+    old = baker.make(Session, device=device, time=timezone.now() - timedelta(seconds=50), identity__data='tester')
+    baker.make(Result, session=old, policy=usrbin, recommendation=Action.ALLOW)
+    baker.make(Result, session=old, policy=bash, recommendation=Action.ALLOW)
+
+    session = baker.make(Session, device=device, time=timezone.now(), identity__data='tester')
+    # The plan version, the enforcements, the latest results, BEGIN and the bulk insert
+    with django_assert_num_queries(5):
+        device.create_work_items(session)
+    items = list(WorkItem.objects.filter(session=session))
+    assert [item.enforcement for item in items] == [strict]
+    assert items[0].fail == 2
+    assert items[0].noresult == 0
+    assert items[0].type == bash.type
+
+    # The policy plan is cached until an enforcement changes
+    session = baker.make(Session, device=device, time=timezone.now(), identity__data='tester')
+    with django_assert_num_queries(4):
+        device.create_work_items(session)
+    strict.fail = 0
+    strict.save()
+    session = baker.make(Session, device=device, time=timezone.now(), identity__data='tester')
+    with django_assert_num_queries(5):
+        device.create_work_items(session)
+    assert WorkItem.objects.get(session=session).fail == 0
+    with pytest.raises(ValueError):
+        baker.make(Device).create_work_items(session)
+
+    # Also when the device joins another group
+    device.groups.add(other)
+    assert len(get_policy_plan(device)) == 3
+
+    # The version is stored in the database, for the caches of other processes
+    version = PolicyPlanVersion.objects.get().version
+    cache.clear()
+    other.name = 'renamed'
+    other.save()
+    assert PolicyPlanVersion.objects.get().version == version
+    other.parent = root
+    other.save()
+    assert PolicyPlanVersion.objects.get().version != version
+
+
+def test_create_work_items_batch(transactional_db, django_assert_num_queries):
+    root = Group.objects.create(name='root')
+    child = Group.objects.create(name='child', parent=root)
+    bash, usrbin = baker.make(Policy, _quantity=2, argument='/bin', fail=3, noresult=0)
+    on_root = baker.make(Enforcement, group=root, policy=bash, max_age=100)
+    on_child = baker.make(Enforcement, group=child, policy=usrbin, max_age=100)
+
+    devices = baker.make(Device, _quantity=3)
+    devices[0].groups.add(root)
+    devices[1].groups.add(child)
+    old = baker.make(Session, device=devices[1], time=timezone.now() - timedelta(seconds=50),
+                     identity__data='tester')
+    baker.make(Result, session=old, policy=bash, recommendation=Action.ALLOW)
+    baker.make(Result, session=old, policy=usrbin, recommendation=Action.BLOCK)
+
+    sessions = [baker.make(Session, device=device, time=timezone.now(), identity__data='tester')
+                for device in devices]
+    # The plan version, the plans, the latest results, BEGIN and the bulk insert
+    with django_assert_num_queries(5):
+        assert create_work_items(sessions) == 2
+    assert list(WorkItem.objects.filter(session=sessions[0]).values_list('enforcement', flat=True)) == \
+        [on_root.pk]
+    assert list(WorkItem.objects.filter(session=sessions[1]).values_list('enforcement', flat=True)) == \
+        [on_child.pk]
+
+    sessions.append(baker.make(Session, device=devices[0], time=timezone.now(), identity__data='tester'))
+    out = StringIO()
+    call_command('createworkitems', *[str(session.pk) for session in sessions[2:]], stdout=out)
+    assert out.getvalue() == 'Created 1 work items for 2 sessions\n'
+    assert WorkItem.objects.filter(session=sessions[3]).count() == 1
+
+
+def test_latest_results(transactional_db):
+    device = baker.make(Device)
+    bash, usrbin = baker.make(Policy, _quantity=2, argument='/bin', fail=3, noresult=0)
+    now = timezone.now().replace(microsecond=0)
+
+    def latest():
+        return sorted(LatestResult.objects.filter(device=device)
+                      .values_list('policy_id', 'session_id', 'time', 'recommendation'))
+
+    old = baker.make(Session, device=device, time=now - timedelta(hours=2), identity__data='tester')
+    new = baker.make(Session, device=device, time=now - timedelta(hours=1), identity__data='tester')
+    baker.make(Result, session=new, policy=bash, recommendation=Action.ALLOW)
+    # Results of older sessions are not the latest
+    baker.make(Result, session=old, policy=bash, recommendation=Action.BLOCK)
+    baker.make(Result, session=old, policy=usrbin, recommendation=Action.BLOCK)
+    assert latest() == sorted([(bash.pk, new.pk, now - timedelta(hours=1), Action.ALLOW),
+                               (usrbin.pk, old.pk, now - timedelta(hours=2), Action.BLOCK)])
+
+    enforcement = baker.make(Enforcement, policy=bash, max_age=3000)
+    assert device.is_due_for(enforcement)
+    enforcement.max_age = 4000
+    assert not device.is_due_for(enforcement)
+    assert [r.device for r in LatestResult.get_overdue(bash, 3000)] == [device]
+    assert list(LatestResult.get_overdue(bash, 4000)) == []
+
+    # Moving a session or deleting results falls back to the remaining ones
+    old.time = now
+    old.save()
+    assert latest() == sorted([(bash.pk, old.pk, now, Action.BLOCK), (usrbin.pk, old.pk, now, Action.BLOCK)])
+    Result.objects.filter(session=old, policy=bash).delete()
+    assert latest() == sorted([(bash.pk, new.pk, now - timedelta(hours=1), Action.ALLOW),
+                               (usrbin.pk, old.pk, now, Action.BLOCK)])
+    old.delete()
+    assert latest() == [(bash.pk, new.pk, now - timedelta(hours=1), Action.ALLOW)]
+
+    LatestResult.objects.all().delete()
+    out = StringIO()
+    call_command('setuplatestresults', '--rebuild', stdout=out)
+    assert out.getvalue() == 'Installed the latest result triggers, filled in 1 results\n'
+    assert latest() == [(bash.pk, new.pk, now - timedelta(hours=1), Action.ALLOW)]
+
+
+def test_latest_results_without_triggers(transactional_db, monkeypatch):
+    # E.g. on MySQL, the latest results are queried from the results
+    monkeypatch.setattr(latest_results, 'is_installed', lambda using: False)
+    group = Group.objects.create(name='root')
+    device = baker.make(Device)
+    device.groups.add(group)
+    bash, usrbin = baker.make(Policy, _quantity=2, argument='/bin', fail=3, noresult=0)
+    on_bash = baker.make(Enforcement, group=group, policy=bash, max_age=3000)
+    on_usrbin = baker.make(Enforcement, group=group, policy=usrbin, max_age=3000)
+
+    now = timezone.now()
+    old = baker.make(Session, device=device, time=now - timedelta(hours=2), identity__data='tester')
+    new = baker.make(Session, device=device, time=now - timedelta(minutes=10), identity__data='tester')
+    baker.make(Result, session=old, policy=bash, recommendation=Action.BLOCK)
+    baker.make(Result, session=new, policy=bash, recommendation=Action.ALLOW)
+    baker.make(Result, session=new, policy=usrbin, recommendation=Action.BLOCK)
+    LatestResult.objects.all().delete()
+
+    assert not device.is_due_for(on_bash)
+    assert device.is_due_for(on_usrbin)
+    session = baker.make(Session, device=device, time=now, identity__data='tester')
+    device.create_work_items(session)
+    assert [item.enforcement for item in WorkItem.objects.filter(session=session)] == [on_usrbin]
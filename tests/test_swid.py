@@ -4,21 +4,40 @@ Tests for `swid` app.
 """
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+import gzip
+import io
+import json
+import lzma
+import shutil
 from datetime import timedelta
-
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.db.models import BinaryField
+from django.db.models.functions import Cast
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.dateformat import format
 
 import pytest
+from lxml import etree
 from model_bakery import baker
 
+from apps.core import batching
+from apps.core.fields import CompressedTextField
 from apps.core.models import Session, WorkItem
 from apps.core.types import WorkItemType
-from apps.swid.models import Tag, EntityRole, Entity, TagStats
-from apps.filesystem.models import File, Directory
+from apps.swid.models import Tag, TagDiff, TagXml, EntityRole, Entity, TagStats
+from apps.filesystem.models import File, Directory, FileHash, Algorithm
 from apps.swid import utils
+from apps.front.paging import decode_cursor, encode_cursor
 from apps.swid.paging import swid_inventory_list_producer, swid_log_list_producer, \
-    swid_inventory_stat_producer
+    swid_inventory_stat_producer, swid_inventory_session_list_producer
+
+from .fixtures import *  # NOQA: Star import is OK here because it's just a test
 
 ### FIXTURES ###
 
@@ -115,8 +134,38 @@ def test_tag_entity_roles(swidtag, filename, tagroles):
 def test_tag_xml(swidtag, filename):
     with open('tests/test_tags/%s' % filename, 'r') as swid_file:
         swid_tag_xml = swid_file.read()
-        swid_tag_xml_pretty = utils.prettify_xml(swid_tag_xml)
-        assert swidtag.swid_xml == swid_tag_xml_pretty
+        assert swidtag.swid_xml == swid_tag_xml
+
+
+@pytest.mark.parametrize('filename', [
+    'strongswan.full.swidtag',
+    'strongswan-libcharon.full.swidtag',
+    'cowsay.short.swidtag',
+])
+def test_parse_swid_tag_raw(filename):
+    with open('tests/test_tags/%s' % filename, 'r') as f:
+        tag_xml = f.read()
+    pretty = utils.parse_swid_tag(tag_xml, prettify=True)
+    raw = utils.parse_swid_tag(tag_xml)
+    assert pretty.swid_xml == utils.prettify_xml(tag_xml)
+    assert raw.swid_xml == tag_xml
+    assert raw._replace(swid_xml=None) == pretty._replace(swid_xml=None)
+
+
+def test_tag_detail_prettifies_raw_xml(transactional_db, client, strongtnc_users):
+    with open('tests/test_tags/strongswan.full.swidtag', 'r') as f:
+        tag_xml = f.read()
+    compact_xml = etree.tostring(etree.fromstring(tag_xml.encode('utf-8'),
+                                                  etree.XMLParser(remove_blank_text=True)),
+                                 encoding='unicode')
+    tag, _ = utils.process_swid_tag(compact_xml)
+    assert tag.swid_xml == compact_xml
+
+    client.login(username='readonly-user', password='readonly')
+    response = client.get(reverse('swid:tag_detail', args=[tag.pk]))
+    assert response.status_code == 200
+    assert response.context['swid_xml'] == utils.prettify_xml(compact_xml)
+    assert response.context['swid_xml'].count('\n') > 1
 
 
 @pytest.mark.parametrize(['filename', 'directories', 'files', 'filecount'], [
@@ -147,6 +196,33 @@ def test_tag_files(swidtag, filename, directories, files, filecount):
     assert swidtag.files.count() == filecount
 
 
+@pytest.mark.parametrize('filename', [
+    'strongswan-libcharon.full.swidtag',
+])
+def test_tag_file_hashes(swidtag, filename):
+    assert swidtag.files.count() == 6
+    assert File.objects.get(name='libstrongswan-eap-md5.so').directory.path == '/usr/lib/ipsec/plugins'
+    assert File.objects.get(name='libcharon.so.0').directory.path == '/usr/lib/ipsec'
+    assert sorted(Algorithm.objects.values_list('name', flat=True)) == ['SHA256', 'SHA512']
+
+    hashes = FileHash.objects.filter(version=swidtag.version)
+    assert hashes.count() == 6
+    assert hashes.filter(algorithm__name='SHA512').count() == 1
+    assert hashes.filter(mutable=True).get().file.name == 'eap-md5.conf'
+    assert hashes.get(file__name='libstrongswan-eap-md5.so').hash == \
+        '5b8a3e61c7e5d3a5a9a0c3c7e4d86fb8af5d9c2a2a6f7f7c4c1c5b44e3d1a2b0'
+
+    # Importing the tag again must not create any new rows
+    with open('tests/test_tags/%s' % filename) as f:
+        tag, replaced = utils.process_swid_tag(f.read(), allow_tag_update=True)
+    assert replaced is False
+    assert tag.files.count() == 6
+    assert File.objects.count() == 6
+    assert Directory.objects.count() == 3
+    assert Algorithm.objects.count() == 2
+    assert FileHash.objects.count() == 6
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize('filename', [
     'strongswan.full.swidtag.notagcreator',
@@ -164,6 +240,194 @@ def test_invalid_tags(filename):
         assert len(Entity.objects.all()) == 0
 
 
+def test_process_multiple_tags(transactional_db):
+    tags_xml = []
+    for filename in ['strongswan.full.swidtag', 'invalid_tags/strongswan.full.swidtag.notagcreator',
+                     'cowsay.full.swidtag', 'strongswan.full.swidtag.replacement']:
+        with open('tests/test_tags/%s' % filename) as f:
+            tags_xml.append(f.read())
+
+    results = list(utils.process_swid_tags(tags_xml, allow_tag_update=True))
+    assert len(results) == 4
+
+    assert results[0].tag.package_name == 'strongswan'
+    assert results[0].replaced is False
+    assert results[0].error is None
+    assert results[1].tag is None
+    assert isinstance(results[1].error, ValueError)
+    assert results[2].tag.package_name == 'cowsay'
+    assert results[2].replaced is False
+    assert results[3].tag.pk == results[0].tag.pk
+    assert results[3].replaced is True
+
+    assert Tag.objects.count() == 2
+    assert Entity.objects.filter(regid='strongswan.org').count() == 1
+    assert results[3].tag.files.count() == 3
+
+
+def test_importswid_command(transactional_db):
+    out = StringIO()
+    call_command('importswid', 'tests/test_tags/multiple-swid-tags.txt', stdout=out)
+    assert Tag.objects.count() == 5
+    assert out.getvalue().count('Added') == 5
+
+    out = StringIO()
+    call_command('importswid', 'tests/test_tags/multiple-swid-tags.txt', stdout=out)
+    assert Tag.objects.count() == 5
+    assert out.getvalue().count('Unchanged') == 5
+
+
+def test_importswid_command_workers(transactional_db):
+    out = StringIO()
+    call_command('importswid', 'tests/test_tags/ubuntu_full_swid.txt', workers=3, stdout=out)
+    lines = out.getvalue().splitlines()
+    assert len(lines) == Tag.objects.count()
+
+    # Tags are stored in the order of the input file
+    with open('tests/test_tags/ubuntu_full_swid.txt') as f:
+        unique_ids = [utils.parse_swid_tag(line.strip()).unique_id for line in f]
+    assert [line.split(' ', 1)[1] for line in lines] == unique_ids
+
+
+@pytest.mark.parametrize('filename', ['strongswan.full.swidtag'])
+def test_swid_xml_compressed(swidtag, filename):
+    raw_xml = bytes(TagXml.objects.filter(pk=swidtag.xml_id)
+                    .annotate(raw_xml=Cast('xml', BinaryField()))
+                    .values_list('raw_xml', flat=True)[0])
+    assert CompressedTextField.is_compressed(raw_xml)
+    assert len(raw_xml) < len(swidtag.swid_xml)
+    assert Tag.objects.get(pk=swidtag.pk).swid_xml == swidtag.swid_xml
+
+
+@pytest.mark.parametrize('filename', ['strongswan.full.swidtag'])
+def test_swid_xml_stored_once(swidtag, filename, monkeypatch):
+    assert swidtag.xml.digest == TagXml.get_digest(swidtag.swid_xml)
+    # The digest does not depend on the indentation
+    assert swidtag.xml.digest == TagXml.get_digest(utils.prettify_xml(swidtag.swid_xml))
+    assert utils.parse_swid_tag(swidtag.swid_xml).digest == swidtag.xml.digest
+    assert utils.parse_swid_tag(swidtag.swid_xml, prettify=True).digest == swidtag.xml.digest
+
+    # The digest is computed while parsing, storing does not parse the XML again
+    monkeypatch.setattr(TagXml, 'get_digest', None)
+
+    # Re-importing the same tag keeps its XML
+    with open('tests/test_tags/strongswan.full.swidtag') as f:
+        tag, replaced = utils.process_swid_tag(f.read(), allow_tag_update=True)
+    assert not replaced
+    assert tag.xml_id == swidtag.xml_id
+    assert TagXml.objects.count() == 1
+
+    # Replaced XML is deleted
+    with open('tests/test_tags/strongswan.full.swidtag.replacement') as f:
+        tag, replaced = utils.process_swid_tag(f.read(), allow_tag_update=True)
+    assert replaced
+    assert tag.xml_id != swidtag.xml_id
+    assert list(TagXml.objects.values_list('pk', flat=True)) == [tag.xml_id]
+
+    # So is the XML of deleted tags
+    tag.delete()
+    assert TagXml.objects.count() == 0
+
+
+def _raw_tag_xml(tag):
+    return bytes(TagXml.objects.filter(pk=tag.xml_id)
+                 .annotate(raw_xml=Cast('xml', BinaryField()))
+                 .values_list('raw_xml', flat=True)[0])
+
+
+def test_compressswid_command(transactional_db):
+    call_command('importswid', 'tests/test_tags/multiple-swid-tags.txt', stdout=StringIO())
+    tags = list(Tag.objects.order_by('pk'))
+
+    # Store the XML of some tags uncompressed
+    with connection.cursor() as cursor:
+        for tag in tags[1:4]:
+            cursor.execute('UPDATE swid_tag_xml SET xml = %s WHERE id = %s',
+                           [tag.swid_xml.encode('utf-8'), tag.xml_id])
+    assert not CompressedTextField.is_compressed(_raw_tag_xml(tags[1]))
+    assert Tag.objects.get(pk=tags[1].pk).swid_xml == tags[1].swid_xml
+
+    out = StringIO()
+    call_command('compressswid', batch_size=2, stdout=out)
+    assert out.getvalue().splitlines()[-1] == 'Done, compressed 3 tags'
+    for tag in tags:
+        assert CompressedTextField.is_compressed(_raw_tag_xml(tag))
+        assert Tag.objects.get(pk=tag.pk).swid_xml == tag.swid_xml
+
+
+@pytest.mark.parametrize('compression', [None, gzip, lzma])
+def test_read_swid_tags(tmp_path, compression):
+    filenames = ['strongswan.full.swidtag', 'cowsay.full.swidtag', 'strongswan-libcharon.full.swidtag']
+    tags_xml = []
+    for filename in filenames:
+        with open('tests/test_tags/%s' % filename, 'rb') as f:
+            tags_xml.append(f.read())
+
+    # Concatenated tags spanning multiple lines, each with an XML declaration
+    path = str(tmp_path / 'tags')
+    with (compression or io).open(path, 'wb') as f:
+        f.write(b'\n'.join(tags_xml))
+
+    # The tags are split without parsing them, only the declarations are removed
+    tags = list(utils.read_swid_tags(path))
+    assert tags == [tag_xml.split(b'?>', 1)[1].strip() for tag_xml in tags_xml]
+
+
+def test_read_swid_tags_encodings(tmp_path, monkeypatch):
+    first = '<?xml version="1.0" encoding="ISO-8859-1"?>\n<SoftwareIdentity name="caf\xe9"/>\n' \
+        '<SoftwareIdentity name="tea"><!-- <?xml version="1.0"?> --></SoftwareIdentity>'
+    second = '\ufeff<?xml version="1.0" encoding="UTF-8"?><SoftwareIdentity name="\ufeffcaf\xe9"/>'
+    path = tmp_path / 'tags'
+    path.write_bytes(first.encode('latin-1') + b'\n' + second.encode('utf-8'))
+
+    # Small chunks split declarations, end tags and multi-byte characters
+    monkeypatch.setattr(utils.SwidTagStream, 'chunk_size', 7)
+    tags = list(utils.read_swid_tags(str(path)))
+    assert [etree.fromstring(t).get('name') for t in tags] == ['caf\xe9', 'tea', '\ufeffcaf\xe9']
+    assert tags[1] == b'<SoftwareIdentity name="tea"><!-- <?xml version="1.0"?> --></SoftwareIdentity>'
+
+
+def test_read_swid_tags_directory(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    shutil.copy('tests/test_tags/strongswan.full.swidtag', str(tmp_path / 'b.swidtag'))
+    shutil.copy('tests/test_tags/cowsay.full.swidtag', str(tmp_path / 'sub' / 'a.swidtag'))
+    shutil.copy('tests/test_tags/multiple-swid-tags.txt', str(tmp_path / 'c.txt'))
+    with open('tests/test_tags/strongswan-libcharon.full.swidtag', 'rb') as f:
+        with gzip.open(str(tmp_path / 'c.swidtag.gz'), 'wb') as gz:
+            gz.write(f.read())
+
+    tags = [utils.parse_swid_tag(t).package_name for t in utils.read_swid_tags(str(tmp_path))]
+    assert tags == ['strongswan', 'libcharon-extra-plugins', 'cowsay']
+
+
+def test_read_swid_tags_invalid(tmp_path):
+    path = tmp_path / 'tags'
+    path.write_text('<SoftwareIdentity name="foo"></Software')
+    tags = list(utils.read_swid_tags(str(path)))
+    assert tags == [b'<SoftwareIdentity name="foo"></Software']
+    with pytest.raises(ValueError, match='Invalid XML'):
+        utils.parse_swid_tag(tags[0])
+
+
+def test_importswid_command_invalid_encoding(transactional_db, tmp_path):
+    path = tmp_path / 'tags'
+    path.write_bytes(b'<?xml version="1.0" encoding="no-such-encoding"?><SoftwareIdentity name="foo"/>')
+    with pytest.raises(CommandError, match='Unknown encoding no-such-encoding'):
+        call_command('importswid', str(path), stdout=StringIO())
+
+
+def test_parse_swid_tags_errors(transactional_db):
+    with open('tests/test_tags/strongswan.full.swidtag') as f:
+        tag_xml = f.read()
+    tags_xml = [tag_xml, '<SoftwareIdentity name="foo"', tag_xml]
+    for workers in [1, 2]:
+        results = list(utils.parse_swid_tags(tags_xml, workers=workers, queue_size=1))
+        assert [r[0] is None for r in results] == [False, True, False]
+        assert isinstance(results[1][1], ValueError)
+        assert results[0][0].swid_xml == tag_xml
+    assert Tag.objects.count() == 0
+
+
 @pytest.mark.parametrize('value', ['distributor', 'licensor', 'tagCreator'])
 def test_valid_role(value):
     try:
@@ -208,6 +472,38 @@ def test_tag_replace_files(swidtag, filename):
     assert tag.files.count() == 3
 
 
+def _tag_file_rows(tag):
+    return dict(Tag.files.through.objects.filter(tag=tag).values_list('file_id', 'pk'))
+
+
+@pytest.mark.parametrize('filename', ['strongswan.full.swidtag'])
+def test_tag_replace_unchanged(swidtag, filename):
+    file_rows = _tag_file_rows(swidtag)
+    role_pks = set(swidtag.entityrole_set.values_list('pk', flat=True))
+
+    with open('tests/test_tags/%s' % filename) as f:
+        tag, replaced = utils.process_swid_tag(f.read(), allow_tag_update=True)
+
+    # Reported as unchanged, not as replaced
+    assert replaced is False
+    assert tag.pk == swidtag.pk
+    assert _tag_file_rows(tag) == file_rows
+    assert set(tag.entityrole_set.values_list('pk', flat=True)) == role_pks
+
+
+@pytest.mark.parametrize('filename', ['strongswan.full.swidtag'])
+def test_tag_replace_files_diff(swidtag, filename):
+    file_rows = _tag_file_rows(swidtag)
+
+    with open('tests/test_tags/strongswan.full.swidtag.replacement') as f:
+        tag, replaced = utils.process_swid_tag(f.read(), allow_tag_update=True)
+
+    # Rows of files contained in both versions of the tag are kept
+    new_file_rows = _tag_file_rows(tag)
+    assert len(new_file_rows) == 3
+    assert set(new_file_rows.items()) < set(file_rows.items())
+
+
 @pytest.mark.parametrize('filename', [
     'invalid_tags/strongswan.full.swidtag.duplicateregid',
 ])
@@ -317,18 +613,22 @@ def tags_and_sessions(transactional_db):
     # intital set: tag 1-4
     s1.tag_set.add(tag1, tag2, tag3, tag4)
     utils.update_tag_stats(s1, [1, 2, 3, 4])
+    utils.update_tag_diffs(s1)
 
     # s2, added: tag5;
     s2.tag_set.add(tag1, tag2, tag3, tag4, tag5)
     utils.update_tag_stats(s2, [1, 2, 3, 4, 5])
+    utils.update_tag_diffs(s2)
 
     # s3, removed: tag1;
     s3.tag_set.add(tag2, tag3, tag4, tag5)
     utils.update_tag_stats(s3, [2, 3, 4, 5])
+    utils.update_tag_diffs(s3)
 
     # s4 added: tag6, tag7; removed: tag2;
     s4.tag_set.add(tag3, tag4, tag5, tag6, tag7)
     utils.update_tag_stats(s4, [3, 4, 5, 6, 7])
+    utils.update_tag_diffs(s4)
 
     return {
         'now': now,
@@ -459,6 +759,121 @@ def test_swid_log(transactional_db, tags_and_sessions):
     assert len(data[s1]) == 4
 
 
+def _log_rows(page):
+    return [(session.pk, tag.pk, tag.added) for session, tags in page.items() for tag in tags]
+
+
+@pytest.mark.parametrize('filter_query', [None, 'tag'])
+def test_swid_log_cursor(transactional_db, tags_and_sessions, filter_query):
+    now = tags_and_sessions['now']
+    params = {
+        'device_id': 1,
+        'from_timestamp': int(format(now - timedelta(days=3), 'U')),
+        'to_timestamp': int(format(now + timedelta(days=4), 'U')),
+    }
+    size = 2
+    offset_pages = [_log_rows(swid_log_list_producer(i * size, (i + 1) * size, filter_query, params))
+                    for i in range(5)]
+    assert sum(len(rows) for rows in offset_pages) == 9
+
+    # Walk forward and back again, passing the keys of the page shown before
+    page = swid_log_list_producer(0, size, filter_query, params)
+    shown = 0
+    for idx in [1, 2, 3, 4, 3, 2, 1, 0]:
+        encoded = encode_cursor(shown, filter_query, params, page)
+        cursor = decode_cursor(encoded, filter_query, params)
+        with CaptureQueriesContext(connection) as queries:
+            page = swid_log_list_producer(idx * size, (idx + 1) * size, filter_query, params, cursor=cursor)
+        assert _log_rows(page) == offset_pages[idx]
+        assert not any('OFFSET' in query['sql'] for query in queries.captured_queries)
+        shown = idx
+
+    # A cursor of another filter is ignored
+    assert decode_cursor(encoded, 'other', params) is None
+
+
+def _tag_diff_rows(device_id):
+    return sorted(TagDiff.objects.filter(device_id=device_id).values_list('session_id', 'tag_id', 'added'))
+
+
+def test_rebuild_tag_diffs(transactional_db, tags_and_sessions):
+    incremental = _tag_diff_rows(1)
+    assert utils.rebuild_tag_diffs(1) == len(incremental) == 9
+    assert _tag_diff_rows(1) == incremental
+
+
+def test_update_tag_diffs_out_of_order(transactional_db, tags_and_sessions):
+    now = tags_and_sessions['now']
+    s1, s2, s3, s4 = tags_and_sessions['sessions']
+    # A measurement between s3 and s4 arrives late
+    late = baker.make(Session, identity__data='tester', time=now + timedelta(days=2, hours=1), device_id=1)
+    late.tag_set.add(*Tag.objects.filter(pk__in=[3, 4, 5, 6]))
+    utils.update_tag_diffs(late)
+
+    diffs = _tag_diff_rows(1)
+    assert [d for d in diffs if d[0] == late.pk] == [(late.pk, 2, False), (late.pk, 6, True)]
+    assert [d for d in diffs if d[0] == s4.pk] == [(s4.pk, 7, True)]
+    utils.rebuild_tag_diffs(1)
+    assert _tag_diff_rows(1) == diffs
+
+
+def test_update_tag_diffs_after_delete(transactional_db, tags_and_sessions):
+    s1, s2, s3, s4 = tags_and_sessions['sessions']
+    # The diff of s3 is relative to s1 afterwards
+    s2_pk = s2.pk
+    s2.delete()
+    diffs = _tag_diff_rows(1)
+    assert not [d for d in diffs if d[0] == s2_pk]
+    utils.rebuild_tag_diffs(1)
+    assert _tag_diff_rows(1) == diffs
+
+
+def test_swid_log_stats(transactional_db, tags_and_sessions, client, django_assert_max_num_queries):
+    now = tags_and_sessions['now']
+    User.objects.create_user(username='tester', password='tester')
+    client.login(username='tester', password='tester')
+    payload = {
+        'device_id': 1,
+        'from_timestamp': format(now - timedelta(days=3), 'U'),
+        'to_timestamp': format(now + timedelta(days=4), 'U'),
+    }
+    with django_assert_max_num_queries(3):
+        response = client.post(reverse('swid:tag_log_stats'), payload, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+    data = json.loads(response.content)
+    assert data['session_count'] == 4
+    assert (data['added_count'], data['removed_count']) == (7, 2)
+
+    payload['device_id'] = 2
+    response = client.post(reverse('swid:tag_log_stats'), payload, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+    assert json.loads(response.content)['session_count'] == 0
+
+
+def test_swid_inventory_session_list_producer(transactional_db, tags_and_sessions,
+                                              django_assert_num_queries):
+    now = tags_and_sessions['now']
+    s1, s2, s3, s4 = tags_and_sessions['sessions']
+    out = StringIO()
+    call_command('updateswidstats', stdout=out)
+    assert 'Updated the SWID stats of 4 sessions' in out.getvalue()
+
+    params = {
+        'device_id': 1,
+        'from_timestamp': int(format(now - timedelta(days=3), 'U')),
+        'to_timestamp': int(format(now + timedelta(days=4), 'U')),
+    }
+    with django_assert_num_queries(2):
+        sessions = list(swid_inventory_session_list_producer(0, 10, None, params))
+    counts = {s.pk: (s.tag_count, s.new_tag_count, s.has_tags) for s in sessions}
+    assert counts == {
+        s1.pk: (4, 4, True),
+        s2.pk: (5, 1, True),
+        s3.pk: (4, 0, True),
+        7: (0, 0, False),
+        s4.pk: (5, 2, True),
+        6: (0, 0, False),
+    }
+
+
 def test_get_installed_tags_with_time(transactional_db, tags_and_sessions):
     s1 = tags_and_sessions['sessions'][0]  # -3 days old
     s2 = tags_and_sessions['sessions'][1]  # -1 day old
@@ -527,3 +942,46 @@ def test_large_tagstats_update(transactional_db):
     tag_ids = range(2000)
     utils.update_tag_stats(s1, tag_ids)
     assert TagStats.objects.count() == 2000
+
+
+@pytest.mark.parametrize('measured', [range(10, 2000), range(500, 1500), range(1000, 2500)])
+def test_large_tagstats_update_existing(transactional_db, django_assert_max_num_queries, measured):
+    now = timezone.now()
+    s1 = baker.make(Session, id=1, time=now - timedelta(days=1), identity__data="tester", device__id=1)
+    s2 = baker.make(Session, id=2, time=now, identity__data="tester", device__id=1)
+    Tag.objects.bulk_create([Tag(id=n, unique_id='tag%i' % n, xml=baker.make(TagXml))
+                             for n in range(2500)])
+    utils.update_tag_stats(s1, range(2000))
+
+    # New stats are inserted in batches on SQLite
+    with django_assert_max_num_queries(8):
+        utils.update_tag_stats(s2, measured)
+
+    stats = TagStats.objects.filter(device_id=1)
+    assert set(stats.values_list('tag_id', flat=True)) == set(range(2000)) | set(measured)
+    assert set(stats.filter(last_seen=s2).values_list('tag_id', flat=True)) == set(measured)
+    assert set(stats.filter(first_seen=s2).values_list('tag_id', flat=True)) == set(measured) - set(range(2000))
+
+
+def test_software_id_hash(transactional_db):
+    tag = baker.make(Tag, software_id='strongswan.org__fedora_19-x86_64-strongswan-5.1.2-4.fc19')
+    tag.refresh_from_db()
+    assert tag.software_id_hash == Tag.hash_software_id(tag.software_id)
+    assert Tag.objects.with_software_id(tag.software_id).get() == tag
+
+    tag.software_id = 'strongswan.org__fedora_19-x86_64-strongswan-5.1.2-5.fc19'
+    tag.save()
+    tag.refresh_from_db()
+    assert tag.software_id_hash == Tag.hash_software_id(tag.software_id)
+
+
+@pytest.mark.parametrize('threshold', [1000, 1])
+def test_resolve_software_ids(transactional_db, monkeypatch, threshold):
+    monkeypatch.setattr(batching, 'TEMP_TABLE_THRESHOLD', threshold)
+    tags = baker.make(Tag, _quantity=2)
+    # Simulate a hash collision, the full Software ID must still be compared
+    Tag.objects.filter(pk=tags[1].pk).update(software_id_hash=Tag.hash_software_id('colliding'))
+
+    found, missing = utils.resolve_software_ids(['colliding', tags[0].software_id])
+    assert found == {tags[0].software_id: tags[0].pk}
+    assert missing == ['colliding']
@@ -1,6 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from model_bakery import baker
+
+from apps.core import batching, search
+from apps.devices.models import Device
+from apps.filesystem.models import Directory, File
 from apps.front.utils import timestamp_local_to_utc
 
 
@@ -8,3 +20,122 @@ def test_timestamp_local_to_utc():
     # Assuming this timezone is Europe/Zurich.
     # This can be parametrized if https://github.com/pelme/pytest_django/issues/93 is resolved.
     assert timestamp_local_to_utc(1000000000) == 1000007200
+
+
+@pytest.mark.parametrize('items, size, expected', [
+    ([], 2, []),
+    ([1, 2, 3, 4, 5], 2, [[1, 2], [3, 4], [5]]),
+    ([1, 2, 3], None, [[1, 2, 3]]),
+    ([], None, []),
+])
+def test_batches(items, size, expected):
+    assert batching.batches(items, size) == expected
+
+
+@pytest.mark.django_db
+def test_batch_size():
+    limit = batching.max_query_params()
+    if limit is None:
+        assert batching.batch_size() is None
+    else:
+        size = batching.batch_size()
+        assert 0 < size < limit
+        assert batching.batch_size(params_per_item=2) == size // 2
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('size', [None, 1, 3])
+def test_filter_in(size):
+    devices = baker.make(Device, _quantity=5)
+    ids = [d.pk for d in devices[1:]] + [0]
+    found = batching.filter_in(Device.objects.all(), 'id', ids, size)
+    assert sorted(d.pk for d in found) == sorted(d.pk for d in devices[1:])
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('temp_table', [False, True])
+def test_resolve(temp_table):
+    devices = baker.make(Device, _quantity=3)
+    values = ['missing2', devices[2].value, 'missing1', devices[0].value, 'missing2']
+    found, missing = batching.resolve(Device, 'value', values, temp_table=temp_table)
+    assert found == {devices[2].value: devices[2].pk, devices[0].value: devices[0].pk}
+    assert missing == ['missing2', 'missing1']
+
+
+@pytest.mark.django_db
+def test_substring_search():
+    assert search.search_table(File, 'name') in search.get_installed_tables()
+    directory = Directory.objects.create(path='/usr/bin')
+    File.objects.bulk_create([File(name=name, directory=directory) for name in ['bash', 'BASHBUG', 'zsh']])
+    File.objects.create(name='rebash', directory=directory)
+
+    def names(term):
+        return sorted(File.objects.filter(name__substring=term).values_list('name', flat=True))
+
+    with CaptureQueriesContext(connection) as queries:
+        assert names('ash') == ['BASHBUG', 'bash', 'rebash']
+    assert 'MATCH' in queries.captured_queries[0]['sql']
+    assert names('SHB') == ['BASHBUG']
+    assert names('sh') == ['BASHBUG', 'bash', 'rebash', 'zsh']
+    assert names('"a') == []
+
+    # The index follows updates and deletes
+    File.objects.filter(name='zsh').update(name='zshash')
+    File.objects.filter(name='bash').delete()
+    assert names('ash') == ['BASHBUG', 'rebash', 'zshash']
+    assert list(File.objects.filter(directory__path__substring='usr/b')) == list(File.objects.all())
+
+
+@pytest.mark.django_db
+def test_substring_search_without_index(monkeypatch, caplog):
+    # E.g. SQLite without the trigram tokenizer
+    def fail(cursor, connection, model, field_name, rebuild):
+        cursor.execute("CREATE VIRTUAL TABLE broken_search USING fts5(name, tokenize='missing')")
+    monkeypatch.setattr(search, '_install_fts_table', fail)
+    assert search.install(rebuild=True, fields=[(File, 'name')]) == 0
+    assert 'Could not install the search index of filesystem.File.name' in caplog.text
+
+    # Fields without index are searched with icontains
+    monkeypatch.setitem(search._installed_tables, connection.alias, set())
+    directory = Directory.objects.create(path='/usr/bin')
+    File.objects.create(name='BASHBUG', directory=directory)
+    with CaptureQueriesContext(connection) as queries:
+        assert list(File.objects.filter(name__substring='ash').values_list('name', flat=True)) == ['BASHBUG']
+    assert 'MATCH' not in queries.captured_queries[0]['sql']
+
+
+def test_substring_search_after_table_remake(transactional_db):
+    directory = Directory.objects.create(path='/usr/bin')
+    File.objects.create(name='bash', directory=directory)
+    assert search.install(fields=[(File, 'name')]) == 0
+
+    # Migrations on SQLite copy the table into a new one, dropping the triggers
+    with connection.schema_editor() as editor:
+        editor._remake_table(File)
+    File.objects.create(name='dash', directory=directory)
+    assert not File.objects.filter(name__substring='das').exists()
+
+    assert search.install(fields=[(File, 'name')]) == 1
+    assert list(File.objects.filter(name__substring='das').values_list('name', flat=True)) == ['dash']
+    File.objects.create(name='rbash', directory=directory)
+    assert sorted(File.objects.filter(name__substring='bas').values_list('name', flat=True)) == ['bash', 'rbash']
+    assert search.install(fields=[(File, 'name')]) == 0
+
+
+def test_setupsearch_drop(transactional_db):
+    out = StringIO()
+    call_command('setupsearch', drop=True, stdout=out)
+    assert out.getvalue() == 'Dropped %d search indexes\n' % len(search.SEARCH_FIELDS)
+    assert search.get_installed_tables() == set()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", ['%_search_%'])
+        assert cursor.fetchall() == []
+
+    # Fields without index are searched with icontains
+    File.objects.create(name='bash', directory=Directory.objects.create(path='/bin'))
+    assert File.objects.filter(name__substring='ash').count() == 1
+
+    out = StringIO()
+    call_command('setupsearch', stdout=out)
+    assert out.getvalue() == 'Installed %d search indexes\n' % len(search.SEARCH_FIELDS)
+    assert search.search_table(File, 'name') in search.get_installed_tables()